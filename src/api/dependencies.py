@@ -0,0 +1,12 @@
+from fastapi import Request
+
+from repository.elasticsearch_repository import ElasticSearchRepository
+from repository.mongo_repository import MongoRepository
+
+
+def get_mongo_repository(request: Request) -> MongoRepository:
+    return request.app.state.mongo_repository
+
+
+def get_elasticsearch_repository(request: Request) -> ElasticSearchRepository:
+    return request.app.state.elasticsearch_repository
@@ -0,0 +1,67 @@
+import time
+
+from utils.metrics import http_latency, http_requests, http_shed
+from utils.tracing import current_trace, get_tracer
+
+
+class MetricsMiddleware(object):
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        tracer = get_tracer()
+        trace = tracer.start(scope['method'], scope['path'])
+        token = current_trace.set(trace) if trace is not None else None
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started
+            # the matched route template keeps label cardinality bounded, unmatched paths share one label
+            route = scope.get('route')
+            route_path = route.path if route is not None else 'unmatched'
+            http_requests.inc(scope['method'], route_path, str(status_code))
+            http_latency.observe(scope['method'], route_path, value=duration)
+            if trace is not None:
+                current_trace.reset(token)
+                tracer.finish(trace, route_path, status_code, duration)
+
+
+class AdmissionControlMiddleware(object):
+    # past the limit a request is cheaper to refuse than to queue behind work that is already late,
+    # so the requests that are admitted keep their latency and nginx can retry the rest elsewhere
+    def __init__(self, app, max_concurrency: int, exempt_paths: tuple = ()):
+        self.app = app
+        self.max_concurrency = max_concurrency
+        self.exempt_paths = tuple(exempt_paths)
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith(self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        if self.in_flight >= self.max_concurrency:
+            http_shed.inc(scope['method'])
+            await send({'type': 'http.response.start', 'status': 503,
+                        'headers': [(b'retry-after', b'1'), (b'content-length', b'0')]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
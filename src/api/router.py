@@ -1,62 +1,110 @@
+import asyncio
+
 from bson import ObjectId
-from fastapi import APIRouter, status, Depends
-import os
-from pymemcache import HashClient
+from datetime import datetime
+from fastapi import APIRouter, status, Depends, Request
 from typing import Optional
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 
+from api.dependencies import get_mongo_repository, get_elasticsearch_repository
+from models.batch import BatchGetRequest
 from models.booking import Booking, UpdateBooking
 from models.client import Client, UpdateClient
 from models.room import Room, UpdateRoom
 from repository.mongo_repository import MongoRepository
-from repository.elasticsearch_repository import ElasticSearchRepository
-from repository.cache_repository import get_memcached_clients_client, get_memcached_rooms_client, get_memcached_bookings_client
+from repository.elasticsearch_repository import ElasticSearchRepository, InvalidCursorError, DEFAULT_PAGE_SIZE, \
+    index_in_background
+from repository.availability_repository import AvailabilityRepository, get_availability_repository
+from repository.search_indexer import search_indexer_enabled, get_search_indexer_stats
+from repository.cache_repository import TieredCache, SearchCache, get_clients_cache, get_rooms_cache, get_bookings_cache, \
+    get_cache_by_name, get_search_cache
+from utils.bulk_import import BulkImporter, IMPORT_MODELS, iter_lines
+from utils.date_utils import parse_datetime
+from utils.log import get_logger
+from utils.responses import FastJSONResponse, conditional_json_response
+from utils.tracing import get_tracer
 
 
 router = APIRouter()
+logger = get_logger('api')
+
+MAX_PAGE_SIZE = 1000
+MAX_GEOHASH_PRECISION = 12
+
+# clients and bookings are personal and change on payment, shared caches must not keep them
+PRIVATE_CACHE_CONTROL = 'private, no-cache'
+# a continuation page hands out a cursor pinned to a point in time that closes once its holder reaches the end,
+# so shared caches must not pass it on to other clients
+CURSOR_CACHE_CONTROL = PRIVATE_CACHE_CONTROL
+
+
+def public_cache_control(request: Request) -> str:
+    settings = request.app.state.settings
+    return (f'public, max-age={settings.http_cache_max_age}, '
+            f'stale-while-revalidate={settings.http_cache_stale_while_revalidate}')
+
+
+def is_valid_date_range(start_dt: datetime, end_dt: datetime) -> bool:
+    return parse_datetime(start_dt) < parse_datetime(end_dt)
+
+
+def is_valid_point(lat: float, lon: float) -> bool:
+    return -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+def is_valid_box(top: float, left: float, bottom: float, right: float) -> bool:
+    return is_valid_point(top, left) and is_valid_point(bottom, right) and top >= bottom
+
+
+async def batch_get_by_ids(ids: list, cache: TieredCache, load_many) -> tuple:
+    async def loader(missing_ids: list) -> dict:
+        return {entity.id: entity for entity in await load_many(missing_ids)}
+
+    found = await cache.get_many_or_load([id for id in ids if ObjectId.is_valid(id)], loader)
+    return [found[id] for id in ids if id in found], [id for id in ids if id not in found]
 
 
 @router.post("/clients")
 async def add_client(
     name: str,
-    repository: MongoRepository = Depends(MongoRepository.get_instance),
-    search: ElasticSearchRepository = Depends(ElasticSearchRepository.get_instance)
+    repository: MongoRepository = Depends(get_mongo_repository),
+    search: ElasticSearchRepository = Depends(get_elasticsearch_repository)
 ):
     client = UpdateClient(name=name)
-    existed_client = await repository.get_client_by_name(name)
-    if existed_client is not None:
-        print(f'Client with name {name} already exists', flush=True)
-        print(f'Existed_client {existed_client}', flush=True)
+    client_id = await repository.create_client(client)
+    if client_id is None:
+        logger.debug('Client with name %s already exists', name)
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
     
-    client_id = await repository.create_client(client)
-    await search.create_client(client_id, client)
+    if not search_indexer_enabled():
+        await search.create_client(client_id, client)
     return client_id
 
 
-@router.get("/clients/{client_id}", response_model=Client)
+@router.get("/clients/{client_id}", response_model=Client, response_class=FastJSONResponse)
 async def get_client_by_id(
-    client_id: str, 
-    repository: MongoRepository = Depends(MongoRepository.get_instance),
-    memcached_clients_client: HashClient = Depends(get_memcached_clients_client)
+    client_id: str,
+    request: Request,
+    repository: MongoRepository = Depends(get_mongo_repository),
+    clients_cache: TieredCache = Depends(get_clients_cache)
 ):
     if not ObjectId.is_valid(client_id):
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
 
-
-    client = memcached_clients_client.get(client_id)
-    if client is not None:
-        print('using cached client data', flush=True)
-        return client
-
-
-    client = await repository.get_client_by_id(client_id)
+    client = await clients_cache.get_or_load_json(client_id, lambda: repository.get_client_by_id(client_id))
     if client is None:
         return Response(status_code=status.HTTP_404_NOT_FOUND)
-    
-    memcached_clients_client.add(client_id, client, int(os.getenv('MEMCACHED_CLIENTS_EXPIRE')))
-    
-    return client
+    return conditional_json_response(request, client, PRIVATE_CACHE_CONTROL)
+
+
+@router.post("/clients:batchGet", response_class=FastJSONResponse)
+async def get_clients_by_ids(
+    request: BatchGetRequest,
+    repository: MongoRepository = Depends(get_mongo_repository),
+    clients_cache: TieredCache = Depends(get_clients_cache)
+):
+    clients, missing = await batch_get_by_ids(request.ids, clients_cache, repository.get_clients_by_ids)
+    return FastJSONResponse({"clients": clients, "missing": missing})
 
 
 @router.post("/rooms")
@@ -66,42 +114,51 @@ async def add_room(
     country: str,
     address: str,
     description: str,
-    repository: MongoRepository = Depends(MongoRepository.get_instance),
-    search: ElasticSearchRepository = Depends(ElasticSearchRepository.get_instance)
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    repository: MongoRepository = Depends(get_mongo_repository),
+    search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+    availability: AvailabilityRepository = Depends(get_availability_repository)
 ):
-    existed_room = await repository.get_room_by_name(name)
-    if existed_room is not None:
-        print(f'Room with name {name} already exists', flush=True)
-        print(f'Existed_client {existed_room}', flush=True)
+    if (lat is None) != (lon is None) or (lat is not None and not is_valid_point(lat, lon)):
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
-    
-    room = UpdateRoom(name=name, city=city, country=country, address=address, description=description)
+    room = UpdateRoom(name=name, city=city, country=country, address=address, description=description,
+                      lat=lat, lon=lon)
     room_id = await repository.create_room(room)
-    await search.create_room(room_id, room)
+    if room_id is None:
+        logger.debug('Room with name %s already exists', name)
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    
+    availability.add_room(room_id)
+    if not search_indexer_enabled():
+        await search.create_room(room_id, room)
     return room_id
 
 
-@router.get("/rooms/{room_id}", response_model=Room)
+@router.get("/rooms/{room_id}", response_model=Room, response_class=FastJSONResponse)
 async def get_room_by_id(
-    room_id: str, 
-    repository: MongoRepository = Depends(MongoRepository.get_instance),
-    memcached_rooms_client: HashClient = Depends(get_memcached_rooms_client),
+    room_id: str,
+    request: Request,
+    repository: MongoRepository = Depends(get_mongo_repository),
+    rooms_cache: TieredCache = Depends(get_rooms_cache),
 ):
     if not ObjectId.is_valid(room_id):
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
 
-    room = memcached_rooms_client.get(room_id)
-    if room is not None:
-        print('using cached room data', flush=True)
-        return room
-
-    room = await repository.get_room_by_id(room_id)
+    room = await rooms_cache.get_or_load_json(room_id, lambda: repository.get_room_by_id(room_id))
     if room is None:
         return Response(status_code=status.HTTP_404_NOT_FOUND)
-    
-    memcached_rooms_client.add(room_id, room, int(os.getenv('MEMCACHED_ROOMS_EXPIRE')))
-    
-    return room
+    return conditional_json_response(request, room, public_cache_control(request))
+
+
+@router.post("/rooms:batchGet", response_class=FastJSONResponse)
+async def get_rooms_by_ids(
+    request: BatchGetRequest,
+    repository: MongoRepository = Depends(get_mongo_repository),
+    rooms_cache: TieredCache = Depends(get_rooms_cache)
+):
+    rooms, missing = await batch_get_by_ids(request.ids, rooms_cache, repository.get_rooms_by_ids)
+    return FastJSONResponse({"rooms": rooms, "missing": missing})
 
 
 @router.post("/bookings/book_room")
@@ -109,111 +166,351 @@ async def book_room_by_id(
     client_id: str,
     room_id: str,
     is_paid: bool,
-    start_dt: str,
-    end_dt: str,
-    repository: MongoRepository = Depends(MongoRepository.get_instance),
-    search: ElasticSearchRepository = Depends(ElasticSearchRepository.get_instance)
+    start_dt: datetime,
+    end_dt: datetime,
+    repository: MongoRepository = Depends(get_mongo_repository),
+    search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+    availability: AvailabilityRepository = Depends(get_availability_repository),
+    clients_cache: TieredCache = Depends(get_clients_cache),
+    rooms_cache: TieredCache = Depends(get_rooms_cache)
 ):
     if not ObjectId.is_valid(client_id) or not ObjectId.is_valid(room_id):
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
-    
-    client = await repository.get_client_by_id(client_id)
+    if not is_valid_date_range(start_dt, end_dt):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    if not availability.is_room_free(room_id, start_dt, end_dt):
+        logger.debug('Room with id %s is already booked in this dates', room_id)
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    # a client or room created a moment ago may not have reached the secondaries yet
+    client, room = await asyncio.gather(
+        clients_cache.get_or_load(client_id, lambda: repository.get_client_by_id(client_id, primary=True),
+                                  primary=True),
+        rooms_cache.get_or_load(room_id, lambda: repository.get_room_by_id(room_id, primary=True), primary=True))
     if client is None:
-        print(f'Client with id {client_id} do not exist', flush=True)
+        logger.debug('Client with id %s do not exist', client_id)
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
-    
-    room = await repository.get_room_by_id(room_id)
     if room is None:
-        print(f'Room with id {room_id} do not exist', flush=True)
-        return Response(status_code=status.HTTP_400_BAD_REQUEST)
-        
-    if not await search.check_booking_dates(room_id, start_dt, end_dt):
-        print(f'Room with id {room_id} is already booked in this dates', flush=True)
+        logger.debug('Room with id %s do not exist', room_id)
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
     booking = UpdateBooking(client_id=client_id, room_id=room_id, is_paid=is_paid, start_dt=start_dt, end_dt=end_dt)
     booking_id = await repository.book_room(booking)
-    await search.create_booking(booking_id, booking)
+    if booking_id is None:
+        logger.debug('Room with id %s is already booked in this dates', room_id)
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    availability.add_booking(booking_id, room_id, start_dt, end_dt)
+    if not search_indexer_enabled():
+        index_in_background(search.create_booking(booking_id, booking), f'booking {booking_id}')
     return booking_id
 
 
-@router.post("/bookings/pay_booking")
+@router.post("/bookings/pay_booking", response_model=Booking, response_class=FastJSONResponse)
 async def pay_booking_by_id(
     booking_id: str,
-    repository: MongoRepository = Depends(MongoRepository.get_instance),
-    search: ElasticSearchRepository = Depends(ElasticSearchRepository.get_instance),
-    memcached_bookings_client: HashClient = Depends(get_memcached_bookings_client),
+    repository: MongoRepository = Depends(get_mongo_repository),
+    search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+    bookings_cache: TieredCache = Depends(get_bookings_cache),
 ):
     if not ObjectId.is_valid(booking_id):
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
-    
-    booking = await repository.get_booking_by_id(booking_id)
-    if booking is None:
-        print(f'Booking with id {booking_id} do not exist', flush=True)
-        return Response(status_code=status.HTTP_400_BAD_REQUEST)
-    
+
     paid_booking = await repository.pay_booking(booking_id)
     if paid_booking is None:
+        # only a rejected payment pays for the read that tells a missing booking from a paid one
+        if await repository.get_booking_by_id(booking_id, primary=True) is None:
+            logger.debug('Booking with id %s do not exist', booking_id)
+            return Response(status_code=status.HTTP_400_BAD_REQUEST)
+        logger.debug('Booking %s is already paid', booking_id)
         return Response(status_code=status.HTTP_404_NOT_FOUND)
-    
-    memcached_bookings_client.delete(booking_id)
-    memcached_bookings_client.add(booking_id, paid_booking, int(os.getenv('MEMCACHED_BOOKINGS_EXPIRE')))
-    return paid_booking
+
+    await bookings_cache.write_through(booking_id, paid_booking)
+    if not search_indexer_enabled():
+        index_in_background(search.pay_booking(booking_id), f'payment of booking {booking_id}')
+    return FastJSONResponse(paid_booking)
 
 
-@router.get("/bookings/{booking_id}", response_model=Booking)
+@router.get("/bookings/{booking_id}", response_model=Booking, response_class=FastJSONResponse)
 async def get_booking_by_id(
-    booking_id: str, 
-    repository: MongoRepository = Depends(MongoRepository.get_instance),
-    memcached_bookings_client: HashClient = Depends(get_memcached_bookings_client),
+    booking_id: str,
+    request: Request,
+    repository: MongoRepository = Depends(get_mongo_repository),
+    bookings_cache: TieredCache = Depends(get_bookings_cache),
 ):
     if not ObjectId.is_valid(booking_id):
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
 
-    booking = memcached_bookings_client.get(booking_id)
-    if booking is not None:
-        print('using cached booking data', flush=True)
-        return booking
-
-    booking = await repository.get_booking_by_id(booking_id)
+    booking = await bookings_cache.get_or_load_json(booking_id, lambda: repository.get_booking_by_id(booking_id))
     if booking is None:
         return Response(status_code=status.HTTP_404_NOT_FOUND)
-    
-    memcached_bookings_client.add(booking_id, booking, int(os.getenv('MEMCACHED_BOOKINGS_EXPIRE')))
-    
-    return booking
+    return conditional_json_response(request, booking, PRIVATE_CACHE_CONTROL)
 
 
-@router.get("/country/{country_name}")
-async def find_by_country(country_name: str,
-                                       search: ElasticSearchRepository = Depends(ElasticSearchRepository.get_instance)):
-    rooms = await search.find_by_country(country_name)
-    if rooms is None:
+@router.post("/bookings:batchGet", response_class=FastJSONResponse)
+async def get_bookings_by_ids(
+    request: BatchGetRequest,
+    repository: MongoRepository = Depends(get_mongo_repository),
+    bookings_cache: TieredCache = Depends(get_bookings_cache)
+):
+    bookings, missing = await batch_get_by_ids(request.ids, bookings_cache, repository.get_bookings_by_ids)
+    return FastJSONResponse({"bookings": bookings, "missing": missing})
+
+
+@router.get("/availability/rooms")
+async def find_available_rooms(
+    start_dt: datetime,
+    end_dt: datetime,
+    limit: int = 100,
+    offset: int = 0,
+    availability: AvailabilityRepository = Depends(get_availability_repository)
+):
+    if not is_valid_date_range(start_dt, end_dt):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    room_ids = availability.find_free_rooms(start_dt, end_dt)
+    return {"room_ids": room_ids[offset:offset + limit], "total": len(room_ids)}
+
+
+@router.get("/availability/rooms/{room_id}")
+async def check_room_availability(
+    room_id: str,
+    start_dt: datetime,
+    end_dt: datetime,
+    availability: AvailabilityRepository = Depends(get_availability_repository)
+):
+    if not ObjectId.is_valid(room_id) or not is_valid_date_range(start_dt, end_dt):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    # a room the index has never seen has no bookings, which must not read as free
+    if not availability.has_room(room_id):
         return Response(status_code=status.HTTP_404_NOT_FOUND)
-    return {"rooms": rooms}
+    return {"room_id": room_id, "available": availability.is_room_free(room_id, start_dt, end_dt)}
+
+
+@router.get("/availability/stats")
+async def get_availability_stats(availability: AvailabilityRepository = Depends(get_availability_repository)):
+    return availability.stats()
+
 
+async def rooms_to_ndjson(rooms):
+    async for room in rooms:
+        yield room.model_dump_json() + '\n'
 
-@router.get("/city/{city_name}")
+
+async def find_rooms_response(request: Request, search: ElasticSearchRepository, search_cache: SearchCache, field: str,
+                              value: str, size: int, cursor: Optional[str], stream: bool):
+    if size < 1 or size > MAX_PAGE_SIZE:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    if stream:
+        rooms = search.stream_rooms(search.room_field_query(field, value))
+        return StreamingResponse(rooms_to_ndjson(rooms), media_type='application/x-ndjson')
+
+    async def find_page():
+        rooms, next_cursor = await search.find_rooms_page(search.room_field_query(field, value), size, cursor)
+        return {"rooms": rooms, "next_cursor": next_cursor}
+
+    try:
+        if cursor is not None:
+            return conditional_json_response(request, await find_page(), CURSOR_CACHE_CONTROL)
+        page = await search_cache.get_or_search(search.room_index, field, {"value": value, "size": size}, find_page,
+                                                text_params=("value",))
+        return conditional_json_response(request, page, public_cache_control(request))
+    except InvalidCursorError:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+
+@router.get("/country/{country_name}", response_class=FastJSONResponse)
+async def find_by_country(country_name: str,
+                          request: Request,
+                          size: int = DEFAULT_PAGE_SIZE,
+                          cursor: Optional[str] = None,
+                          stream: bool = False,
+                          search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+                          search_cache: SearchCache = Depends(get_search_cache)):
+    return await find_rooms_response(request, search, search_cache, 'country', country_name, size, cursor, stream)
+
+
+@router.get("/city/{city_name}", response_class=FastJSONResponse)
 async def find_by_city(city_name: str,
-                                       search: ElasticSearchRepository = Depends(ElasticSearchRepository.get_instance)):
-    rooms = await search.find_by_city(city_name)
-    if rooms is None:
-        return Response(status_code=status.HTTP_404_NOT_FOUND)
-    return {"rooms": rooms}
+                       request: Request,
+                       size: int = DEFAULT_PAGE_SIZE,
+                       cursor: Optional[str] = None,
+                       stream: bool = False,
+                       search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+                       search_cache: SearchCache = Depends(get_search_cache)):
+    return await find_rooms_response(request, search, search_cache, 'city', city_name, size, cursor, stream)
 
 
-@router.get("/room_name/{room_name}")
+@router.get("/room_name/{room_name}", response_class=FastJSONResponse)
 async def find_by_name(room_name: str,
-                                       search: ElasticSearchRepository = Depends(ElasticSearchRepository.get_instance)):
-    rooms = await search.find_by_name(room_name)
-    if rooms is None:
-        return Response(status_code=status.HTTP_404_NOT_FOUND)
-    return {"rooms": rooms}
+                       request: Request,
+                       size: int = DEFAULT_PAGE_SIZE,
+                       cursor: Optional[str] = None,
+                       stream: bool = False,
+                       search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+                       search_cache: SearchCache = Depends(get_search_cache)):
+    return await find_rooms_response(request, search, search_cache, 'name', room_name, size, cursor, stream)
 
 
-@router.get("/address/{address}")
+@router.get("/address/{address}", response_class=FastJSONResponse)
 async def find_by_address(address: str,
-                                       search: ElasticSearchRepository = Depends(ElasticSearchRepository.get_instance)):
-    rooms = await search.find_by_address(address)
-    if rooms is None:
+                          request: Request,
+                          size: int = DEFAULT_PAGE_SIZE,
+                          cursor: Optional[str] = None,
+                          stream: bool = False,
+                          search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+                          search_cache: SearchCache = Depends(get_search_cache)):
+    return await find_rooms_response(request, search, search_cache, 'address', address, size, cursor, stream)
+
+
+@router.get("/search/rooms", response_class=FastJSONResponse)
+async def search_rooms(request: Request,
+                       q: Optional[str] = None,
+                       country: Optional[str] = None,
+                       city: Optional[str] = None,
+                       size: int = DEFAULT_PAGE_SIZE,
+                       cursor: Optional[str] = None,
+                       search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+                       search_cache: SearchCache = Depends(get_search_cache)):
+    if size < 1 or size > MAX_PAGE_SIZE:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    async def find_page():
+        return await search.search_rooms(text=q, country=country, city=city, size=size, cursor=cursor)
+
+    try:
+        if cursor is not None:
+            return conditional_json_response(request, await find_page(), CURSOR_CACHE_CONTROL)
+        page = await search_cache.get_or_search(search.room_index, 'search',
+                                                {"q": q, "country": country, "city": city, "size": size},
+                                                find_page, text_params=("q",))
+        return conditional_json_response(request, page, public_cache_control(request))
+    except InvalidCursorError:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+
+@router.get("/search/rooms/near", response_class=FastJSONResponse)
+async def find_rooms_near(request: Request,
+                          lat: float,
+                          lon: float,
+                          radius_km: float = 10.0,
+                          size: int = DEFAULT_PAGE_SIZE,
+                          cursor: Optional[str] = None,
+                          search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+                          search_cache: SearchCache = Depends(get_search_cache)):
+    if size < 1 or size > MAX_PAGE_SIZE or radius_km <= 0 or not is_valid_point(lat, lon):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    async def find_page():
+        return await search.find_rooms_near(lat, lon, radius_km, size=size, cursor=cursor)
+
+    try:
+        if cursor is not None:
+            return conditional_json_response(request, await find_page(), CURSOR_CACHE_CONTROL)
+        page = await search_cache.get_or_search(search.room_index, 'near',
+                                                {"lat": lat, "lon": lon, "radius_km": radius_km, "size": size},
+                                                find_page)
+        return conditional_json_response(request, page, public_cache_control(request))
+    except InvalidCursorError:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+
+@router.get("/search/rooms/box", response_class=FastJSONResponse)
+async def find_rooms_in_box(request: Request,
+                            top: float,
+                            left: float,
+                            bottom: float,
+                            right: float,
+                            lat: Optional[float] = None,
+                            lon: Optional[float] = None,
+                            size: int = DEFAULT_PAGE_SIZE,
+                            cursor: Optional[str] = None,
+                            search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+                            search_cache: SearchCache = Depends(get_search_cache)):
+    if size < 1 or size > MAX_PAGE_SIZE or not is_valid_box(top, left, bottom, right):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    if (lat is None) != (lon is None) or (lat is not None and not is_valid_point(lat, lon)):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    async def find_page():
+        return await search.find_rooms_in_box(top, left, bottom, right, lat=lat, lon=lon, size=size, cursor=cursor)
+
+    try:
+        if cursor is not None:
+            return conditional_json_response(request, await find_page(), CURSOR_CACHE_CONTROL)
+        page = await search_cache.get_or_search(search.room_index, 'box',
+                                                {"top": top, "left": left, "bottom": bottom, "right": right,
+                                                 "lat": lat, "lon": lon, "size": size},
+                                                find_page)
+        return conditional_json_response(request, page, public_cache_control(request))
+    except InvalidCursorError:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+
+@router.get("/search/rooms/clusters", response_class=FastJSONResponse)
+async def find_room_clusters(request: Request,
+                             top: float,
+                             left: float,
+                             bottom: float,
+                             right: float,
+                             precision: int = 5,
+                             search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+                             search_cache: SearchCache = Depends(get_search_cache)):
+    if precision < 1 or precision > MAX_GEOHASH_PRECISION or not is_valid_box(top, left, bottom, right):
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    async def find_clusters():
+        return {"clusters": await search.find_room_clusters(top, left, bottom, right, precision)}
+
+    clusters = await search_cache.get_or_search(search.room_index, 'clusters',
+                                                {"top": top, "left": left, "bottom": bottom, "right": right,
+                                                 "precision": precision},
+                                                find_clusters)
+    return conditional_json_response(request, clusters, public_cache_control(request))
+
+
+@router.post("/import/{entity}")
+async def bulk_import(
+    entity: str,
+    request: Request,
+    data_format: Optional[str] = None,
+    chunk_size: int = 1000,
+    concurrency: int = 4,
+    repository: MongoRepository = Depends(get_mongo_repository),
+    search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+    availability: AvailabilityRepository = Depends(get_availability_repository)
+):
+    if entity not in IMPORT_MODELS:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    if data_format is None:
+        data_format = 'csv' if 'csv' in request.headers.get('content-type', '') else 'ndjson'
+    if data_format not in ('ndjson', 'csv') or chunk_size < 1 or concurrency < 1:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    importer = BulkImporter(entity, repository, search, availability, chunk_size=chunk_size,
+                            concurrency=concurrency, index=not search_indexer_enabled())
+    return await importer.run(iter_lines(request.stream()), data_format)
+
+
+@router.get("/search/indexer")
+async def get_search_indexer_status():
+    return get_search_indexer_stats()
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    stats = {cache_name: get_cache_by_name(cache_name).stats() for cache_name in ['clients', 'rooms', 'bookings']}
+    stats['search'] = get_search_cache().stats()
+    return stats
+
+
+@router.get("/internal/traces")
+async def get_recent_traces(limit: int = 20):
+    return get_tracer().recent(limit)
+
+
+@router.post("/internal/cache/invalidate")
+async def invalidate_cache(cache_name: str, key: str):
+    cache = get_cache_by_name(cache_name)
+    if cache is None:
         return Response(status_code=status.HTTP_404_NOT_FOUND)
-    return {"rooms": rooms}
+    cache.invalidate_local(key)
+    return Response(status_code=status.HTTP_200_OK)
@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from bson import ObjectId
+from dotenv import load_dotenv
+
+from models.booking import UpdateBooking
+from repository.mongo_repository import MongoRepository, connect_and_init_mongo, close_mongo_connect
+from utils.date_utils import booking_nights, parse_datetime
+
+
+async def attempt(repository: MongoRepository, slots: asyncio.Semaphore, room_id: str, days: int) -> bool:
+    start = date(2030, 1, 1) + timedelta(days=random.randrange(days))
+    end = start + timedelta(days=random.randint(1, 5))
+    booking = UpdateBooking(client_id=str(ObjectId()), room_id=room_id, is_paid=False,
+                            start_dt=start.isoformat(), end_dt=end.isoformat())
+    async with slots:
+        return await repository.book_room(booking) is not None
+
+
+def count_overlaps(bookings: list) -> int:
+    # checked on the stored times rather than the ledger, so a ledger that disagrees with them shows up here
+    overlaps = 0
+    by_room = {}
+    for booking in bookings:
+        by_room.setdefault(booking['room_id'], []).append(
+            (parse_datetime(booking['start_dt']), parse_datetime(booking['end_dt'])))
+    for intervals in by_room.values():
+        latest_end = None
+        for start, end in sorted(intervals):
+            if latest_end is not None and start < latest_end:
+                overlaps += 1
+            latest_end = end if latest_end is None else max(latest_end, end)
+    return overlaps
+
+
+async def run(args) -> dict:
+    await connect_and_init_mongo()
+    repository = MongoRepository.get_instance()
+    room_id = str(ObjectId())
+    slots = asyncio.Semaphore(args.concurrency)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(attempt(repository, slots, room_id, args.days) for _ in range(args.attempts)))
+    elapsed = time.perf_counter() - started
+
+    bookings = [booking async for booking in repository._mongo_bookings_collection.find({'room_id': room_id})]
+    nights = [night for booking in bookings for night in booking_nights(booking['start_dt'], booking['end_dt'])]
+    ledger_nights = await repository._mongo_room_nights_collection.count_documents({'room_id': room_id})
+
+    await repository._mongo_bookings_collection.delete_many({'room_id': room_id})
+    await repository._mongo_room_nights_collection.delete_many({'room_id': room_id})
+    close_mongo_connect()
+
+    return {
+        'attempts': args.attempts,
+        'concurrency': args.concurrency,
+        'booked': sum(results),
+        'rejected': len(results) - sum(results),
+        'overlapping_bookings': count_overlaps(bookings),
+        'ledger_matches_bookings': ledger_nights == len(nights),
+        'elapsed_seconds': round(elapsed, 3),
+        'attempts_per_second': round(args.attempts / elapsed, 1),
+    }
+
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Concurrent booking attempts against one hot room')
+    parser.add_argument('--attempts', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--days', type=int, default=90)
+
+    report = asyncio.run(run(parser.parse_args()))
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report['overlapping_bookings'] or not report['ledger_matches_bookings'] else 0)
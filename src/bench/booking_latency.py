@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import random
+from datetime import datetime, timezone
+
+from fastapi import Depends, FastAPI, status
+from starlette.responses import Response
+
+from api.dependencies import get_elasticsearch_repository, get_mongo_repository
+from bench.load_test import LoadGenerator, Workload, add_arguments, bench_environment, describe, measure, \
+    write_report
+from models.booking import UpdateBooking
+from repository.availability_repository import AvailabilityRepository, get_availability_repository
+from repository.elasticsearch_repository import ElasticSearchRepository
+from repository.mongo_repository import MongoRepository
+
+
+def add_sequential_route(app: FastAPI):
+    # the booking path as it was: every check and the search write awaited one after another, straight from mongo
+    @app.post('/bench/book_room_sequential')
+    async def book_room_sequential(
+        client_id: str,
+        room_id: str,
+        is_paid: bool,
+        start_dt: datetime,
+        end_dt: datetime,
+        repository: MongoRepository = Depends(get_mongo_repository),
+        search: ElasticSearchRepository = Depends(get_elasticsearch_repository),
+        availability: AvailabilityRepository = Depends(get_availability_repository)
+    ):
+        if await repository.get_client_by_id(client_id) is None:
+            return Response(status_code=status.HTTP_400_BAD_REQUEST)
+        if await repository.get_room_by_id(room_id) is None:
+            return Response(status_code=status.HTTP_400_BAD_REQUEST)
+        if not availability.is_room_free(room_id, start_dt, end_dt):
+            return Response(status_code=status.HTTP_400_BAD_REQUEST)
+        booking = UpdateBooking(client_id=client_id, room_id=room_id, is_paid=is_paid, start_dt=start_dt,
+                                end_dt=end_dt)
+        booking_id = await repository.book_room(booking)
+        if booking_id is None:
+            return Response(status_code=status.HTTP_400_BAD_REQUEST)
+        availability.add_booking(booking_id, room_id, start_dt, end_dt)
+        await search.create_booking(booking_id, booking)
+        return booking_id
+
+
+class SequentialWorkload(Workload):
+    def book_room_sequential(self) -> tuple:
+        method, _, query, body = self.book_room()
+        return method, '/bench/book_room_sequential', query, body
+
+
+async def run(args) -> dict:
+    started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    report = {}
+    async with bench_environment(args, SequentialWorkload) as (app, workload, latencies):
+        add_sequential_route(app)
+        config = describe(args, workload, latencies)
+        for name, operation in [('sequential', 'book_room_sequential'), ('concurrent', 'book_room')]:
+            generator = LoadGenerator(app, workload, {operation: 1}, random.Random(args.seed))
+            report[name] = (await measure(generator, args))['endpoints'][operation]
+
+    return {
+        'benchmark': 'booking_latency',
+        'started_at': started_at,
+        'config': config,
+        **report,
+        'p50_speedup': round(report['sequential']['p50_ms'] / report['concurrent']['p50_ms'], 2),
+        'p99_speedup': round(report['sequential']['p99_ms'] / report['concurrent']['p99_ms'], 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end booking latency of the sequential and concurrent path')
+    add_arguments(parser)
+    parser.set_defaults(concurrency=8, duration=5.0)
+
+    args = parser.parse_args()
+    write_report(asyncio.run(run(args)), args.output)
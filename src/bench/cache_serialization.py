@@ -0,0 +1,88 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pydantic import BaseModel
+
+from models.booking import Booking
+from models.client import Client
+from models.room import Room
+from utils.cache_utils import BinarySerializer, JsonSerializer, msgpack
+
+
+class JsonModelSerializer(JsonSerializer):
+    # the old cache path: stdlib json and a model built from the decoded dict by the caller
+    def __init__(self, model: type):
+        self._model = model
+
+    def deserialize(self, key, value, flags):
+        return self._model.model_validate(super().deserialize(key, value, flags))
+
+
+def sample_values() -> dict:
+    rooms = [Room(id=str(ObjectId()), name=f'Sunny loft {i}', country='Portugal', city='Lisbon',
+                  address=f'Rua Augusta {i}, 1100-048 Lisboa',
+                  description='Bright two bedroom flat with a balcony over the old town, close to the river.')
+             for i in range(100)]
+    start_dt = datetime(2030, 1, 1)
+    return {
+        'client': Client(id=str(ObjectId()), name='Alice Example'),
+        'room': rooms[0],
+        'booking': Booking(id=str(ObjectId()), client_id=str(ObjectId()), room_id=rooms[0].id, is_paid=False,
+                           start_dt=start_dt, end_dt=start_dt + timedelta(days=3)),
+        'search_page': {'generation': 7, 'payload': {'rooms': [room.model_dump() for room in rooms],
+                                                     'next_cursor': 'eyJwaXRfaWQiOiAiLi4uIn0='}},
+    }
+
+
+def measure(serializer, value, iterations: int) -> dict:
+    data, flags = serializer.serialize('key', value)
+    data = data.encode() if isinstance(data, str) else data
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        serializer.serialize('key', value)
+    encode_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        serializer.deserialize('key', data, flags)
+    decode_seconds = time.perf_counter() - started
+
+    return {
+        'bytes': len(data),
+        'encode_us': round(encode_seconds / iterations * 1e6, 2),
+        'decode_us': round(decode_seconds / iterations * 1e6, 2),
+        'decoded_type': type(serializer.deserialize('key', data, flags)).__name__,
+    }
+
+
+def run(args) -> dict:
+    models = [Client, Room, Booking]
+    serializers = {
+        'json': JsonSerializer(),
+        'orjson': BinarySerializer(models, codec='orjson', compress_threshold=0),
+        'orjson_zlib': BinarySerializer(models, codec='orjson', compress_threshold=args.compress_threshold),
+    }
+    if msgpack is not None:
+        serializers['msgpack'] = BinarySerializer(models, codec='msgpack', compress_threshold=0)
+        serializers['msgpack_zlib'] = BinarySerializer(models, codec='msgpack',
+                                                       compress_threshold=args.compress_threshold)
+
+    report = {}
+    for name, value in sample_values().items():
+        report[name] = {serializer_name: measure(serializer, value, args.iterations)
+                        for serializer_name, serializer in serializers.items()}
+        if isinstance(value, BaseModel):
+            report[name]['json_model'] = measure(JsonModelSerializer(type(value)), value, args.iterations)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cache serializer size and encode/decode cost')
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--compress-threshold', type=int, default=1024)
+
+    print(json.dumps(run(parser.parse_args()), indent=2))
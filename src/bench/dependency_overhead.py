@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+from fastapi import Depends, FastAPI
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.responses import Response
+
+from api.dependencies import get_elasticsearch_repository, get_mongo_repository
+from bench.response_path import call
+from repository.elasticsearch_repository import ElasticSearchRepository
+from repository.mongo_repository import MongoRepository
+from utils.settings import get_settings
+
+
+class PerRequestMongoRepository(object):
+    # what every request used to pay: environment lookups and fresh database and collection handles
+    def __init__(self, mongo_client: AsyncIOMotorClient):
+        mongo_db = os.getenv('MONGO_DB')
+        self._clients = mongo_client.get_database(mongo_db).get_collection(os.getenv('MONGO_CLIENTS_COLLECTION'))
+        self._rooms = mongo_client.get_database(mongo_db).get_collection(os.getenv('MONGO_ROOMS_COLLECTION'))
+        self._bookings = mongo_client.get_database(mongo_db).get_collection(os.getenv('MONGO_BOOKINGS_COLLECTION'))
+        self._room_nights = mongo_client.get_database(mongo_db).get_collection(
+            os.getenv('MONGO_ROOM_NIGHTS_COLLECTION'))
+
+
+class PerRequestElasticSearchRepository(object):
+    def __init__(self):
+        self._index_client = os.getenv('ELASTICSEARCH_INDEX_CLIENT')
+        self._index_room = os.getenv('ELASTICSEARCH_INDEX_ROOM')
+        self._index_booking = os.getenv('ELASTICSEARCH_INDEX_BOOKING')
+
+
+def build_app() -> FastAPI:
+    settings = get_settings()
+    mongo_client = AsyncIOMotorClient(settings.mongo_uri, connect=False)
+
+    app = FastAPI()
+    app.state.settings = settings
+    app.state.mongo_repository = MongoRepository(mongo_client.get_database(settings.mongo_db), settings)
+    app.state.elasticsearch_repository = ElasticSearchRepository(settings)
+
+    def per_request_mongo() -> PerRequestMongoRepository:
+        return PerRequestMongoRepository(mongo_client)
+
+    @app.get('/per_request')
+    async def per_request(repository: PerRequestMongoRepository = Depends(per_request_mongo),
+                          search: PerRequestElasticSearchRepository = Depends(PerRequestElasticSearchRepository)):
+        return Response(b'ok')
+
+    @app.get('/app_state')
+    async def app_state(repository: MongoRepository = Depends(get_mongo_repository),
+                        search: ElasticSearchRepository = Depends(get_elasticsearch_repository)):
+        return Response(b'ok')
+
+    return app
+
+
+async def measure(app: FastAPI, path: str, requests: int, concurrency: int) -> dict:
+    await call(app, path)
+    started, cpu_started = time.perf_counter(), time.process_time()
+    for _ in range(requests // concurrency):
+        await asyncio.gather(*(call(app, path) for _ in range(concurrency)))
+    elapsed, cpu_seconds = time.perf_counter() - started, time.process_time() - cpu_started
+    served = requests // concurrency * concurrency
+    return {
+        'requests': served,
+        'rps': round(served / elapsed),
+        'cpu_us_per_request': round(cpu_seconds / served * 1e6, 1),
+    }
+
+
+async def run(args) -> dict:
+    app = build_app()
+    before = await measure(app, '/per_request', args.requests, args.concurrency)
+    after = await measure(app, '/app_state', args.requests, args.concurrency)
+    return {
+        'per_request': before,
+        'app_state': after,
+        'saved_cpu_us_per_request': round(before['cpu_us_per_request'] - after['cpu_us_per_request'], 1),
+    }
+
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Dependency resolution cost of per-request and shared repositories')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=200)
+
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
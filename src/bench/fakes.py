@@ -0,0 +1,929 @@
+import asyncio
+import copy
+import heapq
+import itertools
+import math
+import random
+import re
+import threading
+import time
+
+from bson import ObjectId
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+from elasticsearch import ApiError, BadRequestError, NotFoundError
+from pydantic_core import to_jsonable_python
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+
+def resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class PreciseTimer(object):
+    # epoll rounds asyncio.sleep up to whole milliseconds, so short delays are timed on one helper thread
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def sleep(self, delay: float) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='bench-timer', daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (time.perf_counter() + delay, next(self._counter), loop, future))
+            self._condition.notify()
+        return future
+
+    def _run(self):
+        with self._condition:
+            while True:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                remaining = self._heap[0][0] - time.perf_counter()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                _, _, loop, future = heapq.heappop(self._heap)
+                loop.call_soon_threadsafe(resolve, future)
+
+
+timer = PreciseTimer()
+
+
+class Latency(object):
+    # injected before every backend round trip, uniform in mean +- jitter
+    def __init__(self, mean_ms: float = 0.0, jitter: float = 0.0):
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+
+    def configure(self, mean_ms: float, jitter: float = 0.0):
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+
+    async def wait(self):
+        if self.mean_ms <= 0:
+            return
+        spread = self.mean_ms * self.jitter
+        await timer.sleep(max(random.uniform(self.mean_ms - spread, self.mean_ms + spread), 0.0) / 1000)
+
+    def describe(self) -> dict:
+        return {'mean_ms': self.mean_ms, 'jitter': self.jitter}
+
+
+def get_field(document: dict, path: str):
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def match_condition(value, condition) -> bool:
+    if not isinstance(condition, dict) or not condition or not all(key.startswith('$') for key in condition):
+        return value == condition
+    for operator, operand in condition.items():
+        if operator == '$in':
+            matched = value in operand
+        elif operator == '$nin':
+            matched = value not in operand
+        elif operator == '$eq':
+            matched = value == operand
+        elif operator == '$ne':
+            matched = value != operand
+        elif operator == '$exists':
+            matched = (value is not None) == bool(operand)
+        elif value is None:
+            matched = False
+        elif operator == '$lt':
+            matched = value < operand
+        elif operator == '$lte':
+            matched = value <= operand
+        elif operator == '$gt':
+            matched = value > operand
+        elif operator == '$gte':
+            matched = value >= operand
+        else:
+            raise NotImplementedError(f'Unsupported query operator {operator}')
+        if not matched:
+            return False
+    return True
+
+
+def matches(document: dict, query: dict) -> bool:
+    return all(match_condition(get_field(document, field), condition) for field, condition in query.items())
+
+
+def project(document: dict, projection: dict | None) -> dict:
+    if not projection:
+        return copy.copy(document)
+    fields = {field for field, include in projection.items() if include}
+    return {field: value for field, value in document.items() if field in fields or field == '_id'}
+
+
+def apply_update(document: dict, update: dict) -> dict:
+    updated = copy.copy(document)
+    for operator, fields in update.items():
+        for field, value in fields.items():
+            if operator == '$set':
+                updated[field] = value
+            elif operator == '$unset':
+                updated.pop(field, None)
+            elif operator == '$inc':
+                updated[field] = updated.get(field, 0) + value
+            else:
+                raise NotImplementedError(f'Unsupported update operator {operator}')
+    return updated
+
+
+class FakeCursor(object):
+    def __init__(self, collection: 'FakeCollection', query: dict, projection: dict | None):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._documents = None
+
+    async def _fetch(self) -> list:
+        if self._documents is None:
+            await self._collection.latency.wait()
+            self._documents = [project(document, self._projection)
+                               for document in self._collection.find_documents(self._query)]
+        return self._documents
+
+    async def to_list(self, length: int | None = None) -> list:
+        documents = await self._fetch()
+        return documents if length is None else documents[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in await self._fetch():
+            yield document
+
+
+class FakeCollection(object):
+    # the subset of AsyncIOMotorCollection the repositories use, with _id lookups kept O(1)
+    def __init__(self, database: 'FakeDatabase', name: str, latency: Latency):
+        self.database = database
+        self.name = name
+        self.latency = latency
+        self._documents = {}
+        self._unique = {}
+
+    def with_options(self, **kwargs) -> 'FakeCollection':
+        # a single in-memory node, every read preference lands on the same documents
+        return self
+
+    def find_documents(self, query: dict) -> list:
+        ids = query.get('_id')
+        if ids is not None and not isinstance(ids, dict):
+            candidates = [self._documents[ids]] if ids in self._documents else []
+        elif isinstance(ids, dict) and list(ids) == ['$in']:
+            candidates = [self._documents[id] for id in dict.fromkeys(ids['$in']) if id in self._documents]
+        else:
+            candidates = self._documents.values()
+        return [document for document in candidates if matches(document, query)]
+
+    @staticmethod
+    def _unique_key(document: dict, fields: tuple):
+        return tuple(document.get(field) for field in fields)
+
+    def _check_unique(self, document: dict, replacing=None):
+        if document['_id'] in self._documents and document['_id'] != replacing:
+            raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: _id_', 11000)
+        for (name, fields), owners in self._unique.items():
+            owner = owners.get(self._unique_key(document, fields))
+            if owner is not None and owner != document['_id']:
+                raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: {name}', 11000)
+
+    def _put(self, document: dict):
+        previous = self._documents.get(document['_id'])
+        for (_, fields), owners in self._unique.items():
+            if previous is not None:
+                owners.pop(self._unique_key(previous, fields), None)
+            owners[self._unique_key(document, fields)] = document['_id']
+        self._documents[document['_id']] = document
+
+    def _remove(self, document: dict):
+        del self._documents[document['_id']]
+        for (_, fields), owners in self._unique.items():
+            owners.pop(self._unique_key(document, fields), None)
+
+    def _insert(self, document: dict, session: 'FakeSession' = None):
+        document.setdefault('_id', ObjectId())
+        stored = copy.copy(document)
+        self._check_unique(stored)
+        self._put(stored)
+        if session is not None and session.in_transaction:
+            session.inserted.append((self, stored))
+        else:
+            self.database.publish('insert', self.name, stored)
+
+    async def create_indexes(self, indexes: list) -> list:
+        await self.latency.wait()
+        for index in indexes:
+            spec = index.document
+            if spec.get('unique'):
+                fields = tuple(spec['key'])
+                owners = {self._unique_key(document, fields): document['_id']
+                          for document in self._documents.values()}
+                self._unique[(spec['name'], fields)] = owners
+        return [index.document['name'] for index in indexes]
+
+    async def insert_one(self, document: dict, session: 'FakeSession' = None) -> InsertOneResult:
+        await self.latency.wait()
+        self._insert(document, session)
+        return InsertOneResult(document['_id'], True)
+
+    async def insert_many(self, documents: list, ordered: bool = True,
+                          session: 'FakeSession' = None) -> InsertManyResult:
+        await self.latency.wait()
+        errors = []
+        inserted = 0
+        for i, document in enumerate(documents):
+            try:
+                self._insert(document, session)
+                inserted += 1
+            except DuplicateKeyError as ex:
+                errors.append({'index': i, 'code': 11000, 'errmsg': str(ex)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'writeConcernErrors': [], 'nInserted': inserted,
+                                  'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []})
+        return InsertManyResult([document['_id'] for document in documents], True)
+
+    async def find_one(self, query: dict = None, projection: dict = None) -> dict | None:
+        await self.latency.wait()
+        found = self.find_documents(query or {})
+        return project(found[0], projection) if found else None
+
+    def find(self, query: dict = None, projection: dict = None) -> FakeCursor:
+        return FakeCursor(self, query or {}, projection)
+
+    async def count_documents(self, query: dict) -> int:
+        await self.latency.wait()
+        return len(self.find_documents(query))
+
+    async def _find_one_and_modify(self, operation: str, query: dict, modify, projection: dict | None,
+                                   return_document: bool) -> dict | None:
+        await self.latency.wait()
+        found = self.find_documents(query)
+        if not found:
+            return None
+        before = found[0]
+        after = modify(before)
+        after['_id'] = before['_id']
+        self._check_unique(after, replacing=before['_id'])
+        self._put(after)
+        self.database.publish(operation, self.name, after)
+        return project(after if return_document == ReturnDocument.AFTER else before, projection)
+
+    async def find_one_and_replace(self, query: dict, replacement: dict, projection: dict = None,
+                                   return_document: bool = ReturnDocument.BEFORE) -> dict | None:
+        return await self._find_one_and_modify('replace', query, lambda _: copy.copy(replacement), projection,
+                                               return_document)
+
+    async def find_one_and_update(self, query: dict, update: dict, projection: dict = None,
+                                  return_document: bool = ReturnDocument.BEFORE) -> dict | None:
+        return await self._find_one_and_modify('update', query, lambda document: apply_update(document, update),
+                                               projection, return_document)
+
+    async def update_one(self, query: dict, update: dict) -> UpdateResult:
+        updated = await self.find_one_and_update(query, update)
+        count = 0 if updated is None else 1
+        return UpdateResult({'n': count, 'nModified': count}, True)
+
+    async def delete_many(self, query: dict) -> DeleteResult:
+        await self.latency.wait()
+        found = self.find_documents(query)
+        for document in found:
+            self._remove(document)
+            self.database.publish('delete', self.name, document)
+        return DeleteResult({'n': len(found)}, True)
+
+
+class FakeChangeStream(object):
+    def __init__(self, database: 'FakeDatabase', pipeline: list, full_document: str | None):
+        self._database = database
+        self._match = {key: value for stage in pipeline for key, value in stage.get('$match', {}).items()}
+        self._full_document = full_document
+        self._queue = asyncio.Queue()
+
+    def push(self, change: dict):
+        if matches(change, self._match):
+            self._queue.put_nowait(change)
+
+    async def __aenter__(self):
+        self._database.streams.add(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._database.streams.discard(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        return await self._queue.get()
+
+
+class FakeDatabase(object):
+    def __init__(self, client: 'FakeMongoClient', name: str):
+        self.client = client
+        self.name = name
+        self.streams = set()
+        self._collections = {}
+
+    def get_collection(self, name: str) -> FakeCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = FakeCollection(self, name, self.client.latency)
+        return collection
+
+    async def command(self, name: str) -> dict:
+        await self.client.latency.wait()
+        if name != 'hello':
+            raise NotImplementedError(f'Unsupported command {name}')
+        hello = {'isWritablePrimary': True, 'maxWireVersion': 17}
+        if self.client.replica_set:
+            hello['setName'] = 'bench'
+        return hello
+
+    async def create_collection(self, name: str) -> FakeCollection:
+        await self.client.latency.wait()
+        return self.get_collection(name)
+
+    async def list_collection_names(self) -> list:
+        return list(self._collections)
+
+    def watch(self, pipeline: list = None, full_document: str = None, **kwargs) -> FakeChangeStream:
+        return FakeChangeStream(self, pipeline or [], full_document)
+
+    def publish(self, operation: str, collection: str, document: dict):
+        if not self.streams:
+            return
+        change = {'operationType': operation, 'ns': {'db': self.name, 'coll': collection},
+                  'documentKey': {'_id': document['_id']},
+                  'fullDocument': None if operation == 'delete' else copy.copy(document)}
+        for stream in list(self.streams):
+            stream.push(change)
+
+
+class FakeSession(object):
+    # a single in-memory node has nothing to isolate, a transaction only defers its change events until it
+    # commits and takes its inserts back if it aborts
+    def __init__(self, client: 'FakeMongoClient'):
+        self._client = client
+        self.in_transaction = False
+        self.inserted = []
+
+    async def __aenter__(self) -> 'FakeSession':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def with_transaction(self, callback):
+        if not self._client.replica_set:
+            raise OperationFailure('Transaction numbers are only allowed on a replica set member or mongos', 20)
+        self.in_transaction, self.inserted = True, []
+        try:
+            result = await callback(self)
+        except BaseException:
+            for collection, document in reversed(self.inserted):
+                collection._remove(document)
+            raise
+        else:
+            for collection, document in self.inserted:
+                collection.database.publish('insert', collection.name, document)
+            return result
+        finally:
+            self.in_transaction, self.inserted = False, []
+
+
+class FakeMongoClient(object):
+    def __init__(self, latency: Latency = None, replica_set: bool = True):
+        self.latency = latency or Latency()
+        self.replica_set = replica_set
+        self._databases = {}
+
+    def get_database(self, name: str) -> FakeDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = FakeDatabase(self, name)
+        return database
+
+    async def server_info(self) -> dict:
+        await self.latency.wait()
+        return {'version': 'in-memory'}
+
+    async def start_session(self) -> FakeSession:
+        return FakeSession(self)
+
+    async def list_database_names(self) -> list:
+        return [name for name, database in self._databases.items() if await database.list_collection_names()]
+
+    def close(self):
+        pass
+
+
+TOKEN = re.compile(r'\w+')
+
+
+def tokenize(value) -> list:
+    return TOKEN.findall(str(value).lower()) if value is not None else []
+
+
+def base_field(field: str) -> str:
+    # sub-fields like name._2gram or city.keyword are views of the same source value
+    return field.split('.', 1)[0]
+
+
+def range_matches(value, bounds: dict) -> bool:
+    if value is None:
+        return False
+    value = to_jsonable_python(value)
+    return all(match_condition(value, {f'${operator}': to_jsonable_python(bound)})
+               for operator, bound in bounds.items())
+
+
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+DISTANCE_UNITS_KM = {'km': 1.0, 'mi': 1.609344, 'm': 0.001}
+
+
+def geo_point(value) -> tuple | None:
+    if isinstance(value, dict) and value.get('lat') is not None and value.get('lon') is not None:
+        return float(value['lat']), float(value['lon'])
+    return None
+
+
+def distance_km(a: tuple, b: tuple) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def parse_distance_km(distance: str) -> float:
+    number, unit = re.fullmatch(r'([\d.]+)\s*(km|mi|m)', distance).groups()
+    return float(number) * DISTANCE_UNITS_KM[unit]
+
+
+def in_box(point: tuple, box: dict) -> bool:
+    top, left = box['top_left']['lat'], box['top_left']['lon']
+    bottom, right = box['bottom_right']['lat'], box['bottom_right']['lon']
+    lat, lon = point
+    inside_lon = left <= lon <= right if left <= right else lon >= left or lon <= right
+    return bottom <= lat <= top and inside_lon
+
+
+def geohash(point: tuple, precision: int) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    bits = []
+    for i in range(precision * 5):
+        value, bounds = (point[1], lon_range) if i % 2 == 0 else (point[0], lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        bits.append(value >= middle)
+        bounds[0 if value >= middle else 1] = middle
+    return ''.join(GEOHASH_ALPHABET[int(''.join('1' if bit else '0' for bit in bits[i:i + 5]), 2)]
+                   for i in range(0, len(bits), 5))
+
+
+def sort_fields(sort: list) -> list:
+    # (field, order, origin) where origin is the point a _geo_distance sort measures from
+    fields = []
+    for spec in sort:
+        (field, order), = spec.items() if isinstance(spec, dict) else ((spec, 'asc'),)
+        if field == '_geo_distance':
+            (geo_field, origin), = ((key, value) for key, value in order.items() if key not in ('order', 'unit'))
+            fields.append((base_field(geo_field), order.get('order', 'asc'), geo_point(origin)))
+            continue
+        fields.append((field, order['order'] if isinstance(order, dict) else order, None))
+    return fields
+
+
+def sort_key(hit: dict, fields: list) -> tuple:
+    # descending values are negated so plain tuple ordering works, which limits descending sorts to numbers
+    key = []
+    for field, order, origin in fields:
+        if field == '_score':
+            value = hit['_score']
+        elif field == '_shard_doc':
+            value = hit['_seq_no']
+        elif origin is not None:
+            point = geo_point(hit['_source'].get(field))
+            value = distance_km(origin, point) if point is not None else math.inf
+        else:
+            value = hit['_source'].get(base_field(field))
+        key.append(-value if order == 'desc' else value)
+    return tuple(key)
+
+
+def sort_values(key: tuple, fields: list) -> list:
+    return [-value if order == 'desc' else value for value, (_, order, _) in zip(key, fields)]
+
+
+class FakeResponse(object):
+    def __init__(self, body: dict):
+        self.body = body
+
+    def __getitem__(self, key):
+        return self.body[key]
+
+
+MAX_RESULT_WINDOW = 10000
+
+
+def api_error(error_class: type, status: int, message: str) -> ApiError:
+    meta = ApiResponseMeta(status=status, http_version='1.1', headers=HttpHeaders(), duration=0.0,
+                           node=NodeConfig('http', 'localhost', 9200))
+    return error_class(message, meta, {'error': message})
+
+
+def not_found(message: str) -> NotFoundError:
+    return api_error(NotFoundError, 404, message)
+
+
+class FakeIndex(object):
+    # queries are answered from token and keyword postings, so only documents that can match are touched
+    def __init__(self):
+        self.documents = {}
+        self._tokens = {}
+        self._values = {}
+        self._points = {}
+
+    def _postings(self, document: dict, add: bool):
+        for field, value in document['_source'].items():
+            point = geo_point(value)
+            if point is not None:
+                points = self._points.setdefault(field, {})
+                if add:
+                    points[document['_id']] = point
+                else:
+                    points.pop(document['_id'], None)
+            if isinstance(value, str):
+                for token in set(tokenize(value)):
+                    postings = self._tokens.setdefault(field, {}).setdefault(token, set())
+                    postings.add(document['_id']) if add else postings.discard(document['_id'])
+            if isinstance(value, (str, int, float, bool)):
+                postings = self._values.setdefault(field, {}).setdefault(value, set())
+                postings.add(document['_id']) if add else postings.discard(document['_id'])
+
+    def put(self, id: str, seq_no: int, source: dict):
+        previous = self.documents.get(id)
+        if previous is not None:
+            self._postings(previous, add=False)
+        self.documents[id] = {'_id': id, '_seq_no': seq_no, '_source': source}
+        self._postings(self.documents[id], add=True)
+
+    def _match(self, fields: list, text: str, prefix: bool) -> dict:
+        # a document scores the number of query tokens it contains in its best field,
+        # with bool_prefix the last token also matches as a prefix
+        query_tokens = tokenize(text)
+        exact = query_tokens[:-1] if prefix else query_tokens
+        scores = {}
+        for field in dict.fromkeys(base_field(field.split('^')[0]) for field in fields):
+            postings = self._tokens.get(field, {})
+            field_scores = {}
+            for token in exact:
+                for id in postings.get(token, ()):
+                    field_scores[id] = field_scores.get(id, 0.0) + 1
+            if prefix and query_tokens:
+                prefixed = set()
+                for token, ids in postings.items():
+                    if token.startswith(query_tokens[-1]):
+                        prefixed.update(ids)
+                for id in prefixed:
+                    field_scores[id] = field_scores.get(id, 0.0) + 1
+            for id, score in field_scores.items():
+                if score > scores.get(id, 0.0):
+                    scores[id] = score
+        return scores
+
+    def evaluate(self, query: dict) -> dict:
+        # returns the score of every matching document by id
+        (kind, body), = query.items()
+        if kind == 'match_all':
+            return dict.fromkeys(self.documents, 1.0)
+        if kind == 'bool':
+            scores = None
+            for clause in body.get('must', []):
+                clause_scores = self.evaluate(clause)
+                scores = clause_scores if scores is None else {id: score + clause_scores[id]
+                                                               for id, score in scores.items() if id in clause_scores}
+            for clause in body.get('filter', []):
+                clause_scores = self.evaluate(clause)
+                scores = clause_scores if scores is None else {id: score for id, score in scores.items()
+                                                               if id in clause_scores}
+            if scores is None:
+                scores = dict.fromkeys(self.documents, 0.0)
+            for clause in body.get('must_not', []):
+                for id in self.evaluate(clause):
+                    scores.pop(id, None)
+            return scores
+        if kind == 'match':
+            (field, text), = body.items()
+            return self._match([field], text['query'] if isinstance(text, dict) else text, prefix=False)
+        if kind == 'multi_match':
+            return self._match(body['fields'], body['query'], prefix=body.get('type') == 'bool_prefix')
+        if kind in ('term', 'terms'):
+            (field, values), = body.items()
+            if kind == 'term':
+                values = [values['value'] if isinstance(values, dict) else values]
+            postings = self._values.get(base_field(field), {})
+            return dict.fromkeys(set().union(*(postings.get(value, ()) for value in values)), 0.0)
+        if kind == 'range':
+            (field, bounds), = body.items()
+            return {id: 0.0 for id, document in self.documents.items()
+                    if range_matches(document['_source'].get(base_field(field)), bounds)}
+        if kind == 'geo_distance':
+            (field, origin), = ((key, value) for key, value in body.items() if key != 'distance')
+            radius_km, origin = parse_distance_km(body['distance']), geo_point(origin)
+            # a degree of latitude is never shorter than 110.5 km, far rows are dropped before the haversine
+            max_lat_delta = radius_km / 110.5
+            return {id: 0.0 for id, point in self._points.get(base_field(field), {}).items()
+                    if abs(point[0] - origin[0]) <= max_lat_delta and distance_km(origin, point) <= radius_km}
+        if kind == 'geo_bounding_box':
+            (field, box), = body.items()
+            return {id: 0.0 for id, point in self._points.get(base_field(field), {}).items() if in_box(point, box)}
+        raise NotImplementedError(f'Unsupported query {kind}')
+
+    def search(self, query: dict) -> list:
+        return [{'_id': id, '_score': score, '_seq_no': self.documents[id]['_seq_no'],
+                 '_source': self.documents[id]['_source']}
+                for id, score in self.evaluate(query).items()]
+
+
+class FakeIndices(object):
+    def __init__(self, client: 'FakeElasticsearch'):
+        self._client = client
+
+    async def exists(self, index: str) -> bool:
+        await self._client.latency.wait()
+        return index in self._client.indices_mappings
+
+    async def create(self, index: str, settings: dict = None, mappings: dict = None) -> dict:
+        await self._client.latency.wait()
+        self._client.indices_mappings[index] = mappings or {}
+        self._client.get_index(index)
+        return {'acknowledged': True, 'index': index}
+
+    async def put_mapping(self, index: str, **mappings) -> dict:
+        await self._client.latency.wait()
+        self._client.indices_mappings[index] = mappings
+        return {'acknowledged': True}
+
+    async def put_settings(self, index: str, settings: dict) -> dict:
+        await self._client.latency.wait()
+        return {'acknowledged': True}
+
+    async def refresh(self, index: str = None) -> dict:
+        return {'_shards': {}}
+
+
+class FakeElasticsearch(object):
+    # answers the repository's search shapes against in-memory indices, scoring by token overlap
+    def __init__(self, latency: Latency = None):
+        self.latency = latency or Latency()
+        self.indices = FakeIndices(self)
+        self.indices_mappings = {}
+        self._indices = {}
+        self._points_in_time = {}
+        self._seq_no = itertools.count()
+
+    def get_index(self, index: str) -> FakeIndex:
+        fake_index = self._indices.get(index)
+        if fake_index is None:
+            fake_index = self._indices[index] = FakeIndex()
+        return fake_index
+
+    def options(self, **kwargs) -> 'FakeElasticsearch':
+        return self
+
+    async def info(self) -> dict:
+        await self.latency.wait()
+        return {'version': {'number': 'in-memory'}}
+
+    async def close(self):
+        pass
+
+    def _store(self, index: str, id: str, document: dict) -> dict:
+        fake_index = self.get_index(index)
+        previous = fake_index.documents.get(id)
+        fake_index.put(id, previous['_seq_no'] if previous else next(self._seq_no), to_jsonable_python(document))
+        return {'_index': index, '_id': id, 'result': 'updated' if previous else 'created'}
+
+    def _get_source(self, index: str, id: str) -> dict:
+        current = self.get_index(index).documents.get(id)
+        if current is None:
+            raise not_found(f'document {id} missing from {index}')
+        return current['_source']
+
+    async def create(self, index: str, id: str, document: dict, **kwargs) -> FakeResponse:
+        await self.latency.wait()
+        return FakeResponse(self._store(index, id, document))
+
+    async def index(self, index: str, id: str, document: dict, **kwargs) -> FakeResponse:
+        await self.latency.wait()
+        return FakeResponse(self._store(index, id, document))
+
+    async def update(self, index: str, id: str, doc: dict = None, document: dict = None, **kwargs) -> FakeResponse:
+        await self.latency.wait()
+        source = self._get_source(index, id)
+        return FakeResponse(self._store(index, id, {**source, **to_jsonable_python(doc or document)}))
+
+    async def get(self, index: str, id: str, **kwargs) -> FakeResponse:
+        await self.latency.wait()
+        return FakeResponse({'_index': index, '_id': id, 'found': True, '_source': self._get_source(index, id)})
+
+    async def open_point_in_time(self, index: str, keep_alive: str, **kwargs) -> FakeResponse:
+        await self.latency.wait()
+        pit_id = str(ObjectId())
+        self._points_in_time[pit_id] = index
+        return FakeResponse({'id': pit_id})
+
+    async def close_point_in_time(self, id: str, **kwargs) -> FakeResponse:
+        await self.latency.wait()
+        return FakeResponse({'succeeded': self._points_in_time.pop(id, None) is not None})
+
+    @staticmethod
+    def _terms(hits: list, terms: dict) -> dict:
+        field = base_field(terms['field'])
+        counts = {}
+        for hit in hits:
+            value = hit['_source'].get(field)
+            if value is not None:
+                counts[value] = counts.get(value, 0) + 1
+        buckets = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:terms.get('size', 10)]
+        return {'buckets': [{'key': key, 'doc_count': count} for key, count in buckets]}
+
+    @staticmethod
+    def _geohash_grid(hits: list, grid: dict, sub_aggregations: dict) -> dict:
+        field = base_field(grid['field'])
+        cells = {}
+        for hit in hits:
+            point = geo_point(hit['_source'].get(field))
+            if point is not None:
+                cells.setdefault(geohash(point, grid.get('precision', 5)), []).append(point)
+        buckets = []
+        for key, points in sorted(cells.items(), key=lambda item: (-len(item[1]), item[0]))[:grid.get('size', 10000)]:
+            bucket = {'key': key, 'doc_count': len(points)}
+            for name, aggregation in sub_aggregations.items():
+                if 'geo_centroid' not in aggregation:
+                    raise NotImplementedError(f'Unsupported sub-aggregation {list(aggregation)}')
+                bucket[name] = {'location': {'lat': sum(lat for lat, _ in points) / len(points),
+                                             'lon': sum(lon for _, lon in points) / len(points)},
+                                'count': len(points)}
+            buckets.append(bucket)
+        return {'buckets': buckets}
+
+    @classmethod
+    def _aggregate(cls, hits: list, aggregations: dict) -> dict:
+        result = {}
+        for name, aggregation in aggregations.items():
+            if 'terms' in aggregation:
+                result[name] = cls._terms(hits, aggregation['terms'])
+            elif 'geohash_grid' in aggregation:
+                result[name] = cls._geohash_grid(hits, aggregation['geohash_grid'],
+                                                 aggregation.get('aggregations', {}))
+            else:
+                raise NotImplementedError(f'Unsupported aggregation {list(aggregation)}')
+        return result
+
+    async def search(self, index: str = None, query: dict = None, size: int = 10, pit: dict = None,
+                     sort: list = None, search_after: list = None, aggregations: dict = None, from_: int = 0,
+                     **kwargs) -> FakeResponse:
+        await self.latency.wait()
+        if from_ + size > MAX_RESULT_WINDOW:
+            raise api_error(BadRequestError, 400, f'Result window is too large, from + size must be less than or '
+                                                  f'equal to: [{MAX_RESULT_WINDOW}] but was [{from_ + size}]')
+        if pit is not None:
+            index = self._points_in_time.get(pit['id'])
+            if index is None:
+                raise not_found(f'point in time {pit["id"]} expired')
+
+        # ties keep index order, which is what _shard_doc and a search without a point in time both give
+        hits = sorted(self.get_index(index).search(query or {'match_all': {}}), key=lambda hit: hit['_seq_no'])
+        fields = sort_fields(sort or [{'_score': 'desc'}, {'_shard_doc': 'asc'}])
+        keyed = [(sort_key(hit, fields), hit) for hit in hits]
+
+        body = {'hits': {'total': {'value': len(hits), 'relation': 'eq'}}}
+        if aggregations:
+            body['aggregations'] = self._aggregate(hits, aggregations)
+        if search_after is not None:
+            # negating the descending values again turns the cursor back into a key
+            after = tuple(sort_values(tuple(search_after), fields))
+            keyed = [(key, hit) for key, hit in keyed if key > after]
+        page = heapq.nsmallest(from_ + size, keyed, key=lambda item: item[0])[from_:]
+        body['hits']['hits'] = [{'_index': index, '_id': hit['_id'], '_score': hit['_score'],
+                                 '_source': hit['_source'], 'sort': sort_values(key, fields)} for key, hit in page]
+        if pit is not None:
+            body['pit_id'] = pit['id']
+        return FakeResponse(body)
+
+
+class MemcachedServer(object):
+    # speaks the text protocol subset the cache client uses, latency is paid once per received chunk
+    def __init__(self, latency: Latency = None):
+        self.latency = latency or Latency()
+        self._items = {}
+        self._server = None
+        self.address = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.address = '%s:%d' % self._server.sockets[0].getsockname()[:2]
+        return self.address
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _lookup(self, key: bytes):
+        item = self._items.get(key)
+        if item is not None and item[2] and item[2] <= time.monotonic():
+            del self._items[key]
+            return None
+        return item
+
+    @staticmethod
+    def _expires_at(expire: int) -> float:
+        return time.monotonic() + expire if expire > 0 else 0.0
+
+    def _execute(self, parts: list, data: bytes | None) -> bytes:
+        command = parts[0]
+        if command in (b'get', b'gets'):
+            response = bytearray()
+            for key in parts[1:]:
+                item = self._lookup(key)
+                if item is not None:
+                    response += b'VALUE %s %d %d\r\n%s\r\n' % (key, item[0], len(item[1]), item[1])
+            return bytes(response + b'END\r\n')
+        if command in (b'set', b'add', b'replace'):
+            key, flags, expire = parts[1], int(parts[2]), int(parts[3])
+            exists = self._lookup(key) is not None
+            if (command == b'add' and exists) or (command == b'replace' and not exists):
+                return b'NOT_STORED\r\n'
+            self._items[key] = (flags, data, self._expires_at(expire))
+            return b'STORED\r\n'
+        if command in (b'incr', b'decr'):
+            item = self._lookup(parts[1])
+            if item is None:
+                return b'NOT_FOUND\r\n'
+            delta = int(parts[2]) if command == b'incr' else -int(parts[2])
+            value = str(max(int(item[1]) + delta, 0)).encode()
+            self._items[parts[1]] = (item[0], value, item[2])
+            return value + b'\r\n'
+        if command == b'delete':
+            return b'DELETED\r\n' if self._items.pop(parts[1], None) is not None else b'NOT_FOUND\r\n'
+        if command == b'flush_all':
+            self._items.clear()
+            return b'OK\r\n'
+        if command == b'version':
+            return b'VERSION in-memory\r\n'
+        return b'ERROR\r\n'
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        buffer = bytearray()
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    return
+                buffer += chunk
+                responses = bytearray()
+                while True:
+                    end = buffer.find(b'\r\n')
+                    if end < 0:
+                        break
+                    parts = bytes(buffer[:end]).split()
+                    data = None
+                    consumed = end + 2
+                    if parts and parts[0] in (b'set', b'add', b'replace'):
+                        size = int(parts[4])
+                        if len(buffer) < consumed + size + 2:
+                            break
+                        data = bytes(buffer[consumed:consumed + size])
+                        consumed += size + 2
+                    del buffer[:consumed]
+                    if parts:
+                        responses += self._execute(parts, data)
+                if responses:
+                    await self.latency.wait()
+                    writer.write(bytes(responses))
+                    await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
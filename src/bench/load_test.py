@@ -0,0 +1,460 @@
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from urllib.parse import urlencode
+
+from fastapi import FastAPI
+
+import utils.settings
+from bench.fakes import FakeElasticsearch, FakeMongoClient, Latency, MemcachedServer
+from models.booking import UpdateBooking
+from models.client import UpdateClient
+from models.room import UpdateRoom
+from repository import elasticsearch_repository, mongo_repository
+from utils.settings import Settings
+
+
+COUNTRIES = {
+    'Portugal': ['Lisbon', 'Porto', 'Faro'],
+    'Spain': ['Madrid', 'Barcelona', 'Valencia', 'Seville'],
+    'Italy': ['Rome', 'Milan', 'Florence', 'Naples'],
+    'France': ['Paris', 'Lyon', 'Nice'],
+}
+WORDS = ['sunny', 'cosy', 'quiet', 'bright', 'spacious', 'modern', 'rustic', 'central', 'garden', 'loft',
+         'studio', 'apartment', 'villa', 'cottage', 'terrace', 'balcony', 'harbour', 'old', 'town', 'view',
+         'beach', 'river', 'park', 'castle', 'market', 'station', 'cathedral', 'square', 'bridge', 'hill',
+         'penthouse', 'duplex', 'cabin', 'townhouse', 'farmhouse', 'bungalow', 'attic', 'courtyard', 'rooftop',
+         'pool', 'fireplace', 'library', 'vineyard', 'olive', 'lemon', 'pine', 'stone', 'brick', 'marble', 'oak',
+         'family', 'romantic', 'artist', 'design', 'heritage', 'boutique', 'charming', 'elegant', 'airy', 'calm']
+CITY_CENTRES = {
+    'Lisbon': (38.722, -9.139), 'Porto': (41.158, -8.629), 'Faro': (37.019, -7.930),
+    'Madrid': (40.417, -3.704), 'Barcelona': (41.387, 2.170), 'Valencia': (39.470, -0.377),
+    'Seville': (37.389, -5.984), 'Rome': (41.903, 12.496), 'Milan': (45.464, 9.190), 'Florence': (43.770, 11.256),
+    'Naples': (40.852, 14.268), 'Paris': (48.857, 2.352), 'Lyon': (45.764, 4.836), 'Nice': (43.710, 7.262),
+}
+CITY_SPREAD_DEGREES = 0.03
+FIRST_NIGHT = datetime(2030, 1, 1)
+
+MIXES = {
+    'read': {'get_room': 45, 'get_client': 10, 'get_booking': 15, 'batch_get_rooms': 10, 'search_city': 10,
+             'search_rooms': 10},
+    'search': {'search_city': 30, 'search_country': 15, 'search_name': 15, 'search_rooms': 35,
+               'get_room': 5},
+    'mixed': {'get_room': 30, 'get_client': 5, 'get_booking': 10, 'batch_get_rooms': 5, 'search_city': 15,
+              'search_rooms': 15, 'check_availability': 5, 'book_room': 10, 'pay_booking': 5},
+    'booking': {'book_room': 50, 'pay_booking': 20, 'check_availability': 15, 'get_booking': 15},
+    'geo': {'search_near': 40, 'search_box': 25, 'room_clusters': 25, 'get_room': 10},
+}
+
+
+def zipf_weights(count: int, skew: float) -> list:
+    # cumulative weights for rng.choices, skew 0 is uniform and ~1 makes a few keys hot like real traffic
+    return list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, count + 1)))
+
+
+class Workload(object):
+    def __init__(self, rng: random.Random, room_ids: list, client_ids: list, booking_ids: list, skew: float,
+                 days: int):
+        self._rng = rng
+        self._room_ids = room_ids
+        self._client_ids = client_ids
+        self._booking_ids = booking_ids
+        self._unpaid_ids = list(booking_ids)
+        self._days = days
+        self._room_weights = zipf_weights(len(room_ids), skew)
+        self._client_weights = zipf_weights(len(client_ids), skew)
+
+    def _room_id(self) -> str:
+        return self._rng.choices(self._room_ids, cum_weights=self._room_weights)[0]
+
+    def _client_id(self) -> str:
+        return self._rng.choices(self._client_ids, cum_weights=self._client_weights)[0]
+
+    def _dates(self) -> tuple:
+        start = FIRST_NIGHT + timedelta(days=self._rng.randrange(self._days))
+        return start.isoformat(), (start + timedelta(days=self._rng.randint(1, 7))).isoformat()
+
+    def get_room(self) -> tuple:
+        return 'GET', f'/airbnb/rooms/{self._room_id()}', {}, None
+
+    def get_client(self) -> tuple:
+        return 'GET', f'/airbnb/clients/{self._client_id()}', {}, None
+
+    def get_booking(self) -> tuple:
+        return 'GET', f'/airbnb/bookings/{self._rng.choice(self._booking_ids)}', {}, None
+
+    def batch_get_rooms(self) -> tuple:
+        return 'POST', '/airbnb/rooms:batchGet', {}, {'ids': [self._room_id() for _ in range(20)]}
+
+    def search_city(self) -> tuple:
+        city = self._rng.choice(self._rng.choice(list(COUNTRIES.values())))
+        return 'GET', f'/airbnb/city/{city}', {'size': 20}, None
+
+    def search_country(self) -> tuple:
+        return 'GET', f'/airbnb/country/{self._rng.choice(list(COUNTRIES))}', {'size': 20}, None
+
+    def search_name(self) -> tuple:
+        return 'GET', f'/airbnb/room_name/{self._rng.choice(WORDS)}', {'size': 20}, None
+
+    def search_rooms(self) -> tuple:
+        country = self._rng.choice(list(COUNTRIES))
+        query = {'q': ' '.join(self._rng.sample(WORDS, 2)), 'size': 20}
+        if self._rng.random() < 0.5:
+            query['country'] = country
+        return 'GET', '/airbnb/search/rooms', query, None
+
+    def _near_city(self) -> tuple:
+        lat, lon = CITY_CENTRES[self._rng.choice(list(CITY_CENTRES))]
+        return (round(self._rng.gauss(lat, CITY_SPREAD_DEGREES), 4),
+                round(self._rng.gauss(lon, CITY_SPREAD_DEGREES), 4))
+
+    def search_near(self) -> tuple:
+        lat, lon = self._near_city()
+        return 'GET', '/airbnb/search/rooms/near', {'lat': lat, 'lon': lon, 'radius_km': 2, 'size': 20}, None
+
+    def search_box(self) -> tuple:
+        lat, lon = self._near_city()
+        return 'GET', '/airbnb/search/rooms/box', {'top': lat + 0.02, 'left': lon - 0.03, 'bottom': lat - 0.02,
+                                                   'right': lon + 0.03, 'size': 20}, None
+
+    def room_clusters(self) -> tuple:
+        # a map of the whole region, like the first view of a map page
+        return 'GET', '/airbnb/search/rooms/clusters', {'top': 50, 'left': -10, 'bottom': 36, 'right': 15,
+                                                        'precision': self._rng.choice([3, 4, 5])}, None
+
+    def check_availability(self) -> tuple:
+        start_dt, end_dt = self._dates()
+        return 'GET', f'/airbnb/availability/rooms/{self._room_id()}', {'start_dt': start_dt, 'end_dt': end_dt}, None
+
+    def book_room(self) -> tuple:
+        start_dt, end_dt = self._dates()
+        return 'POST', '/airbnb/bookings/book_room', {'client_id': self._client_id(), 'room_id': self._room_id(),
+                                                      'is_paid': 'false', 'start_dt': start_dt,
+                                                      'end_dt': end_dt}, None
+
+    def take_unpaid(self, count: int) -> list:
+        count = min(count, len(self._unpaid_ids))
+        return [self._unpaid_ids.pop(self._rng.randrange(len(self._unpaid_ids))) for _ in range(count)]
+
+    def pay_booking(self) -> tuple:
+        if not self._unpaid_ids:
+            return self.get_booking()
+        return 'POST', '/airbnb/bookings/pay_booking', {'booking_id': self.take_unpaid(1)[0]}, None
+
+    def describe(self) -> dict:
+        return {'rooms': len(self._room_ids), 'clients': len(self._client_ids), 'bookings': len(self._booking_ids)}
+
+    def record(self, operation: str, status: int, body: bytes):
+        if operation == 'book_room' and status == 200:
+            booking_id = json.loads(body)
+            self._booking_ids.append(booking_id)
+            self._unpaid_ids.append(booking_id)
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def record(self, latency: float, status: int | None):
+        self.latencies.append(latency)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if status is None or status >= 500:
+            self.errors += 1
+
+    def merge(self, other: 'EndpointStats'):
+        self.latencies.extend(other.latencies)
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.errors += other.errors
+
+
+def percentile(values: list, percent: float) -> float:
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def summarize(stats: EndpointStats, elapsed: float) -> dict:
+    latencies = sorted(stats.latencies)
+    if not latencies:
+        return {'requests': 0}
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1),
+        'errors': stats.errors,
+        'status': dict(sorted(stats.statuses.items())),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+
+
+async def asgi_request(app: FastAPI, method: str, path: str, query: dict, body) -> tuple:
+    payload = json.dumps(body).encode() if body is not None else b''
+    headers = [(b'host', b'bench')]
+    if body is not None:
+        headers += [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'query_string': urlencode(query).encode(), 'root_path': '',
+             'headers': headers, 'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 8000)}
+    response = {'status': None, 'body': []}
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            # nothing else will arrive, park like a connection that stays open
+            await asyncio.Event().wait()
+        sent = True
+        return {'type': 'http.request', 'body': payload, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'].append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return response['status'], b''.join(response['body'])
+
+
+class LoadGenerator(object):
+    def __init__(self, app: FastAPI, workload: Workload, mix: dict, rng: random.Random):
+        self._app = app
+        self._workload = workload
+        self._operations = list(mix)
+        self._weights = list(itertools.accumulate(mix.values()))
+        self._rng = rng
+        self.stats = {}
+        self.recording = False
+
+    async def issue(self, scheduled: float | None = None):
+        operation = self._rng.choices(self._operations, cum_weights=self._weights)[0]
+        method, path, query, body = getattr(self._workload, operation)()
+        started = time.perf_counter() if scheduled is None else scheduled
+        try:
+            status, response = await asgi_request(self._app, method, path, query, body)
+            self._workload.record(operation, status, response)
+        except Exception:
+            status = None
+        if self.recording:
+            self.stats.setdefault(operation, EndpointStats()).record(time.perf_counter() - started, status)
+
+    async def closed_loop(self, concurrency: int, duration: float):
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                await self.issue()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def open_loop(self, rate: float, duration: float):
+        # latency is measured from the intended start so a stalled server cannot hide its queueing delay
+        started = time.perf_counter()
+        tasks = set()
+        for i in range(int(rate * duration)):
+            scheduled = started + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(self.issue(scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def run(self, duration: float, concurrency: int, rate: float | None):
+        if rate:
+            await self.open_loop(rate, duration)
+        else:
+            await self.closed_loop(concurrency, duration)
+
+
+def parse_mix(value: str) -> dict:
+    if value in MIXES:
+        return MIXES[value]
+    mix = {}
+    for part in value.split(','):
+        operation, _, weight = part.partition('=')
+        if not hasattr(Workload, operation.strip()) or operation.strip() == 'record':
+            raise argparse.ArgumentTypeError(f'unknown operation {operation.strip()}')
+        mix[operation.strip()] = float(weight or 1)
+    return mix
+
+
+def bench_settings(memcached_uris: list, args) -> Settings:
+    return Settings(
+        mongo_uri='mongodb://in-memory', mongo_db='bench', mongo_clients_collection='clients',
+        mongo_rooms_collection='rooms', mongo_bookings_collection='bookings',
+        elasticsearch_uri='http://in-memory:9200', elasticsearch_index_client='clients',
+        elasticsearch_index_room='rooms', elasticsearch_index_booking='bookings',
+        memcached_clients_uri=memcached_uris[0], memcached_rooms_uri=memcached_uris[1],
+        memcached_bookings_uri=memcached_uris[2], metrics_enabled=not args.no_metrics,
+        log_level='WARNING', trace_sample_rate=0.0, admission_max_concurrency=args.admission_limit,
+    )
+
+
+async def seed(app: FastAPI, rng: random.Random, args) -> tuple:
+    repository = app.state.mongo_repository
+    search = app.state.elasticsearch_repository
+
+    client_ids = []
+    for i in range(args.clients):
+        client = UpdateClient(name=f'client-{i}')
+        client_ids.append(await repository.create_client(client))
+        await search.create_client(client_ids[-1], client)
+
+    room_ids = []
+    for i in range(args.rooms):
+        country = rng.choice(list(COUNTRIES))
+        city = rng.choice(COUNTRIES[country])
+        lat, lon = CITY_CENTRES[city]
+        room = UpdateRoom(name=f'{" ".join(rng.sample(WORDS, 3))} {i}', country=country, city=city,
+                          address=f'{rng.randint(1, 200)} {rng.choice(WORDS)} street, {city}',
+                          description=' '.join(rng.sample(WORDS, 6)),
+                          lat=rng.gauss(lat, CITY_SPREAD_DEGREES), lon=rng.gauss(lon, CITY_SPREAD_DEGREES))
+        room_ids.append(await repository.create_room(room))
+        await search.create_room(room_ids[-1], room)
+
+    booking_ids = []
+    for _ in range(args.bookings):
+        start = FIRST_NIGHT + timedelta(days=rng.randrange(args.days))
+        booking = UpdateBooking(client_id=rng.choice(client_ids), room_id=rng.choice(room_ids), is_paid=False,
+                                start_dt=start, end_dt=start + timedelta(days=rng.randint(1, 7)))
+        booking_id = await repository.book_room(booking)
+        if booking_id is not None:
+            booking_ids.append(booking_id)
+            await search.create_booking(booking_id, booking)
+    return room_ids, client_ids, booking_ids
+
+
+@contextlib.asynccontextmanager
+async def bench_environment(args, workload_class: type = Workload):
+    # starts the real app on top of the fakes, seeds it and yields it with a workload over the seeded ids
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    latencies = {'mongo': Latency(), 'elasticsearch': Latency(), 'memcached': Latency()}
+
+    memcached_servers = [MemcachedServer(latencies['memcached']) for _ in range(3 * args.memcached_nodes)]
+    addresses = [await server.start() for server in memcached_servers]
+    memcached_uris = [','.join(addresses[i::3]) for i in range(3)]
+    utils.settings.settings = bench_settings(memcached_uris, args)
+
+    # imported once the settings are in place, main reads them at import time
+    import main
+
+    # the app starts as in production, only the client factories hand out the fakes
+    mongo_client = FakeMongoClient(latencies['mongo'], replica_set=not args.mongo_standalone)
+    elasticsearch_client = FakeElasticsearch(latencies['elasticsearch'])
+    with mock.patch.object(mongo_repository, 'create_mongo_client', lambda settings: mongo_client), \
+            mock.patch.object(elasticsearch_repository, 'create_elasticsearch_client',
+                              lambda settings: elasticsearch_client):
+        await main.startup()
+    try:
+        room_ids, client_ids, booking_ids = await seed(main.app, rng, args)
+        # seeding runs without latency, the measured phase pays it on every backend round trip
+        latencies['mongo'].configure(args.mongo_latency, args.jitter)
+        latencies['elasticsearch'].configure(args.elasticsearch_latency, args.jitter)
+        latencies['memcached'].configure(args.memcached_latency, args.jitter)
+        yield main.app, workload_class(rng, room_ids, client_ids, booking_ids, args.skew, args.days), latencies
+    finally:
+        await main.shutdown()
+        for server in memcached_servers:
+            await server.stop()
+
+
+async def measure(generator: LoadGenerator, args) -> dict:
+    if args.warmup > 0:
+        await generator.run(args.warmup, args.concurrency, args.rate)
+    generator.recording = True
+    started, cpu_started = time.perf_counter(), time.process_time()
+    await generator.run(args.duration, args.concurrency, args.rate)
+    elapsed, cpu_seconds = time.perf_counter() - started, time.process_time() - cpu_started
+    generator.recording = False
+
+    total = EndpointStats()
+    for stats in generator.stats.values():
+        total.merge(stats)
+    return {
+        'elapsed_seconds': round(elapsed, 3),
+        # the fakes run in the same process, so this is an upper bound of the service's own cost
+        'cpu_ms_per_request': round(cpu_seconds / max(len(total.latencies), 1) * 1000, 3),
+        'total': summarize(total, elapsed),
+        'endpoints': {operation: summarize(generator.stats[operation], elapsed)
+                      for operation in sorted(generator.stats)},
+    }
+
+
+def describe(args, workload: Workload, latencies: dict) -> dict:
+    return {
+        'duration_seconds': args.duration,
+        'warmup_seconds': args.warmup,
+        'concurrency': None if args.rate else args.concurrency,
+        'rate': args.rate,
+        'seed': args.seed,
+        'skew': args.skew,
+        'data': workload.describe(),
+        'latency': {backend: latency.describe() for backend, latency in latencies.items()},
+        'memcached_nodes': args.memcached_nodes,
+        'metrics': not args.no_metrics,
+        'admission_limit': args.admission_limit,
+        'mongo_standalone': args.mongo_standalone,
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--concurrency', type=int, default=64, help='workers of the closed loop')
+    parser.add_argument('--rate', type=float, default=None, help='requests per second of an open loop instead')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skew', type=float, default=1.0, help='zipf exponent of the key popularity')
+    parser.add_argument('--rooms', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--bookings', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--mongo-latency', type=float, default=1.0, help='milliseconds per round trip')
+    parser.add_argument('--elasticsearch-latency', type=float, default=3.0, help='milliseconds per round trip')
+    parser.add_argument('--memcached-latency', type=float, default=0.2, help='milliseconds per round trip')
+    parser.add_argument('--jitter', type=float, default=0.25, help='latency spread as a fraction of the mean')
+    parser.add_argument('--memcached-nodes', type=int, default=1, help='memcached servers per cache')
+    parser.add_argument('--mongo-standalone', action='store_true', help='fake mongo without replica set features')
+    parser.add_argument('--no-metrics', action='store_true')
+    parser.add_argument('--admission-limit', type=int, default=0, help='requests in flight before shedding, 0 is off')
+    parser.add_argument('--output', default=None, help='also write the report to this file')
+
+
+def write_report(report: dict, output: str | None):
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as output_file:
+            output_file.write(text + '\n')
+    print(text)
+
+
+async def run(args) -> dict:
+    started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    async with bench_environment(args) as (app, workload, latencies):
+        config = {'mix': args.mix, **describe(args, workload, latencies)}
+        result = await measure(LoadGenerator(app, workload, args.mix, random.Random(args.seed)), args)
+    return {'benchmark': 'load_test', 'started_at': started_at, 'config': config, **result}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='In-process load test against in-memory Mongo, ES and memcached')
+    parser.add_argument('--mix', type=parse_mix, default='mixed',
+                        help=f'one of {", ".join(MIXES)} or operation=weight pairs, e.g. get_room=3,book_room=1')
+    add_arguments(parser)
+
+    args = parser.parse_args()
+    write_report(asyncio.run(run(args)), args.output)
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from fastapi import Depends, FastAPI, status
+from starlette.responses import Response
+
+from api.dependencies import get_mongo_repository
+from bench.load_test import EndpointStats, add_arguments, asgi_request, bench_environment, describe, summarize, \
+    write_report
+from models.booking import Booking
+from repository.cache_repository import TieredCache, get_bookings_cache
+from repository.elasticsearch_repository import get_elasticsearch_client, pending_writes
+from repository.mongo_repository import MongoRepository
+from utils.mongo_utils import filter_by_id
+from utils.settings import get_settings
+
+
+def add_legacy_route(app: FastAPI):
+    # the payment path as it was: read, read again, replace, then delete and re-add the cache entry
+    @app.post('/bench/pay_booking_legacy')
+    async def pay_booking_legacy(
+        booking_id: str,
+        repository: MongoRepository = Depends(get_mongo_repository),
+        bookings_cache: TieredCache = Depends(get_bookings_cache),
+    ):
+        if await repository.get_booking_by_id(booking_id) is None:
+            return Response(status_code=status.HTTP_400_BAD_REQUEST)
+        collection = repository._mongo_bookings_collection
+        current = Booking.Map(await collection.find_one(filter_by_id(booking_id)))
+        if current.is_paid:
+            return Response(status_code=status.HTTP_404_NOT_FOUND)
+        paid_booking = current.model_copy(update={'is_paid': True})
+        await collection.find_one_and_replace(filter_by_id(booking_id), dict(paid_booking))
+        await bookings_cache.delete(booking_id)
+        await bookings_cache.add(booking_id, paid_booking)
+        return paid_booking
+
+
+async def pay_concurrently(app: FastAPI, path: str, booking_ids: list, attempts: int, concurrency: int) -> dict:
+    slots = asyncio.Semaphore(concurrency)
+    stats = EndpointStats()
+    successes = {booking_id: 0 for booking_id in booking_ids}
+
+    async def attempt(booking_id: str):
+        async with slots:
+            started = time.perf_counter()
+            response_status, _ = await asgi_request(app, 'POST', path, {'booking_id': booking_id}, None)
+            stats.record(time.perf_counter() - started, response_status)
+            if response_status == 200:
+                successes[booking_id] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(attempt(booking_id) for booking_id in booking_ids for _ in range(attempts)))
+    elapsed = time.perf_counter() - started
+    return {
+        **summarize(stats, elapsed),
+        'bookings': len(booking_ids),
+        'attempts_per_booking': attempts,
+        'paid_more_than_once': sum(count > 1 for count in successes.values()),
+        'never_paid': sum(count == 0 for count in successes.values()),
+    }
+
+
+async def check_paid(app: FastAPI, booking_ids: list) -> dict:
+    repository = app.state.mongo_repository
+    bookings_cache = get_bookings_cache()
+    # the search update is queued off the request path, wait for it before looking at the index
+    if pending_writes:
+        await asyncio.gather(*pending_writes)
+    search_client = get_elasticsearch_client()
+    search_index = get_settings().elasticsearch_index_booking
+    mongo_paid = cache_paid = search_paid = 0
+    for booking_id in booking_ids:
+        mongo_paid += (await repository.get_booking_by_id(booking_id)).is_paid
+        cached = await bookings_cache.get(booking_id)
+        cache_paid += cached is not None and cached.is_paid
+        indexed = await search_client.get(index=search_index, id=booking_id)
+        search_paid += indexed['_source']['is_paid']
+    return {'mongo': mongo_paid, 'cache': cache_paid, 'search': search_paid}
+
+
+async def run(args) -> dict:
+    started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    report = {}
+    async with bench_environment(args) as (app, workload, latencies):
+        add_legacy_route(app)
+        config = {**describe(args, workload, latencies), 'attempts_per_booking': args.attempts}
+        for name, path in [('legacy', '/bench/pay_booking_legacy'), ('atomic', '/airbnb/bookings/pay_booking')]:
+            booking_ids = workload.take_unpaid(args.payments)
+            report[name] = await pay_concurrently(app, path, booking_ids, args.attempts, args.concurrency)
+            report[name]['paid_in'] = await check_paid(app, booking_ids)
+
+    return {
+        'benchmark': 'payment_contention',
+        'started_at': started_at,
+        'config': config,
+        **report,
+        'throughput_speedup': round(report['atomic']['rps'] / report['legacy']['rps'], 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Payment throughput with concurrent duplicate attempts per booking')
+    add_arguments(parser)
+    parser.add_argument('--payments', type=int, default=500, help='bookings paid by each variant')
+    parser.add_argument('--attempts', type=int, default=4, help='concurrent pay requests per booking')
+
+    args = parser.parse_args()
+    write_report(asyncio.run(run(args)), args.output)
@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import json
+import time
+
+from bson import ObjectId
+from fastapi import FastAPI
+
+from models.room import Room
+from utils.cache_utils import to_json_bytes
+from utils.responses import FastJSONResponse
+
+
+def sample_hits(count: int) -> list:
+    return [{'_id': str(ObjectId()),
+             '_source': {'name': f'Sunny loft {i}', 'country': 'Portugal', 'city': 'Lisbon',
+                         'address': f'Rua Augusta {i}, 1100-048 Lisboa',
+                         'description': 'Bright two bedroom flat with a balcony over the old town.'}}
+            for i in range(count)]
+
+
+def room_from_hit(room: dict) -> Room:
+    return Room(id=room['_id'],
+                description=room['_source']['description'],
+                country=room['_source']['country'],
+                city=room['_source']['city'],
+                name=room['_source']['name'],
+                address=room['_source']['address'])
+
+
+def build_app(hits: list) -> FastAPI:
+    app = FastAPI()
+    room = room_from_hit(hits[0])
+    cached_room = room.model_dump(mode='json')
+    cached_body = to_json_bytes(room)
+
+    # the previous path: cached dict re-validated through response_model and encoded with the stdlib encoder
+    @app.get('/before/room', response_model=Room)
+    async def room_before():
+        return cached_room
+
+    @app.get('/after/room', response_model=Room, response_class=FastJSONResponse)
+    async def room_after():
+        return FastJSONResponse(cached_body)
+
+    @app.get('/before/rooms')
+    async def rooms_before():
+        return {'rooms': list(map(room_from_hit, hits)), 'next_cursor': None}
+
+    @app.get('/after/rooms', response_class=FastJSONResponse)
+    async def rooms_after():
+        return FastJSONResponse({'rooms': Room.MapMany([{'_id': hit['_id'], **hit['_source']} for hit in hits]),
+                                 'next_cursor': None})
+
+    return app
+
+
+async def call(app: FastAPI, path: str) -> bytes:
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '', 'headers': [],
+             'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 8000)}
+    body = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.body':
+            body.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return b''.join(body)
+
+
+async def measure(app: FastAPI, path: str, requests: int) -> dict:
+    body = await call(app, path)
+    started = time.process_time()
+    for _ in range(requests):
+        await call(app, path)
+    cpu_seconds = time.process_time() - started
+    return {'bytes': len(body), 'cpu_us_per_request': round(cpu_seconds / requests * 1e6, 1)}
+
+
+async def run(args) -> dict:
+    app = build_app(sample_hits(args.page_size))
+    report = {}
+    for name in ['room', 'rooms']:
+        before = await measure(app, f'/before/{name}', args.requests)
+        after = await measure(app, f'/after/{name}', args.requests)
+        report[name] = {'before': before, 'after': after,
+                        'speedup': round(before['cpu_us_per_request'] / after['cpu_us_per_request'], 2)}
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-request CPU of the default and the fast response path')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--page-size', type=int, default=100)
+
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
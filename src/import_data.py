@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from dotenv import load_dotenv
+
+from repository.mongo_repository import MongoRepository, connect_and_init_mongo, close_mongo_connect
+from repository.elasticsearch_repository import ElasticSearchRepository, connect_and_init_elasticsearch, close_elasticsearch_connect
+from repository.search_indexer import search_indexer_enabled
+from utils.bulk_import import BulkImporter, IMPORT_MODELS
+from utils.log import configure_logging, stop_logging
+from utils.settings import get_settings
+
+
+async def read_lines(path: str):
+    with open(path, encoding='utf-8', newline='') as file:
+        for line in file:
+            yield line.rstrip('\r\n')
+
+
+async def run_import(args):
+    settings = get_settings()
+    configure_logging(settings.log_level, settings.log_format, settings.log_rate_limit, settings.log_rate_interval)
+    await connect_and_init_mongo()
+    await connect_and_init_elasticsearch()
+    try:
+        data_format = args.format or ('csv' if args.path.endswith('.csv') else 'ndjson')
+        importer = BulkImporter(args.entity, MongoRepository.get_instance(), ElasticSearchRepository.get_instance(),
+                                chunk_size=args.chunk_size, concurrency=args.concurrency,
+                                index=not search_indexer_enabled())
+        return await importer.run(read_lines(args.path), data_format)
+    finally:
+        await close_elasticsearch_connect()
+        close_mongo_connect()
+        stop_logging()
+
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Bulk import clients, rooms or bookings from NDJSON or CSV')
+    parser.add_argument('entity', choices=list(IMPORT_MODELS))
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['ndjson', 'csv'])
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4)
+
+    report = asyncio.run(run_import(parser.parse_args()))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    sys.exit(1 if report['failed'] else 0)
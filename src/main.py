@@ -1,33 +1,83 @@
+import os
+
 from dotenv import load_dotenv
 from fastapi import FastAPI
+from starlette.responses import Response
 import uvicorn
 
+from api.middleware import AdmissionControlMiddleware, MetricsMiddleware
 from api.router import router
-from repository.mongo_repository import connect_and_init_mongo, close_mongo_connect
-from repository.elasticsearch_repository import connect_and_init_elasticsearch, close_elasticsearch_connect
+from repository.mongo_repository import MongoRepository, connect_and_init_mongo, close_mongo_connect
+from repository.elasticsearch_repository import ElasticSearchRepository, connect_and_init_elasticsearch, \
+    close_elasticsearch_connect
 from repository.cache_repository import connect_memcached, close_memcached_connect
+from repository.availability_repository import start_availability_index, stop_availability_index
+from repository.search_indexer import start_search_indexer, stop_search_indexer
+from utils.log import configure_logging, get_logger, stop_logging
+from utils.metrics import registry
+from utils.settings import Settings, get_settings
+from utils.tracing import configure_tracing
+
+
+logger = get_logger('server')
 
 
 async def startup():
+    # runs in every worker process, so each one opens its own pools on its own event loop
+    app.state.settings = get_settings()
+    configure_tracing(app.state.settings.trace_sample_rate, app.state.settings.trace_buffer_size)
     await connect_and_init_mongo()
     await connect_and_init_elasticsearch()
-    connect_memcached()
+    app.state.mongo_repository = MongoRepository.get_instance()
+    app.state.elasticsearch_repository = ElasticSearchRepository.get_instance()
+    await connect_memcached()
+    await start_availability_index()
+    await start_search_indexer()
 
 
 async def shutdown():
-    await close_mongo_connect()
+    await stop_search_indexer()
+    await stop_availability_index()
+    close_mongo_connect()
     await close_elasticsearch_connect()
-    close_memcached_connect()
+    await close_memcached_connect()
+    stop_logging()
+
+
+async def metrics():
+    return Response(registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 load_dotenv()
+settings = get_settings()
+configure_logging(settings.log_level, settings.log_format, settings.log_rate_limit, settings.log_rate_interval)
 
 app = FastAPI()
 
 app.include_router(router, prefix="/airbnb")
+app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+if settings.admission_max_concurrency > 0:
+    app.add_middleware(AdmissionControlMiddleware, max_concurrency=settings.admission_max_concurrency,
+                       exempt_paths=settings.admission_exempt_paths)
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
 app.add_event_handler("startup", startup)
 app.add_event_handler("shutdown", shutdown)
 
 
+def serve(settings: Settings):
+    # on SIGTERM uvicorn stops accepting, lets in-flight requests finish within the graceful timeout
+    # and only then runs the shutdown hooks that close the pools
+    workers = settings.server_workers or os.cpu_count()
+    if workers > 1 and settings.cache_peers:
+        # peer invalidations reach one worker per node, its siblings drop the entry when the L1 ttl runs out
+        logger.warning('Serving with %s workers, local cache entries may be stale for up to %ss',
+                       workers, settings.cache_l1_ttl)
+    uvicorn.run('main:app', host=settings.server_host, port=settings.server_port, workers=workers,
+                loop=settings.server_loop, http=settings.server_http, backlog=settings.server_backlog,
+                timeout_keep_alive=settings.server_keep_alive_timeout,
+                timeout_graceful_shutdown=settings.server_graceful_shutdown_timeout)
+
+
 if __name__ == '__main__':
-    uvicorn.run(app, host='0.0.0.0', port=8000)
+    serve(settings)
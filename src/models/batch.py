@@ -0,0 +1,5 @@
+from pydantic import BaseModel, Field
+
+
+class BatchGetRequest(BaseModel):
+    ids: list[str] = Field(max_length=1000)
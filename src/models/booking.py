@@ -1,14 +1,22 @@
-from pydantic import BaseModel
+from datetime import datetime
+from pydantic import BaseModel, TypeAdapter, field_validator, model_validator
 from typing import Any, Optional
 
+from utils.date_utils import booking_span, parse_datetime
+
 
 class Booking(BaseModel):
     id: str
     client_id: str
     room_id: str
     is_paid: bool
-    start_dt: str
-    end_dt: str
+    start_dt: datetime
+    end_dt: datetime
+
+    @field_validator('start_dt', 'end_dt', mode='before')
+    @classmethod
+    def normalize_dt(cls, value: Any) -> datetime:
+        return parse_datetime(value)
 
     @classmethod
     def Map(cls, booking: Any):
@@ -19,14 +27,33 @@ class Booking(BaseModel):
             client_id=str(booking['client_id']),
             room_id=str(booking['room_id']),
             is_paid=booking['is_paid'],
-            start_dt=str(booking['start_dt']),
-            end_dt=str(booking['end_dt'])          
+            start_dt=booking['start_dt'],
+            end_dt=booking['end_dt']
         )
 
+    @classmethod
+    def MapMany(cls, bookings) -> list:
+        return booking_list_adapter.validate_python([{**booking, 'id': str(booking['_id'])} for booking in bookings])
+
+
+booking_list_adapter = TypeAdapter(list[Booking])
+
 
 class UpdateBooking(BaseModel):
     client_id: str
     room_id: str
     is_paid: bool
-    start_dt: str
-    end_dt: str
+    start_dt: datetime
+    end_dt: datetime
+
+    @field_validator('start_dt', 'end_dt', mode='before')
+    @classmethod
+    def normalize_dt(cls, value: Any) -> datetime:
+        return parse_datetime(value)
+
+    @model_validator(mode='after')
+    def snap_to_nights(self) -> 'UpdateBooking':
+        if self.end_dt <= self.start_dt:
+            raise ValueError('end_dt must be after start_dt')
+        self.start_dt, self.end_dt = booking_span(self.start_dt, self.end_dt)
+        return self
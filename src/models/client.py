@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 from typing import Any
 
 
@@ -15,6 +15,13 @@ class Client(BaseModel):
             name=str(client['name']),
         )
 
+    @classmethod
+    def MapMany(cls, clients) -> list:
+        return client_list_adapter.validate_python([{**client, 'id': str(client['_id'])} for client in clients])
+
+
+client_list_adapter = TypeAdapter(list[Client])
+
 
 class UpdateClient(BaseModel):
     name: str
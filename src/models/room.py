@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 from typing import Any
 
 
@@ -9,6 +9,8 @@ class Room(BaseModel):
     city: str
     address: str
     description: str
+    lat: float | None = None
+    lon: float | None = None
 
     @classmethod
     def Map(cls, room: Any):
@@ -21,12 +23,29 @@ class Room(BaseModel):
             city=str(room['city']),
             address=str(room['address']),
             description=str(room['description']),
+            lat=room.get('lat'),
+            lon=room.get('lon'),
         )
 
+    @classmethod
+    def MapMany(cls, rooms) -> list:
+        return room_list_adapter.validate_python([{**room, 'id': str(room['_id'])} for room in rooms])
+
+
+room_list_adapter = TypeAdapter(list[Room])
+
 
 class UpdateRoom(BaseModel):
     name: str
     country: str
     city: str
     address: str
-    description: str
\ No newline at end of file
+    description: str
+    lat: float | None = Field(default=None, ge=-90, le=90)
+    lon: float | None = Field(default=None, ge=-180, le=180)
+
+    @field_validator('lat', 'lon', mode='before')
+    @classmethod
+    def empty_as_missing(cls, value):
+        # csv imports leave the coordinates of rooms without a location as empty columns
+        return None if value == '' else value
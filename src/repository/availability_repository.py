@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from pymongo.errors import PyMongoError
+
+from repository import mongo_repository
+from utils.date_utils import booking_span
+from utils.interval_index import IntervalIndex
+from utils.log import get_logger
+from utils.settings import get_settings
+
+
+logger = get_logger('availability')
+
+
+class AvailabilityRepository(object):
+    def __init__(self, database, rooms_collection: str, bookings_collection: str):
+        self._database = database
+        self._rooms_collection_name = rooms_collection
+        self._bookings_collection_name = bookings_collection
+        self._index = IntervalIndex()
+        self._task = None
+        self.rebuilt_at = None
+        self.events = 0
+
+    def add_room(self, room_id: str):
+        self._index.add_room(room_id)
+
+    def add_booking(self, booking_id: str, room_id: str, start_dt, end_dt):
+        self._index.add(room_id, booking_id, *booking_span(start_dt, end_dt))
+
+    def remove_booking(self, booking_id: str):
+        self._index.remove(booking_id)
+
+    def has_room(self, room_id: str) -> bool:
+        return room_id in self._index.room_ids
+
+    def is_room_free(self, room_id: str, start_dt, end_dt) -> bool:
+        return self._index.is_free(room_id, *booking_span(start_dt, end_dt))
+
+    def find_free_rooms(self, start_dt, end_dt, room_ids=None) -> list:
+        return self._index.free_rooms(*booking_span(start_dt, end_dt), room_ids)
+
+    async def rebuild(self):
+        index = IntervalIndex()
+        rooms = self._database.get_collection(self._rooms_collection_name)
+        async for room in rooms.find({}, {'_id': 1}):
+            index.add_room(str(room['_id']))
+        bookings = self._database.get_collection(self._bookings_collection_name)
+        async for booking in bookings.find({}, {'room_id': 1, 'start_dt': 1, 'end_dt': 1}):
+            try:
+                index.add(str(booking['room_id']), str(booking['_id']),
+                          *booking_span(booking['start_dt'], booking['end_dt']))
+            except (KeyError, ValueError) as ex:
+                logger.warning('Skipping booking %s in availability index: %s', booking['_id'], ex)
+        self._index = index
+        self.rebuilt_at = time.time()
+
+    def _apply(self, change: dict):
+        self.events += 1
+        document_id = str(change['documentKey']['_id'])
+        if change['ns']['coll'] == self._rooms_collection_name:
+            if change['operationType'] == 'insert':
+                self.add_room(document_id)
+            return
+        if change['operationType'] == 'delete':
+            self.remove_booking(document_id)
+            return
+        booking = change['fullDocument']
+        try:
+            self.add_booking(document_id, str(booking['room_id']), booking['start_dt'], booking['end_dt'])
+        except (KeyError, ValueError) as ex:
+            logger.warning('Skipping booking %s in availability index: %s', document_id, ex)
+
+    async def start(self):
+        ready = asyncio.get_running_loop().create_future()
+        self._task = asyncio.create_task(self._follow(ready))
+        await ready
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _follow(self, ready: asyncio.Future):
+        pipeline = [{'$match': {'ns.coll': {'$in': [self._rooms_collection_name, self._bookings_collection_name]},
+                                'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+        while True:
+            try:
+                # the stream is opened before the rebuild so no write between the two is lost
+                async with self._database.watch(pipeline, full_document='updateLookup') as stream:
+                    await self.rebuild()
+                    if not ready.done():
+                        ready.set_result(None)
+                    async for change in stream:
+                        if change.get('fullDocument') is None and change['operationType'] != 'delete':
+                            continue
+                        self._apply(change)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as ex:
+                logger.error('Availability index stream failed, rebuilding: %s', ex)
+                if not ready.done():
+                    try:
+                        await self.rebuild()
+                    except PyMongoError as rebuild_ex:
+                        logger.error('Cant rebuild availability index: %s', rebuild_ex)
+                    ready.set_result(None)
+                await asyncio.sleep(5)
+
+    def stats(self) -> dict:
+        return {
+            'rooms': len(self._index.room_ids),
+            'bookings': len(self._index),
+            'events': self.events,
+            'rebuilt_at': self.rebuilt_at,
+        }
+
+
+availability_repository: AvailabilityRepository = None
+
+
+async def start_availability_index():
+    global availability_repository
+    settings = get_settings()
+    database = mongo_repository.mongo_client.get_database(settings.mongo_db)
+    availability_repository = AvailabilityRepository(database, settings.mongo_rooms_collection,
+                                                     settings.mongo_bookings_collection)
+    await availability_repository.start()
+    logger.info('Availability index loaded', extra=availability_repository.stats())
+
+
+async def stop_availability_index():
+    if availability_repository is not None:
+        await availability_repository.stop()
+
+
+def get_availability_repository() -> AvailabilityRepository:
+    return availability_repository
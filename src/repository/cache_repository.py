@@ -1,43 +1,342 @@
-import os
-import sys
-from datetime import datetime
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
 
-from pymemcache import HashClient
+import aiohttp
+from fastapi.encoders import jsonable_encoder
 
-from utils.cache_utils import JsonSerializer
+from models.booking import Booking
+from models.client import Client
+from models.room import Room
+from utils.async_memcached import AsyncHashClient
+from utils.cache_utils import BinarySerializer, to_json_bytes
+from utils.local_cache import LocalCache
+from utils.log import get_logger
+from utils.metrics import instrument_memcached, registry
+from utils.settings import Settings, get_settings
+from utils.single_flight import SingleFlight
 
 
-memcached_clients_client: HashClient = None
-memcached_rooms_client: HashClient = None
-memcached_bookings_client: HashClient = None
+logger = get_logger('cache')
 
 
-def connect_memcached():
-    global memcached_clients_client
-    global memcached_rooms_client
-    global memcached_bookings_client
+class TieredCache(object):
+    def __init__(self, name: str, memcached_client: AsyncHashClient, local_cache: LocalCache, expire: int,
+                 serde: BinarySerializer, early_refresh_beta: float = 1.0):
+        self.name = name
+        self._memcached_client = memcached_client
+        self._local_cache = local_cache
+        self._expire = expire
+        self._serde = serde
+        self._single_flight = SingleFlight()
+        self._early_refresh_beta = early_refresh_beta
+        self._load_time = 0.0
+        self._refresh_tasks = set()
+        self.remote_hits = 0
+        self.remote_misses = 0
+        self.loads = 0
+        self.early_refreshes = 0
+
+    # local entries keep the decoded value next to its JSON body so responses can skip re-encoding
+    def _store_local(self, key: str, value, body: bytes | None = None):
+        if body is None:
+            body = to_json_bytes(value)
+        self._local_cache.set(key, (value, body), len(body), self._expire)
+
+    def _store_remote_values(self, raw_values: dict) -> dict:
+        values = {}
+        for key, (data, flags) in raw_values.items():
+            value = self._serde.deserialize(key, data, flags)
+            if value is not None:
+                self._store_local(key, value, self._serde.json_body(data, flags))
+                values[key] = value
+        return values
+
+    async def _get(self, key: str) -> tuple:
+        entry = self._local_cache.get(key)
+        if entry is not None:
+            return entry[0], True
+
+        raw_values = await self._memcached_client.get_many_raw([key])
+        value = self._store_remote_values(raw_values).get(key)
+        if value is None:
+            self.remote_misses += 1
+        else:
+            self.remote_hits += 1
+        return value, key in raw_values
+
+    async def get(self, key: str):
+        value, _ = await self._get(key)
+        return value
+
+    async def _load(self, key: str, loader, refresh: bool = False):
+        overwrite = refresh
+        if not refresh:
+            value, stored = await self._get(key)
+            if value is not None:
+                return value
+            # an entry that is stored but does not decode would outlive an add, so it is overwritten
+            overwrite = stored
+
+        started = time.monotonic()
+        value = await loader()
+        self._load_time = 0.8 * self._load_time + 0.2 * (time.monotonic() - started)
+        self.loads += 1
+        if value is None:
+            return None
+        if overwrite:
+            await self.set(key, value)
+        else:
+            await self.add(key, value)
+        return value
+
+    def _should_refresh_early(self, key: str) -> bool:
+        if self._early_refresh_beta <= 0 or self._single_flight.in_flight(key):
+            return False
+        remaining = self._local_cache.ttl_remaining(key)
+        return self._load_time * self._early_refresh_beta * -math.log(1.0 - random.random()) >= remaining
+
+    def _refresh_early(self, key: str, loader):
+        self.early_refreshes += 1
+        task = asyncio.create_task(self._single_flight.do(key, lambda: self._load(key, loader, refresh=True)))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    def _get_local_entry(self, key: str, loader) -> tuple | None:
+        entry = self._local_cache.get(key)
+        if entry is not None and self._should_refresh_early(key):
+            self._refresh_early(key, loader)
+        return entry
+
+    async def get_or_load(self, key: str, loader, primary: bool = False):
+        entry = self._get_local_entry(key, loader)
+        if entry is not None:
+            return entry[0]
+        # a primary read must not join a concurrent secondary read, which can miss a write made a moment ago
+        flight_key = f'{key}:primary' if primary else key
+        return await self._single_flight.do(flight_key, lambda: self._load(key, loader))
+
+    async def get_or_load_json(self, key: str, loader) -> bytes | None:
+        entry = self._get_local_entry(key, loader)
+        if entry is not None:
+            return entry[1]
+        value = await self._single_flight.do(key, lambda: self._load(key, loader))
+        return None if value is None else to_json_bytes(value)
+
+    async def get_many(self, keys: list) -> dict:
+        result = {}
+        remote_keys = []
+        for key in keys:
+            entry = self._local_cache.get(key)
+            if entry is not None:
+                result[key] = entry[0]
+            else:
+                remote_keys.append(key)
+        if not remote_keys:
+            return result
+
+        remote_values = self._store_remote_values(await self._memcached_client.get_many_raw(remote_keys))
+        self.remote_hits += len(remote_values)
+        self.remote_misses += len(remote_keys) - len(remote_values)
+        result.update(remote_values)
+        return result
+
+    async def get_many_or_load(self, keys: list, loader) -> dict:
+        keys = list(dict.fromkeys(keys))
+        result = await self.get_many(keys)
+        missing_keys = [key for key in keys if key not in result]
+        if not missing_keys:
+            return result
+
+        loaded = await loader(missing_keys)
+        self.loads += 1
+        if loaded:
+            await self.set_many(loaded)
+            result.update(loaded)
+        return result
+
+    async def set_many(self, values: dict) -> list:
+        for key, value in values.items():
+            self._store_local(key, value)
+        return await self._memcached_client.set_many(values, self._expire)
+
+    async def add(self, key: str, value) -> bool:
+        self._store_local(key, value)
+        return await self._memcached_client.add(key, value, self._expire)
+
+    async def set(self, key: str, value) -> bool:
+        self._store_local(key, value)
+        return await self._memcached_client.set(key, value, self._expire)
+
+    async def write_through(self, key: str, value) -> bool:
+        stored = await self.set(key, value)
+        broadcast_invalidation(self.name, key)
+        return stored
+
+    async def delete(self, key: str) -> bool:
+        self._local_cache.delete(key)
+        deleted = await self._memcached_client.delete(key)
+        broadcast_invalidation(self.name, key)
+        return deleted
+
+    def invalidate_local(self, key: str):
+        self._local_cache.delete(key)
+
+    def stats(self) -> dict:
+        return {
+            'local': self._local_cache.stats(),
+            'remote_hits': self.remote_hits,
+            'remote_misses': self.remote_misses,
+            'loads': self.loads,
+            'shared_loads': self._single_flight.shared,
+            'early_refreshes': self.early_refreshes,
+        }
+
+
+class SearchCache(object):
+    def __init__(self, memcached_client: AsyncHashClient, local_cache: LocalCache, expire: int,
+                 generation_ttl: float = 0.0, rebump_delay: float = 1.0):
+        self._memcached_client = memcached_client
+        self._local_cache = local_cache
+        self._expire = expire
+        self._generation_ttl = generation_ttl
+        self._rebump_delay = rebump_delay
+        self._generations = {}
+        self._single_flight = SingleFlight()
+        self._bump_tasks = set()
+        self._endpoint_stats = {}
+
+    @staticmethod
+    def _entry_key(index: str, endpoint: str, params: dict, text_params: tuple = ()) -> str:
+        # analysed text is case and whitespace insensitive in Elasticsearch, keyword filters are not
+        normalized = {name: ' '.join(value.lower().split()) if name in text_params else value
+                      for name, value in params.items() if value is not None}
+        digest = hashlib.sha1(json.dumps([endpoint, normalized], sort_keys=True).encode()).hexdigest()
+        return f'search:{index}:{digest}'
+
+    @staticmethod
+    def _generation_key(index: str) -> str:
+        return f'search_generation:{index}'
+
+    def _record(self, endpoint: str, hit: bool):
+        stats = self._endpoint_stats.setdefault(endpoint, {'hits': 0, 'misses': 0})
+        stats['hits' if hit else 'misses'] += 1
+
+    async def _get_entry(self, index: str, key: str) -> tuple:
+        generation, fetched_at = self._generations.get(index, (None, 0.0))
+        local_entry = self._local_cache.get(key)
+        if generation is not None and time.monotonic() - fetched_at < self._generation_ttl:
+            if local_entry is not None and local_entry['generation'] == generation:
+                return generation, local_entry
+            remote_entry = await self._memcached_client.get(key)
+        else:
+            generation_key = self._generation_key(index)
+            values = await self._memcached_client.get_many([generation_key, key])
+            generation = int(values.get(generation_key) or 0)
+            self._generations[index] = (generation, time.monotonic())
+            if local_entry is not None and local_entry['generation'] == generation:
+                return generation, local_entry
+            remote_entry = values.get(key)
+
+        if remote_entry is not None and remote_entry['generation'] == generation:
+            self._local_cache.set(key, remote_entry, len(json.dumps(remote_entry)), self._expire)
+            return generation, remote_entry
+        return generation, None
+
+    async def get_or_search(self, index: str, endpoint: str, params: dict, search, text_params: tuple = ()):
+        key = self._entry_key(index, endpoint, params, text_params)
+        generation, entry = await self._get_entry(index, key)
+        if entry is not None:
+            self._record(endpoint, True)
+            return entry['payload']
+
+        self._record(endpoint, False)
+
+        async def search_and_store():
+            # the payload is shared between clients, so it may only hold cursors that carry no point in time
+            payload = jsonable_encoder(await search())
+            entry = {'generation': generation, 'payload': payload}
+            self._local_cache.set(key, entry, len(json.dumps(entry)), self._expire)
+            await self._memcached_client.set(key, entry, self._expire)
+            return payload
 
-    memcached_clients_uri = os.getenv('MEMCACHED_CLIENTS_URI')
-    memcached_rooms_uri = os.getenv('MEMCACHED_ROOMS_URI')
-    memcached_bookings_uri = os.getenv('MEMCACHED_BOOKINGS_URI')
+        return await self._single_flight.do(f'{key}:{generation}', search_and_store)
 
-    memcached_uris = [memcached_clients_uri,
-                      memcached_rooms_uri,
-                      memcached_bookings_uri,]
+    async def _bump(self, index: str):
+        generation_key = self._generation_key(index)
+        if await self._memcached_client.incr(generation_key) is None:
+            if not await self._memcached_client.add(generation_key, '1'):
+                await self._memcached_client.incr(generation_key)
+        self._generations.pop(index, None)
+
+    async def _bump_later(self, index: str):
+        await asyncio.sleep(self._rebump_delay)
+        await self._bump(index)
+
+    async def invalidate(self, index: str):
+        await self._bump(index)
+        # pages cached before the write becomes visible to search are dropped once the index has refreshed
+        task = asyncio.create_task(self._bump_later(index))
+        self._bump_tasks.add(task)
+        task.add_done_callback(self._bump_tasks.discard)
+
+    def stats(self) -> dict:
+        return {
+            'local': self._local_cache.stats(),
+            'endpoints': {
+                endpoint: {**stats, 'hit_ratio': round(stats['hits'] / (stats['hits'] + stats['misses']), 3)}
+                for endpoint, stats in self._endpoint_stats.items()
+            },
+        }
+
+
+memcached_clients_client: AsyncHashClient = None
+memcached_rooms_client: AsyncHashClient = None
+memcached_bookings_client: AsyncHashClient = None
+
+clients_cache: TieredCache = None
+rooms_cache: TieredCache = None
+bookings_cache: TieredCache = None
+search_cache: SearchCache = None
+
+cache_peers: list = []
+cache_peers_session: aiohttp.ClientSession = None
+pending_invalidations: set = set()
+
+
+async def connect_memcached():
+    global cache_peers
+    global cache_peers_session
+    settings = get_settings()
+
+    memcached_uris = [settings.memcached_clients_uri,
+                      settings.memcached_rooms_uri,
+                      settings.memcached_bookings_uri,]
 
     memcached_clients = [None for _ in range(len(memcached_uris))]
+    serde = get_cache_serializer(settings)
 
     for i, memcached_uri in enumerate(memcached_uris):
         try:
-            memcached_clients[i] = HashClient(memcached_uri.split(','), serde=JsonSerializer())
-            print(f'Connected to memcached with uri {memcached_uri}', flush=True)
+            memcached_clients[i] = AsyncHashClient(memcached_uri.split(','), serde=serde,
+                                                   pool_size=settings.memcached_pool_size,
+                                                   timeout=settings.memcached_timeout)
+            if settings.metrics_enabled:
+                instrument_memcached(memcached_clients[i])
+            logger.info('Connected to memcached with uri %s', memcached_uri)
         except Exception as ex:
-            print(f'Cant connect to user memcached: {ex}', flush=True)
+            logger.error('Cant connect to memcached: %s', ex)
+
+    map_client_array(memcached_clients, serde, settings)
 
-    map_client_array(memcached_clients)
+    cache_peers = list(settings.cache_peers)
+    cache_peers_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1))
 
 
-def close_memcached_connect():
+async def close_memcached_connect():
     global memcached_clients_client
     global memcached_rooms_client
     global memcached_bookings_client
@@ -48,18 +347,62 @@ def close_memcached_connect():
 
     for memcached_client in memcached_clients:
         if memcached_client is not None:
-            memcached_client.close()
+            await memcached_client.close()
+
+    if cache_peers_session is not None:
+        await cache_peers_session.close()
+
+
+def get_cache_serializer(settings: Settings) -> BinarySerializer:
+    # the order of the models is part of the stored format, append new models and bump FORMAT_VERSION otherwise
+    return BinarySerializer([Client, Room, Booking], codec=settings.cache_codec,
+                            compress_threshold=settings.cache_compress_threshold)
 
 
-def map_client_array(memcached_clients):
+def map_client_array(memcached_clients, serde: BinarySerializer, settings: Settings):
     global memcached_clients_client
     global memcached_rooms_client
     global memcached_bookings_client
+    global clients_cache
+    global rooms_cache
+    global bookings_cache
+    global search_cache
 
     memcached_clients_client = memcached_clients[0]
     memcached_rooms_client = memcached_clients[1]
     memcached_bookings_client = memcached_clients[2]
 
+    def local_cache(max_bytes: int = settings.cache_l1_max_bytes) -> LocalCache:
+        return LocalCache(max_bytes, settings.cache_l1_ttl)
+
+    clients_cache = TieredCache('clients', memcached_clients_client, local_cache(),
+                                settings.memcached_clients_expire, serde, settings.cache_early_refresh_beta)
+    rooms_cache = TieredCache('rooms', memcached_rooms_client, local_cache(),
+                              settings.memcached_rooms_expire, serde, settings.cache_early_refresh_beta)
+    bookings_cache = TieredCache('bookings', memcached_bookings_client, local_cache(),
+                                 settings.memcached_bookings_expire, serde, settings.cache_early_refresh_beta)
+    search_cache = SearchCache(memcached_rooms_client, local_cache(settings.search_cache_max_bytes),
+                               settings.search_cache_expire,
+                               generation_ttl=settings.search_cache_generation_ttl,
+                               rebump_delay=settings.search_cache_rebump_delay)
+
+
+async def send_invalidation(peer: str, cache_name: str, key: str):
+    try:
+        async with cache_peers_session.post(f'http://{peer}/airbnb/internal/cache/invalidate',
+                                            params={'cache_name': cache_name, 'key': key}) as response:
+            if response.status != 200:
+                logger.warning('Cache invalidation on %s failed with status %s', peer, response.status)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+        logger.warning('Cant send cache invalidation to %s: %s', peer, ex)
+
+
+def broadcast_invalidation(cache_name: str, key: str):
+    for peer in cache_peers:
+        task = asyncio.create_task(send_invalidation(peer, cache_name, key))
+        pending_invalidations.add(task)
+        task.add_done_callback(pending_invalidations.discard)
+
 
 def get_memcached_clients_client():
     return memcached_clients_client
@@ -71,3 +414,53 @@ def get_memcached_rooms_client():
 
 def get_memcached_bookings_client():
     return memcached_bookings_client
+
+
+def get_clients_cache():
+    return clients_cache
+
+
+def get_rooms_cache():
+    return rooms_cache
+
+
+def get_bookings_cache():
+    return bookings_cache
+
+
+def get_search_cache():
+    return search_cache
+
+
+async def invalidate_search_cache(index: str):
+    if search_cache is not None:
+        await search_cache.invalidate(index)
+
+
+def get_cache_by_name(cache_name: str) -> TieredCache | None:
+    return {
+        'clients': clients_cache,
+        'rooms': rooms_cache,
+        'bookings': bookings_cache,
+    }.get(cache_name)
+
+
+def collect_cache_lookups():
+    caches = {name: get_cache_by_name(name) for name in ['clients', 'rooms', 'bookings']}
+    caches['search'] = search_cache
+    for name, cache in caches.items():
+        if cache is None:
+            continue
+        stats = cache.stats()
+        yield (name, 'local', 'hit'), stats['local']['hits']
+        yield (name, 'local', 'miss'), stats['local']['misses']
+        if 'remote_hits' in stats:
+            yield (name, 'remote', 'hit'), stats['remote_hits']
+            yield (name, 'remote', 'miss'), stats['remote_misses']
+        if 'endpoints' in stats:
+            yield (name, 'any', 'hit'), sum(endpoint['hits'] for endpoint in stats['endpoints'].values())
+            yield (name, 'any', 'miss'), sum(endpoint['misses'] for endpoint in stats['endpoints'].values())
+
+
+registry.collected('cache_lookups_total', 'Cache lookups by tier and result', 'counter',
+                   ('cache', 'tier', 'result'), collect_cache_lookups)
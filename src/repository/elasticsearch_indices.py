@@ -0,0 +1,94 @@
+from elasticsearch import AsyncElasticsearch, BadRequestError
+
+from utils.log import get_logger
+from utils.settings import Settings
+
+
+logger = get_logger('elasticsearch')
+
+KEYWORD = {'type': 'keyword'}
+DATE = {'type': 'date'}
+TEXT_WITH_KEYWORD = {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}}
+SEARCH_AS_YOU_TYPE_WITH_KEYWORD = {'type': 'search_as_you_type',
+                                   'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}}
+
+CLIENT_MAPPINGS = {
+    'dynamic': False,
+    'properties': {
+        'name': SEARCH_AS_YOU_TYPE_WITH_KEYWORD,
+    },
+}
+
+ROOM_MAPPINGS = {
+    'dynamic': False,
+    'properties': {
+        'name': SEARCH_AS_YOU_TYPE_WITH_KEYWORD,
+        'country': TEXT_WITH_KEYWORD,
+        'city': TEXT_WITH_KEYWORD,
+        'address': {'type': 'text'},
+        'description': {'type': 'text'},
+        'location': {'type': 'geo_point'},
+        'room_id': KEYWORD,
+    },
+}
+
+BOOKING_MAPPINGS = {
+    'dynamic': False,
+    'properties': {
+        'client_id': KEYWORD,
+        'room_id': KEYWORD,
+        'is_paid': {'type': 'boolean'},
+        'start_dt': DATE,
+        'end_dt': DATE,
+    },
+}
+
+
+def room_document(room: dict, room_id: str) -> dict:
+    # rooms keep lat/lon as plain fields, the index queries them through one geo_point; room_id is a sortable
+    # copy of _id that breaks score ties when paging
+    document = {key: value for key, value in room.items() if key != '_id'}
+    document['room_id'] = room_id
+    if document.get('lat') is not None and document.get('lon') is not None:
+        document['location'] = {'lat': document['lat'], 'lon': document['lon']}
+    return document
+
+
+def get_index_settings(settings: Settings) -> dict:
+    return {
+        'number_of_shards': settings.elasticsearch_shards,
+        'number_of_replicas': settings.elasticsearch_replicas,
+        'refresh_interval': settings.elasticsearch_refresh_interval,
+    }
+
+
+def get_index_mappings(settings: Settings) -> dict:
+    return {
+        settings.elasticsearch_index_client: CLIENT_MAPPINGS,
+        settings.elasticsearch_index_room: ROOM_MAPPINGS,
+        settings.elasticsearch_index_booking: BOOKING_MAPPINGS,
+    }
+
+
+async def ensure_indices(elasticsearch_client: AsyncElasticsearch, settings: Settings):
+    index_settings = get_index_settings(settings)
+    for index, mappings in get_index_mappings(settings).items():
+        if not await elasticsearch_client.indices.exists(index=index):
+            await elasticsearch_client.indices.create(index=index, settings=index_settings, mappings=mappings)
+            logger.info('Index %s created', index)
+            continue
+        try:
+            await elasticsearch_client.indices.put_mapping(index=index, **mappings)
+            await elasticsearch_client.indices.put_settings(index=index, settings={
+                'refresh_interval': index_settings['refresh_interval'],
+                'number_of_replicas': index_settings['number_of_replicas'],
+            })
+        except BadRequestError as ex:
+            logger.error('Index %s has incompatible mappings and has to be reindexed: %s', index, ex)
+            continue
+        if index == settings.elasticsearch_index_room:
+            # rooms indexed before room_id was mapped get it copied from their _id in the background
+            await elasticsearch_client.update_by_query(
+                index=index, query={'bool': {'must_not': {'exists': {'field': 'room_id'}}}},
+                script={'source': 'ctx._source.room_id = ctx._id', 'lang': 'painless'},
+                conflicts='proceed', wait_for_completion=False)
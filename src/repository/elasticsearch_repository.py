@@ -1,70 +1,173 @@
-import os
-from elasticsearch import AsyncElasticsearch
+import asyncio
+import base64
+import json
+from elasticsearch import AsyncElasticsearch, NotFoundError
+from elasticsearch.helpers import async_streaming_bulk
 from fastapi import Depends
 
 from models.booking import Booking, UpdateBooking
 from models.client import Client, UpdateClient
 from models.room import Room, UpdateRoom
+from repository.cache_repository import invalidate_search_cache
+from repository.elasticsearch_indices import ensure_indices, room_document
+from utils.elasticsearch_query import QueryBuilder
+from utils.log import get_logger
+from utils.metrics import instrument
+from utils.settings import Settings, get_settings
+
+
+logger = get_logger('elasticsearch')
+
+DEFAULT_PAGE_SIZE = 100
+POINT_IN_TIME_KEEP_ALIVE = '1m'
+SCORE_SORT = [{'_score': 'desc'}, {'_shard_doc': 'asc'}]
+# unlike _shard_doc, room_id also breaks ties outside a point in time
+ROOM_TIEBREAK = [{'room_id': 'asc'}]
+ROOM_SORT = [{'_score': 'desc'}, *ROOM_TIEBREAK]
+GEO_FIELD = 'location'
 
 elasticsearch_client: AsyncElasticsearch = None
+elasticsearch_repository: 'ElasticSearchRepository' = None
+pending_writes = set()
+
+
+class InvalidCursorError(Exception):
+    pass
 
 
 def get_elasticsearch_client() -> AsyncElasticsearch:
     return elasticsearch_client
 
 
+def create_elasticsearch_client(settings: Settings) -> AsyncElasticsearch:
+    return AsyncElasticsearch(
+        settings.elasticsearch_uri.split(','),
+        connections_per_node=settings.elasticsearch_connections_per_node,
+        sniff_on_start=settings.elasticsearch_sniff_on_start,
+        sniff_on_node_failure=settings.elasticsearch_sniff_on_node_failure,
+        min_delay_between_sniffing=settings.elasticsearch_sniff_interval,
+        request_timeout=settings.elasticsearch_write_timeout,
+        max_retries=settings.elasticsearch_write_retries,
+    )
+
+
 async def connect_and_init_elasticsearch():
     global elasticsearch_client
-    elasticsearch_uri = os.getenv('ELASTICSEARCH_URI')
+    global elasticsearch_repository
+    settings = get_settings()
     try:
-        elasticsearch_client = AsyncElasticsearch(elasticsearch_uri.split(','))
+        elasticsearch_client = create_elasticsearch_client(settings)
+        elasticsearch_repository = ElasticSearchRepository(settings)
+        if settings.metrics_enabled:
+            instrument(elasticsearch_repository, 'elasticsearch')
         await elasticsearch_client.info()
-        print(f'Connected to elasticsearch with uri {elasticsearch_uri}')
+        logger.info('Connected to elasticsearch with uri %s', settings.elasticsearch_uri)
+        await ensure_indices(elasticsearch_client, settings)
     except Exception as ex:
-        print(f'Cant connect to elasticsearch: {ex}')
+        logger.error('Cant connect to elasticsearch: %s', ex)
+
+
+async def write_in_background(write, description: str):
+    try:
+        await write
+    except Exception as ex:
+        logger.error('Cant index %s in elasticsearch: %s', description, ex)
+
+
+def index_in_background(write, description: str):
+    # search documents are derived data, so requests do not wait for them once mongo has the write
+    task = asyncio.create_task(write_in_background(write, description))
+    pending_writes.add(task)
+    task.add_done_callback(pending_writes.discard)
 
 
 async def close_elasticsearch_connect():
     global elasticsearch_client
     if elasticsearch_client is None:
         return
+    if pending_writes:
+        await asyncio.gather(*pending_writes)
     await elasticsearch_client.close()
 
 class ElasticSearchRepository:
-    def __init__(self):
-        self._elasticsearch_index_client = os.getenv('ELASTICSEARCH_INDEX_CLIENT')
-        self._elasticsearch_index_room = os.getenv('ELASTICSEARCH_INDEX_ROOM')
-        self._elasticsearch_index_booking = os.getenv('ELASTICSEARCH_INDEX_BOOKING')
+    def __init__(self, settings: Settings):
+        self._elasticsearch_index_client = settings.elasticsearch_index_client
+        self._elasticsearch_index_room = settings.elasticsearch_index_room
+        self._elasticsearch_index_booking = settings.elasticsearch_index_booking
+        # searches are idempotent and user facing: short timeout, retried on timeout as well
+        self._reads = elasticsearch_client.options(request_timeout=settings.elasticsearch_search_timeout,
+                                                   max_retries=settings.elasticsearch_search_retries,
+                                                   retry_on_timeout=True)
+        self._writes = elasticsearch_client.options(request_timeout=settings.elasticsearch_write_timeout,
+                                                    max_retries=settings.elasticsearch_write_retries)
+
+    @property
+    def room_index(self) -> str:
+        return self._elasticsearch_index_room
 
     async def create_client(self, client_id: str, client: UpdateClient):
-        await elasticsearch_client.create(index=self._elasticsearch_index_client, id=client_id, document=dict(client))
+        await self._writes.create(index=self._elasticsearch_index_client, id=client_id, document=dict(client))
 
     async def create_booking(self, booking_id: str, booking: UpdateBooking):
-        await elasticsearch_client.create(index=self._elasticsearch_index_booking, id=booking_id, document=dict(booking))
+        await self._writes.create(index=self._elasticsearch_index_booking, id=booking_id, document=dict(booking))
 
     async def create_room(self, room_id: str, room: UpdateRoom):
-        await elasticsearch_client.create(index=self._elasticsearch_index_room, id=room_id, document=dict(room))
+        await self._writes.create(index=self._elasticsearch_index_room, id=room_id,
+                                  document=room_document(dict(room), room_id))
+        await invalidate_search_cache(self._elasticsearch_index_room)
+    
+    async def bulk_create(self, index: str, documents: list, chunk_size: int = 500) -> tuple:
+        actions = ({'_op_type': 'create', '_index': index, '_id': document_id, '_source': dict(document)}
+                   for document_id, document in documents)
+        indexed = 0
+        errors = {}
+        async for ok, item in async_streaming_bulk(self._writes, actions, chunk_size=chunk_size,
+                                                   raise_on_error=False, raise_on_exception=False,
+                                                   max_retries=3):
+            if ok:
+                indexed += 1
+            else:
+                result = item.get('create', {})
+                errors[result.get('_id')] = str(result.get('error', 'index error'))
+        return indexed, errors
+
+    async def bulk_create_clients(self, clients: list) -> tuple:
+        return await self.bulk_create(self._elasticsearch_index_client, clients)
+
+    async def bulk_create_rooms(self, rooms: list) -> tuple:
+        result = await self.bulk_create(self._elasticsearch_index_room,
+                                        [(room_id, room_document(dict(room), room_id)) for room_id, room in rooms])
+        await invalidate_search_cache(self._elasticsearch_index_room)
+        return result
+
+    async def bulk_create_bookings(self, bookings: list) -> tuple:
+        return await self.bulk_create(self._elasticsearch_index_booking, bookings)
     
     async def update_client(self, client_id: str, client: UpdateClient):
-        await elasticsearch_client.update(index=self._elasticsearch_index_client, id=client_id, document=dict(client))
+        await self._writes.update(index=self._elasticsearch_index_client, id=client_id, document=dict(client))
 
     async def update_booking(self, booking_id: str, booking: UpdateBooking):
-        await elasticsearch_client.update(index=self._elasticsearch_index_booking, id=booking_id, document=dict(booking))
+        await self._writes.update(index=self._elasticsearch_index_booking, id=booking_id, doc=dict(booking))
+
+    async def pay_booking(self, booking_id: str):
+        await self._writes.update(index=self._elasticsearch_index_booking, id=booking_id, doc={'is_paid': True})
 
     async def update_room(self, room_id: str, room: UpdateRoom):
-        await elasticsearch_client.update(index=self._elasticsearch_index_room, id=room_id, document=dict(room))
+        await self._writes.update(index=self._elasticsearch_index_room, id=room_id,
+                                  doc=room_document(dict(room), room_id))
+        await invalidate_search_cache(self._elasticsearch_index_room)
     
     async def delete_client(self, client_id: str, client: UpdateClient):
-        await elasticsearch_client.update(index=self._elasticsearch_index_client, id=client_id)
+        await self._writes.update(index=self._elasticsearch_index_client, id=client_id)
 
     async def delete_booking(self, booking_id: str, booking: UpdateBooking):
-        await elasticsearch_client.update(index=self._elasticsearch_index_booking, id=booking_id)
+        await self._writes.update(index=self._elasticsearch_index_booking, id=booking_id)
 
     async def delete_room(self, room_id: str, room: UpdateRoom):
-        await elasticsearch_client.update(index=self._elasticsearch_index_room, id=room_id)
+        await self._writes.update(index=self._elasticsearch_index_room, id=room_id)
 
     async def find_booking_by_query(self, query) -> list:
-        response = await elasticsearch_client.search(index=self._elasticsearch_index_booking, query=query,
+        response = await self._reads.search(index=self._elasticsearch_index_booking, query=query,
                                                            filter_path=['hits.hits._id', 'hits.hits._source'])
         if 'hits' not in response.body:
             return []
@@ -79,164 +182,194 @@ class ElasticSearchRepository:
         return booking
     
     async def find_booking_by_client_id(self, client_id: str) -> list:
-        query = {
-            "match": {
-                "client_id": client_id
-            }
-        }
+        query = QueryBuilder().term("client_id", client_id).build()
         booking = await self.find_booking_by_query(query)
         return booking
 
     async def find_booking_by_booking_date(self, booking_date: str) -> list:
-        query = {
-            "match": {
-                "booking_date": booking_date
-            }
-        }
+        query = QueryBuilder().match("booking_date", booking_date).build()
         booking = await self.find_booking_by_query(query)
         return booking
     
     async def find_booking_by_range(self, left_date: str, right_date: str) -> list:
-        query = {
-            "bool": {
-                "filter": [
-                    {
-                        "range": {
-                            "start_dt": {
-                                "gte": left_date,
-                                "lte": right_date,
-                            }
-                        }
-                    },
-                    {
-                        "range": {
-                            "end_dt": {
-                                "gte": left_date,
-                                "lte": right_date,
-                            }
-                        }
-                    },
-                ]
-            }
-        }
+        query = (QueryBuilder()
+                 .range("start_dt", gte=left_date, lte=right_date)
+                 .range("end_dt", gte=left_date, lte=right_date)
+                 .build())
         booking = await self.find_booking_by_query(query)
         return booking
     
     
     async def find_booking_by_room_id(self, room_id: str) -> list:
-        query = {
-            "match": {
-                "room_id": room_id
-            }
-        }
+        query = QueryBuilder().term("room_id", room_id).build()
         booking = await self.find_booking_by_query(query)
         return booking
 
 
-    async def find_rooms_by_query(self, query) -> list:
-        response = await elasticsearch_client.search(index=self._elasticsearch_index_room, query=query,
+    @staticmethod
+    def _rooms_from_hits(hits: list) -> list:
+        return Room.MapMany([{'_id': hit['_id'], **hit['_source']} for hit in hits])
+
+    @staticmethod
+    def _encode_cursor(position: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> dict:
+        try:
+            decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            pit_id = decoded.get('pit_id')
+            return {'pit_id': None if pit_id is None else str(pit_id), 'search_after': list(decoded['search_after'])}
+        except (ValueError, TypeError, KeyError, AttributeError):
+            raise InvalidCursorError(cursor)
+
+    async def find_rooms_by_query(self, query, size: int = DEFAULT_PAGE_SIZE) -> list:
+        response = await self._reads.search(index=self._elasticsearch_index_room, query=query, size=size,
                                                            filter_path=['hits.hits._id', 'hits.hits._source'])
         if 'hits' not in response.body:
             return []
         result = response.body['hits']['hits']
-        rooms = list(map(lambda room:
-                         Room(id=room['_id'],
-                                    description=room['_source']['description'],
-                                    country=room['_source']['country'],
-                                    city=room['_source']['city'],
-                                    name=room['_source']['name'],
-                                    address=room['_source']['address']
-                                    ), result))
-        return rooms    
-    
-    
-    
-    async def find_by_address(self, query: str):
-        query = {
-            "bool": {
-                "must": [
-                    {"match": {"address": query}},
-                ]
-            }
-        }
-        rooms = await self.find_rooms_by_query(query)
+        rooms = self._rooms_from_hits(result)
         return rooms
 
-    async def find_by_country(self, query: str):
-        query = {
-            "bool": {
-                "must": [
-                    {"match": {"country": query}},
-                ]
-            }
-        }
-        rooms = await self.find_rooms_by_query(query)
-        return rooms
+    async def _search_rooms_after(self, query, size: int, pit_id: str | None, search_after: list | None,
+                                  aggregations: dict | None = None, sort: list = ROOM_SORT) -> dict:
+        if pit_id is None:
+            target = {'index': self._elasticsearch_index_room}
+        else:
+            target = {'pit': {'id': pit_id, 'keep_alive': POINT_IN_TIME_KEEP_ALIVE}}
+        response = await self._reads.search(
+            **target, query=query, size=size, sort=sort, search_after=search_after, aggregations=aggregations,
+            filter_path=['pit_id', 'hits.total', 'hits.hits._id', 'hits.hits._source', 'hits.hits.sort',
+                         'aggregations'])
+        return response.body
 
-    async def find_by_city(self, query: str):
-        query = {
-            "bool": {
-                "must": [
-                    {"match": {"city": query}},
-                ]
-            }
-        }
-        rooms = await self.find_rooms_by_query(query)
-        return rooms
+    async def _find_rooms_page(self, query, size: int, cursor: str | None, aggregations: dict | None = None,
+                               sort: list = ROOM_SORT) -> tuple:
+        if cursor is None:
+            # most readers stop at the first page and the search cache shares it between clients, so it is a plain
+            # search; its last sort values are unique, so the next page starts right after it on any snapshot
+            body = await self._search_rooms_after(query, size, None, None, aggregations, sort)
+            hits = body.get('hits', {}).get('hits', [])
+            next_cursor = self._encode_cursor({'search_after': hits[-1]['sort']}) if len(hits) == size else None
+            return self._rooms_from_hits(hits), next_cursor, body
 
-    async def find_by_name(self, query: str):
-        query = {
-            "bool": {
-                "must": [
-                    {"match": {"name": query}},
-                ]
-            }
-        }
-        rooms = await self.find_rooms_by_query(query)
-        return rooms
+        decoded = self._decode_cursor(cursor)
+        pit_id, search_after = decoded['pit_id'], decoded['search_after']
+        opened = pit_id is None
+        if opened:
+            # the pages after the first share one point in time, writes in between cannot move rooms across them
+            point_in_time = await self._reads.open_point_in_time(index=self._elasticsearch_index_room,
+                                                                 keep_alive=POINT_IN_TIME_KEEP_ALIVE)
+            pit_id = point_in_time['id']
+
+        try:
+            body = await self._search_rooms_after(query, size, pit_id, search_after, aggregations, sort)
+        except NotFoundError:
+            raise InvalidCursorError(cursor)
+        except Exception:
+            if opened:
+                await self._reads.close_point_in_time(id=pit_id)
+            raise
+
+        pit_id = body.get('pit_id', pit_id)
+        hits = body.get('hits', {}).get('hits', [])
+        rooms = self._rooms_from_hits(hits)
+        if len(hits) < size:
+            await self._reads.close_point_in_time(id=pit_id)
+            return rooms, None, body
+        return rooms, self._encode_cursor({'pit_id': pit_id, 'search_after': hits[-1]['sort']}), body
 
-    async def check_booking_dates(self, room_id: str, start_dt: str, end_dt: str) -> bool:
-        index_exist = await elasticsearch_client.indices.exists(index=self._elasticsearch_index_booking)
-        if not index_exist:
-            return True
-        query_start = {
-            "bool": {
-                "filter": [
-                    {"match": {"room_id": room_id}},
-                    {
-                        "range": {
-                            "start_dt": {
-                                "gte": start_dt,
-                                "lte": end_dt,
-                            }
-                        }
-                    }
-                ]
-            }
+    async def find_rooms_page(self, query, size: int = DEFAULT_PAGE_SIZE, cursor: str | None = None) -> tuple:
+        rooms, next_cursor, _ = await self._find_rooms_page(query, size, cursor)
+        return rooms, next_cursor
+
+    async def search_rooms(self, text: str | None = None, country: str | None = None, city: str | None = None,
+                           size: int = DEFAULT_PAGE_SIZE, cursor: str | None = None, facet_size: int = 10) -> dict:
+        builder = (QueryBuilder()
+                   .multi_match(text, ['name', 'name._2gram', 'name._3gram', 'description', 'address'],
+                                match_type='bool_prefix')
+                   .term('country.keyword', country)
+                   .term('city.keyword', city))
+        if cursor is None:
+            builder.facet('country', 'country.keyword', facet_size).facet('city', 'city.keyword', facet_size)
+
+        rooms, next_cursor, body = await self._find_rooms_page(builder.build(), size, cursor,
+                                                               builder.build_aggregations())
+        return {
+            'rooms': rooms,
+            'total': body.get('hits', {}).get('total', {}).get('value'),
+            'facets': QueryBuilder.parse_facets(body.get('aggregations')),
+            'next_cursor': next_cursor,
         }
-        booking_start = await self.find_booking_by_query(query_start)
-        query_end = {
-            "bool": {
-                "filter": [
-                    {"match": {"room_id": room_id}},
-                    {
-                        "range": {
-                            "end_dt": {
-                                "gte": start_dt,
-                                "lte": end_dt,
-                            }
-                        }
-                    }
-                ]
-            }
+
+    async def _find_rooms_by_distance(self, query, lat: float, lon: float, size: int, cursor: str | None) -> dict:
+        sort = QueryBuilder.geo_distance_sort(GEO_FIELD, lat, lon) + ROOM_TIEBREAK
+        rooms, next_cursor, body = await self._find_rooms_page(query, size, cursor, sort=sort)
+        return {
+            'rooms': rooms,
+            'distances_km': [hit['sort'][0] for hit in body.get('hits', {}).get('hits', [])],
+            'total': body.get('hits', {}).get('total', {}).get('value'),
+            'next_cursor': next_cursor,
         }
-        booking_end = await self.find_booking_by_query(query_end)
-        print(booking_end)
-        if (len(booking_start) + len(booking_end)) == 0:
-            return True
-        else:
-            return False
+
+    async def find_rooms_near(self, lat: float, lon: float, radius_km: float, size: int = DEFAULT_PAGE_SIZE,
+                              cursor: str | None = None) -> dict:
+        query = QueryBuilder().geo_distance(GEO_FIELD, lat, lon, radius_km).build()
+        return await self._find_rooms_by_distance(query, lat, lon, size, cursor)
+
+    async def find_rooms_in_box(self, top: float, left: float, bottom: float, right: float,
+                                lat: float | None = None, lon: float | None = None, size: int = DEFAULT_PAGE_SIZE,
+                                cursor: str | None = None) -> dict:
+        if lat is None or lon is None:
+            # without an origin the rooms are ordered from the centre of the box
+            lat = (top + bottom) / 2
+            lon = (left + right) / 2 if left <= right else ((left + right + 360) / 2 + 180) % 360 - 180
+        query = QueryBuilder().geo_bounding_box(GEO_FIELD, top, left, bottom, right).build()
+        return await self._find_rooms_by_distance(query, lat, lon, size, cursor)
+
+    async def find_room_clusters(self, top: float, left: float, bottom: float, right: float,
+                                 precision: int) -> list:
+        builder = (QueryBuilder()
+                   .geo_bounding_box(GEO_FIELD, top, left, bottom, right)
+                   .geo_grid('clusters', GEO_FIELD, precision))
+        response = await self._reads.search(index=self._elasticsearch_index_room, query=builder.build(), size=0,
+                                            aggregations=builder.build_aggregations(), filter_path=['aggregations'])
+        return QueryBuilder.parse_geo_grid(response.body.get('aggregations', {}).get('clusters'))
+
+    async def stream_rooms(self, query, batch_size: int = 1000):
+        point_in_time = await self._reads.open_point_in_time(index=self._elasticsearch_index_room,
+                                                                      keep_alive=POINT_IN_TIME_KEEP_ALIVE)
+        pit_id, search_after = point_in_time['id'], None
+        try:
+            while True:
+                body = await self._search_rooms_after(query, batch_size, pit_id, search_after, sort=SCORE_SORT)
+                pit_id = body.get('pit_id', pit_id)
+                hits = body.get('hits', {}).get('hits', [])
+                for room in self._rooms_from_hits(hits):
+                    yield room
+                if len(hits) < batch_size:
+                    return
+                search_after = hits[-1]['sort']
+        finally:
+            await self._reads.close_point_in_time(id=pit_id)
+
+    @staticmethod
+    def room_field_query(field: str, value: str) -> dict:
+        return QueryBuilder().match(field, value).build()
+
+    async def find_by_address(self, query: str, size: int = DEFAULT_PAGE_SIZE, cursor: str | None = None) -> tuple:
+        return await self.find_rooms_page(self.room_field_query('address', query), size, cursor)
+
+    async def find_by_country(self, query: str, size: int = DEFAULT_PAGE_SIZE, cursor: str | None = None) -> tuple:
+        return await self.find_rooms_page(self.room_field_query('country', query), size, cursor)
+
+    async def find_by_city(self, query: str, size: int = DEFAULT_PAGE_SIZE, cursor: str | None = None) -> tuple:
+        return await self.find_rooms_page(self.room_field_query('city', query), size, cursor)
+
+    async def find_by_name(self, query: str, size: int = DEFAULT_PAGE_SIZE, cursor: str | None = None) -> tuple:
+        return await self.find_rooms_page(self.room_field_query('name', query), size, cursor)
 
     @staticmethod
     def get_instance():
-        return ElasticSearchRepository()
+        return elasticsearch_repository
@@ -1,48 +1,105 @@
-import os
+import asyncio
+from datetime import datetime, timedelta, timezone
 
+from bson import ObjectId
 from fastapi import Depends
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 
-from utils.mongo_utils import filter_by_id, filter_by_name
+from utils.date_utils import booking_nights
+from utils.log import get_logger
+from utils.mongo_utils import filter_by_id, filter_by_ids, filter_by_name, read_preference
 from models.booking import Booking, UpdateBooking
 from models.client import Client, UpdateClient
 from models.room import Room, UpdateRoom
+from utils.metrics import instrument
+from utils.settings import Settings, get_settings
 
 
+logger = get_logger('mongo')
+
 mongo_client: AsyncIOMotorClient = None
+mongo_repository: 'MongoRepository' = None
+
+
+def get_mongo_indexes(settings: Settings) -> dict:
+    return {
+        settings.mongo_clients_collection: [
+            IndexModel([('name', ASCENDING)], name='name_unique', unique=True),
+        ],
+        settings.mongo_rooms_collection: [
+            IndexModel([('name', ASCENDING)], name='name_unique', unique=True),
+        ],
+        settings.mongo_bookings_collection: [
+            IndexModel([('room_id', ASCENDING), ('start_dt', ASCENDING), ('end_dt', ASCENDING)],
+                       name='room_id_dates'),
+            IndexModel([('client_id', ASCENDING)], name='client_id'),
+        ],
+        settings.mongo_room_nights_collection: [
+            IndexModel([('booking_id', ASCENDING)], name='booking_id'),
+        ],
+    }
+
+
+async def create_mongo_indexes(database: AsyncIOMotorDatabase, settings: Settings):
+    for collection_name, indexes in get_mongo_indexes(settings).items():
+        try:
+            created = await database.get_collection(collection_name).create_indexes(indexes)
+            logger.info('Indexes %s ready on %s', created, collection_name)
+        except OperationFailure as ex:
+            logger.error('Cant create indexes on %s: %s', collection_name, ex)
+
+
+def create_mongo_client(settings: Settings) -> AsyncIOMotorClient:
+    # reads are routed per collection by the repository, the client itself stays on the primary
+    return AsyncIOMotorClient(
+        settings.mongo_uri,
+        maxPoolSize=settings.mongo_max_pool_size,
+        minPoolSize=settings.mongo_min_pool_size,
+        maxIdleTimeMS=settings.mongo_max_idle_time_ms,
+        waitQueueTimeoutMS=settings.mongo_wait_queue_timeout_ms,
+        connectTimeoutMS=settings.mongo_connect_timeout_ms,
+        serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+        timeoutMS=settings.mongo_timeout_ms,
+        retryReads=settings.mongo_retry_reads,
+        retryWrites=settings.mongo_retry_writes,
+    )
 
 
 async def connect_and_init_mongo():
     global mongo_client
-    mongo_uri = os.getenv('MONGO_URI')
-    mongo_db = os.getenv('MONGO_DB')
-    mongo_clients_collection = os.getenv('MONGO_CLIENTS_COLLECTION')
-    mongo_rooms_collection = os.getenv('MONGO_ROOMS_COLLECTION')
-    mongo_bookings_collection = os.getenv('MONGO_BOOKINGS_COLLECTION')
+    global mongo_repository
+    settings = get_settings()
 
     try:
-        mongo_client = AsyncIOMotorClient(mongo_uri)
+        mongo_client = create_mongo_client(settings)
+        database = mongo_client.get_database(settings.mongo_db)
+        mongo_repository = MongoRepository(database, settings)
+        if settings.metrics_enabled:
+            instrument(mongo_repository, 'mongo')
         await mongo_client.server_info()
-        print(f'Connected to mongo with uri {mongo_uri}')
-
-        if mongo_db not in await mongo_client.list_database_names():
-            await mongo_client.get_database(mongo_db).create_collection(mongo_clients_collection)
-            print(f'Collection {mongo_clients_collection} created', flush=True)
+        logger.info('Connected to mongo with uri %s', settings.mongo_uri)
+        hello = await database.command('hello')
+        mongo_repository.transactions = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+        if not mongo_repository.transactions:
+            logger.warning('Mongo is a standalone server, bookings are written without transactions')
 
-            await mongo_client.get_database(mongo_db).create_collection(mongo_rooms_collection)
-            print(f'Collection {mongo_rooms_collection} created', flush=True)
+        if settings.mongo_db not in await mongo_client.list_database_names():
+            for collection_name in [settings.mongo_clients_collection,
+                                    settings.mongo_rooms_collection,
+                                    settings.mongo_bookings_collection]:
+                await database.create_collection(collection_name)
+                logger.info('Collection %s created', collection_name)
 
-            await mongo_client.get_database(mongo_db).create_collection(mongo_bookings_collection)
-            print(f'Collection {mongo_bookings_collection} created', flush=True)
+            logger.info('Database %s created', settings.mongo_db)
 
-            mongo_clients_collection = mongo_client.get_database(mongo_db).get_collection(mongo_clients_collection)
-            mongo_rooms_collection = mongo_client.get_database(mongo_db).get_collection(mongo_rooms_collection)
-            mongo_bookings_collection = mongo_client.get_database(mongo_db).get_collection(mongo_bookings_collection)
-
-            print(f'Database {mongo_db} created', flush=True)
+        await create_mongo_indexes(database, settings)
+        if settings.mongo_check_query_plans:
+            await mongo_repository.check_query_plans()
 
     except Exception as ex:
-        print(f'Cant connect to mongo: {ex}', flush=True)
+        logger.error('Cant connect to mongo: %s', ex)
 
 
 def close_mongo_connect():
@@ -53,67 +110,292 @@ def close_mongo_connect():
 
 
 class MongoRepository:
-    def __init__(self):
-        mongo_db = os.getenv('MONGO_DB')
-        mongo_clients_collection = os.getenv('MONGO_CLIENTS_COLLECTION')
-        mongo_rooms_collection = os.getenv('MONGO_ROOMS_COLLECTION')
-        mongo_bookings_collection = os.getenv('MONGO_BOOKINGS_COLLECTION')
+    def __init__(self, database: AsyncIOMotorDatabase, settings: Settings):
+        self._client = database.client
+        # transactions need a replica set or mongos, connect_and_init_mongo finds out which one it talks to
+        self.transactions = False
+        self._mongo_clients_collection = database.get_collection(settings.mongo_clients_collection)
+        self._mongo_rooms_collection = database.get_collection(settings.mongo_rooms_collection)
+        self._mongo_bookings_collection = database.get_collection(settings.mongo_bookings_collection)
+        self._mongo_room_nights_collection = database.get_collection(settings.mongo_room_nights_collection)
+
+        # lookups may be served by a secondary within the staleness bound, unless the caller asks for the primary
+        reads = read_preference(settings.mongo_read_preference, settings.mongo_max_staleness_seconds)
+        self._mongo_clients_reads = self._mongo_clients_collection.with_options(read_preference=reads)
+        self._mongo_rooms_reads = self._mongo_rooms_collection.with_options(read_preference=reads)
+        self._mongo_bookings_reads = self._mongo_bookings_collection.with_options(read_preference=reads)
+
 
-        self._mongo_clients_collection = mongo_client.get_database(mongo_db).get_collection(mongo_clients_collection)
-        self._mongo_rooms_collection = mongo_client.get_database(mongo_db).get_collection(mongo_rooms_collection)
-        self._mongo_bookings_collection = mongo_client.get_database(mongo_db).get_collection(mongo_bookings_collection)
+    @staticmethod
+    async def _insert_many(collection: AsyncIOMotorCollection, documents: list) -> tuple:
+        errors = {}
+        try:
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as ex:
+            for write_error in ex.details.get('writeErrors', []):
+                errors[write_error['index']] = write_error.get('errmsg', 'write error')
+        ids = [None if i in errors else str(document['_id']) for i, document in enumerate(documents)]
+        return ids, errors
 
     
-    async def create_client(self, client: UpdateClient) -> str:
-        insert_result = await self._mongo_clients_collection.insert_one(dict(client))
+    async def create_client(self, client: UpdateClient) -> str | None:
+        try:
+            insert_result = await self._mongo_clients_collection.insert_one(dict(client))
+        except DuplicateKeyError:
+            return None
         return str(insert_result.inserted_id)
     
 
-    async def get_client_by_id(self, client_id: str) -> Client | None:
-        client = await self._mongo_clients_collection.find_one(filter_by_id(client_id))
+    async def create_clients(self, clients: list) -> tuple:
+        return await self._insert_many(self._mongo_clients_collection, [dict(client) for client in clients])
+    
+
+    async def get_client_by_id(self, client_id: str, primary: bool = False) -> Client | None:
+        collection = self._mongo_clients_collection if primary else self._mongo_clients_reads
+        client = await collection.find_one(filter_by_id(client_id))
         return Client.Map(client)
 
 
+    async def get_clients_by_ids(self, client_ids: list) -> list:
+        cursor = self._mongo_clients_reads.find(filter_by_ids(client_ids))
+        return Client.MapMany(await cursor.to_list(length=None))
+
+
     async def get_client_by_name(self, client_name: str) -> Client | None:
-        client = await self._mongo_clients_collection.find_one(filter_by_name(client_name))
+        client = await self._mongo_clients_reads.find_one(filter_by_name(client_name))
         return Client.Map(client)
     
 
-    async def create_room(self, room: UpdateClient) -> str:
-        insert_result = await self._mongo_rooms_collection.insert_one(dict(room))
+    async def create_room(self, room: UpdateRoom) -> str | None:
+        try:
+            insert_result = await self._mongo_rooms_collection.insert_one(dict(room))
+        except DuplicateKeyError:
+            return None
         return str(insert_result.inserted_id)
     
 
-    async def get_room_by_id(self, room_id: str) -> Room | None:
-        room = await self._mongo_rooms_collection.find_one(filter_by_id(room_id))
+    async def create_rooms(self, rooms: list) -> tuple:
+        return await self._insert_many(self._mongo_rooms_collection, [dict(room) for room in rooms])
+    
+
+    async def get_room_by_id(self, room_id: str, primary: bool = False) -> Room | None:
+        collection = self._mongo_rooms_collection if primary else self._mongo_rooms_reads
+        room = await collection.find_one(filter_by_id(room_id))
         return Room.Map(room)
     
 
+    async def get_rooms_by_ids(self, room_ids: list) -> list:
+        cursor = self._mongo_rooms_reads.find(filter_by_ids(room_ids))
+        return Room.MapMany(await cursor.to_list(length=None))
+    
+
     async def get_room_by_name(self, room_name: str) -> Room | None:
-        room = await self._mongo_rooms_collection.find_one(filter_by_name(room_name))
+        room = await self._mongo_rooms_reads.find_one(filter_by_name(room_name))
         return Room.Map(room)
 
 
-    async def book_room(self, booking: UpdateBooking) -> str:
-        insert_result = await self._mongo_bookings_collection.insert_one(dict(booking))
-        return str(insert_result.inserted_id)
+    @staticmethod
+    def _room_nights(booking_id: ObjectId, booking: UpdateBooking) -> list:
+        return [{'_id': f'{booking.room_id}:{night.isoformat()}', 'room_id': booking.room_id,
+                 'night': night.isoformat(), 'booking_id': booking_id}
+                for night in booking_nights(booking.start_dt, booking.end_dt)]
+
+
+    async def _insert_booking(self, booking_id: ObjectId, booking: UpdateBooking, room_nights: list, session=None):
+        await self._mongo_room_nights_collection.insert_many(room_nights, ordered=True, session=session)
+        await self._mongo_bookings_collection.insert_one({'_id': booking_id, **dict(booking)}, session=session)
+
+
+    async def book_room(self, booking: UpdateBooking) -> str | None:
+        booking_id = ObjectId()
+        room_nights = self._room_nights(booking_id, booking)
+        try:
+            if self.transactions:
+                # the nights and the booking commit together, a crash in between cannot leave the room blocked
+                async with await self._client.start_session() as session:
+                    await session.with_transaction(
+                        lambda session: self._insert_booking(booking_id, booking, room_nights, session))
+            else:
+                try:
+                    await self._insert_booking(booking_id, booking, room_nights)
+                except Exception:
+                    # without a transaction the nights are taken back by hand, the sweep catches a crash here
+                    await self._mongo_room_nights_collection.delete_many({'booking_id': booking_id})
+                    raise
+        except (BulkWriteError, DuplicateKeyError):
+            return None
+        return str(booking_id)
+    
+
+    @staticmethod
+    async def _existing_ids(collection: AsyncIOMotorCollection, ids: set) -> set:
+        valid_ids = [id for id in ids if ObjectId.is_valid(id)]
+        if not valid_ids:
+            return set()
+        cursor = collection.find(filter_by_ids(valid_ids), {'_id': 1})
+        return {str(document['_id']) async for document in cursor}
+
+
+    async def book_rooms(self, bookings: list) -> tuple:
+        # the same checks book_room_by_id makes, read from the primary since the referenced clients and rooms
+        # may have been imported a moment ago
+        client_ids, room_ids = await asyncio.gather(
+            self._existing_ids(self._mongo_clients_collection, {booking.client_id for booking in bookings}),
+            self._existing_ids(self._mongo_rooms_collection, {booking.room_id for booking in bookings}))
+        booking_ids = [ObjectId() for _ in bookings]
+        room_nights = []
+        night_positions = []
+        conflicts = {}
+        claimed_nights = set()
+        for position, (booking_id, booking) in enumerate(zip(booking_ids, bookings)):
+            if booking.client_id not in client_ids:
+                conflicts[position] = 'client does not exist'
+                continue
+            if booking.room_id not in room_ids:
+                conflicts[position] = 'room does not exist'
+                continue
+            nights = self._room_nights(booking_id, booking)
+            if any(night['_id'] in claimed_nights for night in nights):
+                conflicts[position] = 'room is already booked for these dates'
+                continue
+            claimed_nights.update(night['_id'] for night in nights)
+            room_nights.extend(nights)
+            night_positions.extend([position] * len(nights))
+
+        night_errors = {}
+        # insert_many refuses an empty list, which a chunk of only rejected bookings leaves
+        if room_nights:
+            _, night_errors = await self._insert_many(self._mongo_room_nights_collection, room_nights)
+        for i in night_errors:
+            conflicts[night_positions[i]] = 'room is already booked for these dates'
+        if conflicts:
+            await self._mongo_room_nights_collection.delete_many(
+                {'booking_id': {'$in': [booking_ids[position] for position in conflicts]}})
+
+        positions = [position for position in range(len(bookings)) if position not in conflicts]
+        documents = [{'_id': booking_ids[position], **dict(bookings[position])} for position in positions]
+        ids = [None] * len(bookings)
+        errors = dict(conflicts)
+        if documents:
+            inserted_ids, insert_errors = await self._insert_many(self._mongo_bookings_collection, documents)
+            for i, position in enumerate(positions):
+                ids[position] = inserted_ids[i]
+                if i in insert_errors:
+                    errors[position] = insert_errors[i]
+            failed = [booking_ids[positions[i]] for i in insert_errors]
+            if failed:
+                await self._mongo_room_nights_collection.delete_many({'booking_id': {'$in': failed}})
+        return ids, errors
     
 
+    async def backfill_room_nights(self, batch_size: int = 1000) -> dict:
+        # bookings made before the ledger existed hold no nights, so nothing stops their rooms being booked again
+        report = {'checked': 0, 'backfilled': 0, 'conflicts': []}
+        batch = []
+        async for document in self._mongo_bookings_collection.find({}):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                await self._backfill_room_nights(batch, report)
+                batch = []
+        if batch:
+            await self._backfill_room_nights(batch, report)
+        return report
+
+
+    async def _backfill_room_nights(self, bookings: list, report: dict):
+        booking_ids = [booking['_id'] for booking in bookings]
+        cursor = self._mongo_room_nights_collection.find({'booking_id': {'$in': booking_ids}}, {'booking_id': 1})
+        ledgered = {night['booking_id'] async for night in cursor}
+        report['checked'] += len(bookings)
+        for booking in bookings:
+            if booking['_id'] in ledgered:
+                continue
+            _, errors = await self._insert_many(self._mongo_room_nights_collection,
+                                                self._room_nights(booking['_id'], Booking.Map(booking)))
+            if errors:
+                # an overlapping booking already holds some of the nights, the rest are claimed anyway
+                report['conflicts'].append(str(booking['_id']))
+            report['backfilled'] += 1
+
+
+    async def sweep_room_nights(self, grace_seconds: float = 600.0, batch_size: int = 1000) -> int:
+        # nights whose booking was never written, the grace period leaves bookings still being written alone
+        cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=grace_seconds))
+        released = 0
+        booking_ids = set()
+        async for night in self._mongo_room_nights_collection.find({'booking_id': {'$lt': cutoff}}, {'booking_id': 1}):
+            booking_ids.add(night['booking_id'])
+            if len(booking_ids) >= batch_size:
+                released += await self._release_orphan_nights(booking_ids)
+                booking_ids = set()
+        if booking_ids:
+            released += await self._release_orphan_nights(booking_ids)
+        return released
+
+
+    async def _release_orphan_nights(self, booking_ids: set) -> int:
+        cursor = self._mongo_bookings_collection.find({'_id': {'$in': list(booking_ids)}}, {'_id': 1})
+        orphans = booking_ids - {booking['_id'] async for booking in cursor}
+        if not orphans:
+            return 0
+        result = await self._mongo_room_nights_collection.delete_many({'booking_id': {'$in': list(orphans)}})
+        return result.deleted_count
+
+
     async def pay_booking(self, booking_id: str) -> Booking | None:
-        cur_booking = Booking.Map(await self._mongo_bookings_collection.find_one(filter_by_id(booking_id)))
-        if cur_booking.is_paid == True:
-            print(f'Booking {booking_id} is already paid', flush=True)
-            return None
-        new_booking = Booking(id=cur_booking.id,start_dt=cur_booking.start_dt, end_dt=cur_booking.end_dt ,client_id=cur_booking.client_id, room_id=cur_booking.room_id, is_paid=True)
-        await self._mongo_bookings_collection.find_one_and_replace(filter_by_id(booking_id), dict(new_booking))
-        return new_booking
+        # one conditional round trip, concurrent payments of the same booking cannot both succeed
+        booking = await self._mongo_bookings_collection.find_one_and_update(
+            {**filter_by_id(booking_id), 'is_paid': False}, {'$set': {'is_paid': True}},
+            return_document=ReturnDocument.AFTER)
+        return Booking.Map(booking)
 
 
-    async def get_booking_by_id(self, booking_id: str) -> Booking | None:
-        booking = await self._mongo_bookings_collection.find_one(filter_by_id(booking_id))
+    async def get_booking_by_id(self, booking_id: str, primary: bool = False) -> Booking | None:
+        collection = self._mongo_bookings_collection if primary else self._mongo_bookings_reads
+        booking = await collection.find_one(filter_by_id(booking_id))
         return Booking.Map(booking)
 
 
+    async def get_bookings_by_ids(self, booking_ids: list) -> list:
+        cursor = self._mongo_bookings_reads.find(filter_by_ids(booking_ids))
+        return Booking.MapMany(await cursor.to_list(length=None))
+
+
+    @staticmethod
+    def _find_collscan(plan: dict) -> bool:
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        children = [plan.get('inputStage')] + plan.get('inputStages', [])
+        return any(MongoRepository._find_collscan(child) for child in children if child)
+
+
+    async def check_query_plans(self) -> list:
+        sample_id = str(ObjectId())
+        sample_dt = datetime.now()
+        queries = [
+            ('get_client_by_name', self._mongo_clients_collection, filter_by_name('')),
+            ('get_clients_by_ids', self._mongo_clients_collection, filter_by_ids([sample_id])),
+            ('get_room_by_name', self._mongo_rooms_collection, filter_by_name('')),
+            ('get_rooms_by_ids', self._mongo_rooms_collection, filter_by_ids([sample_id])),
+            ('get_bookings_by_ids', self._mongo_bookings_collection, filter_by_ids([sample_id])),
+            ('bookings_by_room_and_dates', self._mongo_bookings_collection,
+             {'room_id': sample_id, 'start_dt': {'$lt': sample_dt}, 'end_dt': {'$gt': sample_dt}}),
+            ('bookings_by_client', self._mongo_bookings_collection, {'client_id': sample_id}),
+            ('release_room_nights', self._mongo_room_nights_collection, {'booking_id': ObjectId(sample_id)}),
+        ]
+        collscans = []
+        for name, collection, query in queries:
+            try:
+                explain = await collection.find(query).explain()
+            except OperationFailure as ex:
+                logger.warning('Cant explain query %s: %s', name, ex)
+                continue
+            if self._find_collscan(explain['queryPlanner']['winningPlan']):
+                logger.warning('Query %s on %s falls back to COLLSCAN', name, collection.name)
+                collscans.append(name)
+        return collscans
+
+
     @staticmethod
     def get_instance():
-        return MongoRepository()
+        return mongo_repository
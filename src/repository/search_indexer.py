@@ -0,0 +1,283 @@
+import asyncio
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from elastic_transport import TransportError
+from elasticsearch.helpers import async_bulk
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+
+from repository import mongo_repository
+from repository.cache_repository import invalidate_search_cache
+from repository.elasticsearch_indices import room_document
+from repository.elasticsearch_repository import get_elasticsearch_client
+from utils.log import get_logger
+from utils.settings import get_settings
+
+
+logger = get_logger('search_indexer')
+
+CHANGE_STREAM_HISTORY_LOST = 286
+MAX_BACKOFF_SECONDS = 30.0
+
+
+def is_retryable(status) -> bool:
+    return not isinstance(status, int) or status == 429 or status >= 500
+
+
+class SearchIndexer(object):
+    def __init__(self, database, collections: dict, state_collection: str, batch_size: int = 500,
+                 flush_interval: float = 0.5, lease_ttl: float = 15.0):
+        self._database = database
+        self._collections = collections
+        self._state_collection = database.get_collection(state_collection)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._lease_ttl = lease_ttl
+        self._owner = f'{socket.gethostname()}-{uuid.uuid4().hex[:8]}'
+        self._task = None
+        self.is_leader = False
+        self.indexed = 0
+        self.errors = 0
+        self.retries = 0
+        self.dead_lettered = 0
+        self.last_event_time = None
+        self.last_flush_time = None
+        self.lag_seconds = 0.0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if self.is_leader:
+            await self._state_collection.delete_one({'_id': 'lease', 'owner': self._owner})
+            self.is_leader = False
+
+    async def _acquire_lease(self) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            lease = await self._state_collection.find_one_and_update(
+                {'_id': 'lease', '$or': [{'owner': self._owner}, {'expires_at': {'$lt': now}}]},
+                {'$set': {'owner': self._owner, 'expires_at': now + timedelta(seconds=self._lease_ttl)}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            return False
+        return lease is not None and lease['owner'] == self._owner
+
+    async def _load_resume_token(self):
+        state = await self._state_collection.find_one({'_id': 'resume_token'})
+        return None if state is None else state['token']
+
+    async def _save_resume_token(self, token):
+        await self._state_collection.update_one({'_id': 'resume_token'},
+                                                {'$set': {'token': token, 'updated_at': datetime.now(timezone.utc)}},
+                                                upsert=True)
+
+    def _backoff(self, attempt: int) -> float:
+        # never sleep through the lease, the leader renews it at a third of the ttl between attempts
+        return min(0.5 * 2 ** attempt, MAX_BACKOFF_SECONDS, self._lease_ttl / 3)
+
+    def _update_lag(self, batch: list):
+        # measured on every poll rather than on flush, so an idle stream reads as caught up and a batch
+        # stuck behind retries keeps ageing
+        self.lag_seconds = max(time.time() - batch[0]['clusterTime'].time, 0.0) if batch else 0.0
+
+    async def _run(self):
+        failures = 0
+        while True:
+            try:
+                self.is_leader = await self._acquire_lease()
+                if self.is_leader:
+                    await self._tail()
+                else:
+                    await asyncio.sleep(self._lease_ttl / 2)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as ex:
+                if ex.code == CHANGE_STREAM_HISTORY_LOST:
+                    logger.error('Search indexer resume token is no longer in the oplog, restarting from now; '
+                                 'a full reindex is required')
+                    await self._state_collection.delete_one({'_id': 'resume_token'})
+                else:
+                    logger.error('Search indexer failed: %s', ex)
+                    await asyncio.sleep(1)
+            except PyMongoError as ex:
+                logger.error('Search indexer failed: %s', ex)
+                await asyncio.sleep(1)
+            except Exception:
+                failures += 1
+                logger.exception('Search indexer failed, retrying in %.1fs', self._backoff(failures))
+                await asyncio.sleep(self._backoff(failures))
+
+    async def _tail(self):
+        pipeline = [{'$match': {'ns.coll': {'$in': list(self._collections)},
+                                'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+        resume_token = await self._load_resume_token()
+        lease_renewed = time.monotonic()
+
+        async with self._database.watch(pipeline, full_document='updateLookup', resume_after=resume_token,
+                                         max_await_time_ms=int(self._flush_interval * 1000)) as stream:
+            batch = []
+            batch_started = time.monotonic()
+            while True:
+                change = await stream.try_next()
+                if change is not None:
+                    batch.append(change)
+                self._update_lag(batch)
+                now = time.monotonic()
+                if batch and (len(batch) >= self._batch_size or now - batch_started >= self._flush_interval):
+                    if not await self._flush(batch):
+                        self.is_leader = False
+                        return
+                    batch = []
+                    lease_renewed = time.monotonic()
+                if not batch:
+                    batch_started = now
+                if now - lease_renewed >= self._lease_ttl / 3:
+                    if not await self._acquire_lease():
+                        self.is_leader = False
+                        return
+                    lease_renewed = now
+
+    @staticmethod
+    def _to_action(index: str, change: dict) -> dict | None:
+        document_id = str(change['documentKey']['_id'])
+        if change['operationType'] == 'delete':
+            return {'_op_type': 'delete', '_index': index, '_id': document_id}
+        document = change.get('fullDocument')
+        if document is None:
+            return None
+        if index == get_settings().elasticsearch_index_room:
+            source = room_document(document, document_id)
+        else:
+            source = {key: value for key, value in document.items() if key != '_id'}
+        return {'_op_type': 'index', '_index': index, '_id': document_id, '_source': source}
+
+    async def _bulk(self, actions: list) -> list:
+        """Apply actions and return the ones worth retrying; permanent failures are dead-lettered."""
+        try:
+            indexed, errors = await async_bulk(get_elasticsearch_client(), actions, raise_on_error=False,
+                                               raise_on_exception=False, max_retries=3)
+        except TransportError as ex:
+            logger.warning('Search indexer could not reach Elasticsearch: %s', ex)
+            return actions
+
+        self.indexed += indexed
+        by_key = {(action['_index'], action['_id']): action for action in actions}
+        retry = []
+        for error in errors:
+            op_type, item = next(iter(error.items()))
+            status = item.get('status')
+            if op_type == 'delete' and status == 404:
+                continue
+            self.errors += 1
+            action = by_key[(item['_index'], item['_id'])]
+            if is_retryable(status):
+                logger.warning('Search indexer will retry %s', error)
+                retry.append(action)
+            else:
+                logger.error('Search indexer could not apply %s', error)
+                await self._dead_letter(action, item)
+        return retry
+
+    async def _dead_letter(self, action: dict, item: dict):
+        self.dead_lettered += 1
+        await self._state_collection.update_one(
+            {'_id': f"failed:{action['_index']}:{action['_id']}"},
+            {'$set': {'index': action['_index'], 'document_id': action['_id'], 'op_type': action['_op_type'],
+                      'status': item.get('status'), 'error': item.get('error'),
+                      'failed_at': datetime.now(timezone.utc)}},
+            upsert=True)
+
+    async def _flush(self, batch: list) -> bool:
+        # Index actions carry the looked-up current document, so only the last action per
+        # document matters; collapsing them also makes retries order-independent.
+        actions = {}
+        for change in batch:
+            action = self._to_action(self._collections[change['ns']['coll']], change)
+            if action is not None:
+                actions[(action['_index'], action['_id'])] = action
+        actions = list(actions.values())
+
+        pending, attempt = actions, 0
+        while pending:
+            pending = await self._bulk(pending)
+            if pending:
+                # The resume token stays put until every event is applied; if the lease is lost
+                # meanwhile the next leader replays the batch from the last saved token.
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt))
+                self._update_lag(batch)
+                if not await self._acquire_lease():
+                    return False
+
+        room_index = get_settings().elasticsearch_index_room
+        if any(action['_index'] == room_index for action in actions):
+            await invalidate_search_cache(room_index)
+
+        await self._save_resume_token(batch[-1]['_id'])
+        self.last_event_time = batch[-1]['clusterTime'].time
+        self.last_flush_time = time.time()
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'enabled': True,
+            'leader': self.is_leader,
+            'owner': self._owner,
+            'indexed': self.indexed,
+            'errors': self.errors,
+            'retries': self.retries,
+            'dead_lettered': self.dead_lettered,
+            'lag_seconds': round(self.lag_seconds, 3),
+            'last_event_time': self.last_event_time,
+            'last_flush_time': self.last_flush_time,
+        }
+
+
+search_indexer: SearchIndexer = None
+
+
+def search_indexer_enabled() -> bool:
+    return get_settings().search_indexer_enabled
+
+
+async def start_search_indexer():
+    global search_indexer
+    settings = get_settings()
+    if not settings.search_indexer_enabled:
+        return
+
+    collections = {
+        settings.mongo_clients_collection: settings.elasticsearch_index_client,
+        settings.mongo_rooms_collection: settings.elasticsearch_index_room,
+        settings.mongo_bookings_collection: settings.elasticsearch_index_booking,
+    }
+    database = mongo_repository.mongo_client.get_database(settings.mongo_db)
+    search_indexer = SearchIndexer(database, collections, settings.search_indexer_state_collection,
+                                   batch_size=settings.search_indexer_batch_size,
+                                   flush_interval=settings.search_indexer_flush_interval)
+    search_indexer.start()
+    logger.info('Search indexer started')
+
+
+async def stop_search_indexer():
+    if search_indexer is not None:
+        await search_indexer.stop()
+
+
+def get_search_indexer_stats() -> dict:
+    if search_indexer is None:
+        return {'enabled': False}
+    return search_indexer.stats()
@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from dotenv import load_dotenv
+
+from repository.mongo_repository import MongoRepository, connect_and_init_mongo, close_mongo_connect
+from utils.log import configure_logging, stop_logging
+from utils.settings import get_settings
+
+
+async def run(args) -> dict:
+    settings = get_settings()
+    configure_logging(settings.log_level, settings.log_format, settings.log_rate_limit, settings.log_rate_interval)
+    await connect_and_init_mongo()
+    try:
+        repository = MongoRepository.get_instance()
+        if args.command == 'backfill':
+            return await repository.backfill_room_nights(args.batch_size)
+        return {'released': await repository.sweep_room_nights(args.grace_seconds, args.batch_size)}
+    finally:
+        close_mongo_connect()
+        stop_logging()
+
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Maintain the room nights ledger that prevents double booking')
+    parser.add_argument('command', choices=['backfill', 'sweep'],
+                        help='backfill: claim the nights of bookings made before the ledger existed; '
+                             'sweep: release nights whose booking was never written')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--grace-seconds', type=float, default=600.0,
+                        help='sweep only nights older than this, bookings younger may still be in flight')
+
+    report = asyncio.run(run(parser.parse_args()))
+    json.dump(report, sys.stdout, indent=2)
+    print()
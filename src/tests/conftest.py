@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+
+import pytest
+
+from bench.load_test import add_arguments, asgi_request, bench_environment
+
+
+def bench_args(*argv: str) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    return parser.parse_args(['--rooms', '5', '--clients', '2', '--bookings', '0', '--no-metrics', *argv])
+
+
+class App(object):
+    # the real app on top of the bench fakes, requests go straight through ASGI
+    def __init__(self, app, workload):
+        self.app = app
+        self.room_ids = workload._room_ids
+        self.client_ids = workload._client_ids
+
+    async def get(self, path: str, **query) -> tuple:
+        return await asgi_request(self.app, 'GET', f'/airbnb{path}', query, None)
+
+    async def post(self, path: str, **query) -> tuple:
+        return await asgi_request(self.app, 'POST', f'/airbnb{path}', query, None)
+
+    async def book(self, room_id: str, start_dt: str, end_dt: str) -> tuple:
+        return await self.post('/bookings/book_room', client_id=self.client_ids[0], room_id=room_id,
+                               is_paid='false', start_dt=start_dt, end_dt=end_dt)
+
+
+@pytest.fixture
+def run_app():
+    def run(test, *argv: str):
+        async def main():
+            async with bench_environment(bench_args(*argv)) as (app, workload, _):
+                await test(App(app, workload))
+        asyncio.run(main())
+    return run
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from models.booking import UpdateBooking
+from repository.availability_repository import get_availability_repository
+
+
+@pytest.mark.parametrize('mongo', [[], ['--mongo-standalone']], ids=['replica_set', 'standalone'])
+def test_conflicting_booking_is_rejected(run_app, mongo):
+    async def test(app):
+        room_id = app.room_ids[0]
+        status, _ = await app.book(room_id, '2031-01-01T00:00:00', '2031-01-04T00:00:00')
+        assert status == 200
+        status, _ = await app.book(room_id, '2031-01-03T00:00:00', '2031-01-05T00:00:00')
+        assert status == 400
+        # the rejected booking gives back the nights it did not conflict on
+        status, _ = await app.book(room_id, '2031-01-04T00:00:00', '2031-01-05T00:00:00')
+        assert status == 200
+
+    run_app(test, *mongo)
+
+
+@pytest.mark.parametrize('mongo', [[], ['--mongo-standalone']], ids=['replica_set', 'standalone'])
+def test_ledger_rejects_overlap_behind_the_index(run_app, mongo):
+    # two requests can both pass the availability pre-check, the ledger is what turns the second away
+    async def test(app):
+        repository = app.app.state.mongo_repository
+        assert repository.transactions == (not mongo)
+        booking = UpdateBooking(client_id=app.client_ids[0], room_id=app.room_ids[0], is_paid=False,
+                                start_dt='2031-02-01T12:00:00', end_dt='2031-02-03T12:00:00')
+        assert await repository.book_room(booking) is not None
+        assert await repository.book_room(booking.model_copy(update={'client_id': app.client_ids[1]})) is None
+        nights = repository._mongo_room_nights_collection
+        assert await nights.count_documents({'room_id': app.room_ids[0]}) == 2
+
+    run_app(test, *mongo)
+
+
+@pytest.mark.parametrize('mongo', [[], ['--mongo-standalone']], ids=['replica_set', 'standalone'])
+def test_index_and_ledger_agree_on_nights(run_app, mongo):
+    # a same-day stay holds the whole night in both, so the index never offers what the ledger refuses
+    async def test(app):
+        room_id = app.room_ids[0]
+
+        async def available(start_dt, end_dt) -> bool:
+            status, body = await app.get(f'/availability/rooms/{room_id}', start_dt=start_dt, end_dt=end_dt)
+            assert status == 200
+            return json.loads(body)['available']
+
+        status, _ = await app.book(room_id, '2031-03-01T08:00:00', '2031-03-01T12:00:00')
+        assert status == 200
+        for _ in range(2):
+            assert not await available('2031-03-01T14:00:00', '2031-03-01T16:00:00')
+            assert await available('2031-03-02T00:00:00', '2031-03-03T00:00:00')
+            # rebuilt from the stored bookings the index still agrees
+            await get_availability_repository().rebuild()
+
+        status, _ = await app.book(room_id, '2031-03-01T14:00:00', '2031-03-01T16:00:00')
+        assert status == 400
+        repository = app.app.state.mongo_repository
+        same_day = UpdateBooking(client_id=app.client_ids[0], room_id=room_id, is_paid=False,
+                                 start_dt='2031-03-01T14:00:00', end_dt='2031-03-01T16:00:00')
+        assert await repository.book_room(same_day) is None
+        status, _ = await app.book(room_id, '2031-03-02T09:00:00', '2031-03-02T18:00:00')
+        assert status == 200
+
+    run_app(test, *mongo)
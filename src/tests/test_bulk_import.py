@@ -0,0 +1,44 @@
+import json
+
+from bson import ObjectId
+
+from repository.availability_repository import get_availability_repository
+from utils.bulk_import import BulkImporter
+
+
+async def lines(records: list):
+    for record in records:
+        yield json.dumps(record)
+
+
+def test_imported_bookings_go_through_the_ledger(run_app):
+    async def test(app):
+        room_id, client_id = app.room_ids[0], app.client_ids[0]
+
+        def booking(start_dt, end_dt, **fields):
+            return {'client_id': client_id, 'room_id': room_id, 'is_paid': False,
+                    'start_dt': start_dt, 'end_dt': end_dt, **fields}
+
+        status, _ = await app.book(room_id, '2032-01-01T00:00:00', '2032-01-03T00:00:00')
+        assert status == 200
+        availability = get_availability_repository()
+        importer = BulkImporter('bookings', app.app.state.mongo_repository, app.app.state.elasticsearch_repository,
+                                availability, chunk_size=10, index=False)
+        report = await importer.run(lines([
+            booking('2032-02-01T00:00:00', '2032-02-03T00:00:00'),
+            booking('2032-03-05T00:00:00', '2032-03-01T00:00:00'),
+            booking('2032-01-02T00:00:00', '2032-01-04T00:00:00'),
+            booking('2032-02-02T00:00:00', '2032-02-04T00:00:00'),
+            booking('2032-04-01T00:00:00', '2032-04-02T00:00:00', client_id=str(ObjectId())),
+            booking('2032-04-01T00:00:00', '2032-04-02T00:00:00', room_id='not-an-id'),
+        ]), 'ndjson')
+
+        assert report['inserted'] == 1
+        assert {failure['record']: failure['stage'] for failure in report['failures']} == {
+            2: 'validate', 3: 'insert', 4: 'insert', 5: 'insert', 6: 'insert'}
+        # the imported booking blocks its nights in the availability index straight away
+        assert not availability.is_room_free(room_id, '2032-02-02T00:00:00', '2032-02-03T00:00:00')
+        status, _ = await app.book(room_id, '2032-02-02T00:00:00', '2032-02-03T00:00:00')
+        assert status == 400
+
+    run_app(test)
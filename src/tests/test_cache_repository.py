@@ -0,0 +1,60 @@
+import asyncio
+
+from repository.cache_repository import get_clients_cache, get_rooms_cache
+from utils.cache_utils import FLAG_BINARY
+from utils.settings import get_settings
+
+
+async def corrupt(uris: str, key: str, data: bytes):
+    # written on every node, whichever one the key hashes to then holds the bad entry
+    for uri in uris.split(','):
+        host, port = uri.rsplit(':', 1)
+        reader, writer = await asyncio.open_connection(host, int(port))
+        writer.write(b'set %s %d 0 %d\r\n%s\r\n' % (key.encode(), FLAG_BINARY, len(data), data))
+        assert await reader.readline() == b'STORED\r\n'
+        writer.close()
+        await writer.wait_closed()
+
+
+def test_primary_read_does_not_join_a_secondary_read(run_app):
+    async def test(app):
+        cache = get_clients_cache()
+        lagging = asyncio.Event()
+
+        async def read_secondary():
+            # a secondary that has not seen the client yet
+            await lagging.wait()
+            return None
+
+        async def read_primary():
+            return 'client'
+
+        secondary = asyncio.create_task(cache.get_or_load('fresh', read_secondary))
+        await asyncio.sleep(0)
+        assert await cache.get_or_load('fresh', read_primary, primary=True) == 'client'
+        lagging.set()
+        assert await secondary is None
+
+    run_app(test)
+
+
+def test_corrupt_entry_is_reloaded_and_overwritten(run_app):
+    async def test(app):
+        room_id = app.room_ids[0]
+        status, body = await app.get(f'/rooms/{room_id}')
+        assert status == 200
+
+        # format version 1, orjson, compressed, first registered model, then a body that is not zlib
+        await corrupt(get_settings().memcached_rooms_uri, room_id, b'\x01\x81\x01not zlib')
+        cache = get_rooms_cache()
+        cache.invalidate_local(room_id)
+        loads = cache.loads
+        assert await app.get(f'/rooms/{room_id}') == (status, body)
+        assert cache.loads == loads + 1
+
+        # the reload replaced the bad entry, the next worker to miss locally reads it from memcached
+        cache.invalidate_local(room_id)
+        assert await app.get(f'/rooms/{room_id}') == (status, body)
+        assert cache.loads == loads + 1
+
+    run_app(test)
@@ -0,0 +1,41 @@
+import zlib
+
+import pytest
+
+from models.room import Room
+from utils.cache_utils import BinarySerializer, FLAG_BINARY, FLAG_STR
+
+
+ROOM = Room(id='r1', name='Loft', country='PT', city='Porto', address='Rua 1', description='x' * 2048)
+
+
+@pytest.fixture
+def serde():
+    return BinarySerializer([Room], compress_threshold=1024)
+
+
+def test_round_trip(serde):
+    data, flags = serde.serialize('room:r1', ROOM)
+    assert serde.deserialize('room:r1', data, flags) == ROOM
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda data: data[:3] + b'not zlib',
+    lambda data: data[:3] + zlib.compress(b'{"id": "r1"'),
+    lambda data: data[:3] + zlib.compress(b'{"id": "r1"}'),
+    lambda data: data[:1] + bytes((data[1] & 0x7f,)) + data[2:],
+], ids=['bad_zlib', 'truncated_json', 'invalid_model', 'wrong_compression_bit'])
+def test_corrupt_entry_reads_as_miss(serde, corrupt):
+    data, flags = serde.serialize('room:r1', ROOM)
+    data = corrupt(data)
+    assert serde.deserialize('room:r1', data, flags) is None
+
+
+def test_bad_zlib_has_no_json_body(serde):
+    data, flags = serde.serialize('room:r1', ROOM)
+    assert serde.json_body(data[:3] + b'not zlib', flags) is None
+
+
+def test_non_utf8_string_reads_as_miss(serde):
+    assert serde.deserialize('counter', b'\xff\xfe', FLAG_STR) is None
+    assert serde.deserialize('counter', b'\x01', FLAG_BINARY) is None
@@ -0,0 +1,9 @@
+from utils.local_cache import LocalCache
+
+
+def test_entry_ttl_is_bounded_by_the_l1_ttl():
+    cache = LocalCache(1024, default_ttl=5.0)
+    cache.set('long', 'value', 5, ttl=3600)
+    cache.set('short', 'value', 5, ttl=1)
+    assert 0 < cache.ttl_remaining('long') <= 5.0
+    assert cache.ttl_remaining('short') <= 1.0
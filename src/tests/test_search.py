@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+
+async def walk(app, size: int, query: dict, between_pages=None) -> list:
+    ids, cursor = [], None
+    while True:
+        params = dict(query, size=size, **({'cursor': cursor} if cursor else {}))
+        status, body = await app.get('/search/rooms', **params)
+        assert status == 200
+        page = json.loads(body)
+        ids += [room['id'] for room in page['rooms']]
+        cursor = page['next_cursor']
+        if not cursor:
+            return ids
+        if between_pages is not None:
+            await between_pages(len(ids))
+
+
+@pytest.mark.parametrize('query', ['country', 'text'])
+def test_cursor_paging_across_writes(run_app, query):
+    # rooms created while a client pages through results must not shift the pages it has yet to read
+    async def test(app):
+        status, body = await app.get(f'/rooms/{app.room_ids[0]}')
+        room = json.loads(body)
+        params = {'country': room['country']} if query == 'country' else {'q': room['name'].split()[0]}
+        before = await walk(app, 100, params)
+        assert len(before) > 4
+
+        async def create_room(seen: int):
+            # matches the query, so it may rank among the pages already read as well as those still to come
+            word = params.get('q', 'new')
+            status, _ = await app.post('/rooms', name=f'{word} {word} {word} {seen}', country=room['country'],
+                                       city=room['city'], address='1 new street', description=f'{word} {word}')
+            assert status == 200
+
+        ids = await walk(app, 2, params, create_room)
+        assert len(ids) == len(set(ids))
+        assert set(before) <= set(ids)
+        assert not app.app.state.elasticsearch_repository._reads._points_in_time
+
+    run_app(test, '--rooms', '30')
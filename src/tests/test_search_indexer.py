@@ -0,0 +1,25 @@
+import time
+
+from bson import Timestamp
+
+from bench.fakes import FakeMongoClient
+from repository.search_indexer import SearchIndexer
+
+
+def indexer(lease_ttl: float = 15.0) -> SearchIndexer:
+    return SearchIndexer(FakeMongoClient().get_database('test'), {}, 'indexer_state', lease_ttl=lease_ttl)
+
+
+def test_backoff_stays_under_the_lease():
+    search_indexer = indexer(lease_ttl=15.0)
+    assert search_indexer._backoff(1) == 1.0
+    assert max(search_indexer._backoff(attempt) for attempt in range(20)) == 5.0
+
+
+def test_lag_follows_the_pending_batch():
+    search_indexer = indexer()
+    search_indexer._update_lag([{'clusterTime': Timestamp(int(time.time()) - 60, 1)}])
+    assert search_indexer.lag_seconds >= 59
+    # an idle stream has nothing left to apply
+    search_indexer._update_lag([])
+    assert search_indexer.lag_seconds == 0.0
@@ -0,0 +1,10 @@
+from utils.tracing import Tracer
+
+
+def test_recent_returns_at_most_limit_traces():
+    tracer = Tracer(sample_rate=1.0, buffer_size=10)
+    for path in ('/a', '/b', '/c'):
+        tracer.finish(tracer.start('GET', path), path, 200, 0.001)
+    assert [trace['path'] for trace in tracer.recent(2)] == ['/b', '/c']
+    assert tracer.recent(0) == []
+    assert tracer.recent(-1) == []
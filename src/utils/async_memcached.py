@@ -0,0 +1,204 @@
+import asyncio
+import bisect
+import hashlib
+
+from utils.log import get_logger
+
+
+logger = get_logger('memcached')
+
+
+class MemcachedNode(object):
+    def __init__(self, server: str, pool_size: int = 10, timeout: float = 1.0):
+        host, _, port = server.strip().partition(':')
+        self.server = server.strip()
+        self._host = host
+        self._port = int(port or 11211)
+        self._timeout = timeout
+        self._pool = asyncio.LifoQueue(maxsize=pool_size)
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def _acquire(self):
+        await self._slots.acquire()
+        try:
+            while not self._pool.empty():
+                reader, writer = self._pool.get_nowait()
+                if not writer.is_closing():
+                    return reader, writer
+            return await asyncio.wait_for(asyncio.open_connection(self._host, self._port), self._timeout)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken: bool = False):
+        reader, writer = conn
+        if broken or writer.is_closing():
+            writer.close()
+        else:
+            self._pool.put_nowait(conn)
+        self._slots.release()
+
+    async def execute(self, request: bytes, parse):
+        conn = await self._acquire()
+        try:
+            reader, writer = conn
+            writer.write(request)
+            result = await asyncio.wait_for(self._exchange(writer, reader, parse), self._timeout)
+        except BaseException:
+            self._release(conn, broken=True)
+            raise
+        self._release(conn)
+        return result
+
+    @staticmethod
+    async def _exchange(writer, reader, parse):
+        await writer.drain()
+        return await parse(reader)
+
+    async def close(self):
+        while not self._pool.empty():
+            _, writer = self._pool.get_nowait()
+            writer.close()
+
+
+class AsyncHashClient(object):
+    def __init__(self, servers: list, serde=None, pool_size: int = 10, timeout: float = 1.0,
+                 replicas: int = 160):
+        self._serde = serde
+        self._nodes = {}
+        self._ring = []
+        self._ring_nodes = []
+
+        points = []
+        for server in servers:
+            node = MemcachedNode(server, pool_size=pool_size, timeout=timeout)
+            self._nodes[node.server] = node
+            for i in range(replicas // 4):
+                digest = hashlib.md5(f'{node.server}-{i}'.encode()).digest()
+                for j in range(4):
+                    point = int.from_bytes(digest[j * 4:j * 4 + 4], 'little')
+                    points.append((point, node))
+        points.sort(key=lambda point: point[0])
+        self._ring = [point for point, _ in points]
+        self._ring_nodes = [node for _, node in points]
+
+    def _get_node(self, key: str) -> MemcachedNode:
+        digest = hashlib.md5(key.encode()).digest()
+        point = int.from_bytes(digest[0:4], 'little')
+        index = bisect.bisect(self._ring, point) % len(self._ring)
+        return self._ring_nodes[index]
+
+    def _group_by_node(self, keys) -> dict:
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._get_node(key), []).append(key)
+        return groups
+
+    def _serialize(self, key: str, value):
+        if self._serde is None:
+            return value if isinstance(value, bytes) else str(value).encode(), 0
+        data, flags = self._serde.serialize(key, value)
+        if isinstance(data, str):
+            data = data.encode()
+        return data, flags
+
+    def _deserialize(self, key: str, value: bytes, flags: int):
+        if self._serde is None:
+            return value
+        return self._serde.deserialize(key, value, flags)
+
+    @staticmethod
+    async def _read_values(reader) -> dict:
+        values = {}
+        while True:
+            line = await reader.readline()
+            if line == b'END\r\n':
+                return values
+            if not line.startswith(b'VALUE '):
+                raise ConnectionError(f'Unexpected memcached response: {line!r}')
+            _, key, flags, size = line.split()[:4]
+            data = await reader.readexactly(int(size) + 2)
+            values[key.decode()] = (data[:-2], int(flags))
+
+    @staticmethod
+    def _read_lines(count: int):
+        async def parse(reader):
+            return [(await reader.readline()).rstrip(b'\r\n') for _ in range(count)]
+        return parse
+
+    async def _get_many_from_node(self, node: MemcachedNode, keys: list) -> dict:
+        try:
+            return await node.execute(f'get {" ".join(keys)}\r\n'.encode(), self._read_values)
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError) as ex:
+            logger.warning('Memcached get on %s failed: %s', node.server, ex)
+            return {}
+
+    async def get_many_raw(self, keys) -> dict:
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        groups = self._group_by_node(keys)
+        responses = await asyncio.gather(*(self._get_many_from_node(node, node_keys)
+                                           for node, node_keys in groups.items()))
+        result = {}
+        for response in responses:
+            result.update(response)
+        return result
+
+    async def get_many(self, keys) -> dict:
+        result = {}
+        for key, (value, flags) in (await self.get_many_raw(keys)).items():
+            value = self._deserialize(key, value, flags)
+            if value is not None:
+                result[key] = value
+        return result
+
+    async def get(self, key: str, default=None):
+        result = await self.get_many([key])
+        return result.get(key, default)
+
+    async def _store(self, command: str, node: MemcachedNode, items: dict, expire: int) -> list:
+        request = bytearray()
+        for key, value in items.items():
+            data, flags = self._serialize(key, value)
+            request += f'{command} {key} {flags} {expire} {len(data)}\r\n'.encode()
+            request += data + b'\r\n'
+        try:
+            replies = await node.execute(bytes(request), self._read_lines(len(items)))
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError) as ex:
+            logger.warning('Memcached %s on %s failed: %s', command, node.server, ex)
+            return list(items)
+        return [key for key, reply in zip(items, replies) if reply != b'STORED']
+
+    async def set_many(self, values: dict, expire: int = 0) -> list:
+        groups = self._group_by_node(values)
+        failed = await asyncio.gather(*(self._store('set', node, {key: values[key] for key in keys}, expire)
+                                        for node, keys in groups.items()))
+        return [key for keys in failed for key in keys]
+
+    async def set(self, key: str, value, expire: int = 0) -> bool:
+        return not await self._store('set', self._get_node(key), {key: value}, expire)
+
+    async def add(self, key: str, value, expire: int = 0) -> bool:
+        return not await self._store('add', self._get_node(key), {key: value}, expire)
+
+    async def incr(self, key: str, delta: int = 1) -> int | None:
+        node = self._get_node(key)
+        try:
+            replies = await node.execute(f'incr {key} {delta}\r\n'.encode(), self._read_lines(1))
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError) as ex:
+            logger.warning('Memcached incr on %s failed: %s', node.server, ex)
+            return None
+        return int(replies[0]) if replies[0].isdigit() else None
+
+    async def delete(self, key: str) -> bool:
+        node = self._get_node(key)
+        try:
+            replies = await node.execute(f'delete {key}\r\n'.encode(), self._read_lines(1))
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError) as ex:
+            logger.warning('Memcached delete on %s failed: %s', node.server, ex)
+            return False
+        return replies[0] == b'DELETED'
+
+    async def close(self):
+        await asyncio.gather(*(node.close() for node in self._nodes.values()))
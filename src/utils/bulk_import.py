@@ -0,0 +1,166 @@
+import asyncio
+import csv
+import json
+import time
+
+from pydantic import ValidationError
+
+from models.booking import UpdateBooking
+from models.client import UpdateClient
+from models.room import UpdateRoom
+
+
+IMPORT_MODELS = {
+    'clients': UpdateClient,
+    'rooms': UpdateRoom,
+    'bookings': UpdateBooking,
+}
+
+IMPORT_WRITERS = {
+    'clients': ('create_clients', 'bulk_create_clients'),
+    'rooms': ('create_rooms', 'bulk_create_rooms'),
+    'bookings': ('book_rooms', 'bulk_create_bookings'),
+}
+
+MAX_REPORTED_FAILURES = 1000
+
+
+class ImportReport(object):
+    def __init__(self, entity: str):
+        self.entity = entity
+        self.received = 0
+        self.inserted = 0
+        self.indexed = 0
+        self.failed = 0
+        self.failures = []
+        self._started = time.monotonic()
+
+    def fail(self, record_number: int, stage: str, error: str):
+        self.failed += 1
+        if len(self.failures) < MAX_REPORTED_FAILURES:
+            self.failures.append({'record': record_number, 'stage': stage, 'error': error})
+
+    def to_dict(self) -> dict:
+        elapsed = time.monotonic() - self._started
+        return {
+            'entity': self.entity,
+            'received': self.received,
+            'inserted': self.inserted,
+            'indexed': self.indexed,
+            'failed': self.failed,
+            'failures': self.failures,
+            'elapsed_seconds': round(elapsed, 3),
+            'records_per_second': round(self.inserted / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+
+
+async def iter_lines(chunks):
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8').rstrip('\r')
+    if buffer:
+        yield buffer.decode('utf-8').rstrip('\r')
+
+
+async def parse_records(lines, data_format: str):
+    header = None
+    async for line in lines:
+        if not line.strip():
+            continue
+        if data_format == 'ndjson':
+            try:
+                yield json.loads(line), None
+            except json.JSONDecodeError as ex:
+                yield None, f'invalid json: {ex}'
+        elif header is None:
+            header = next(csv.reader([line]))
+        else:
+            values = next(csv.reader([line]))
+            if len(values) != len(header):
+                yield None, f'expected {len(header)} columns, got {len(values)}'
+            else:
+                yield dict(zip(header, values)), None
+
+
+class BulkImporter(object):
+    def __init__(self, entity: str, repository, search, availability=None, chunk_size: int = 1000,
+                 concurrency: int = 4, index: bool = True):
+        self._entity = entity
+        self._availability = availability
+        self._model = IMPORT_MODELS[entity]
+        insert_many, index_many = IMPORT_WRITERS[entity]
+        self._insert_many = getattr(repository, insert_many)
+        self._index_many = getattr(search, index_many)
+        self._index = index
+        self._chunk_size = chunk_size
+        self._slots = asyncio.Semaphore(concurrency)
+        self.report = ImportReport(entity)
+
+    async def _write_chunk(self, chunk: list):
+        try:
+            record_numbers = [record_number for record_number, _ in chunk]
+            documents = [document for _, document in chunk]
+            ids, errors = await self._insert_many(documents)
+            for position, error in errors.items():
+                self.report.fail(record_numbers[position], 'insert', error)
+
+            inserted = [(ids[i], documents[i]) for i in range(len(documents)) if ids[i] is not None]
+            self.report.inserted += len(inserted)
+            self._track(inserted)
+            if not self._index:
+                return
+            record_by_id = {ids[i]: record_numbers[i] for i in range(len(ids)) if ids[i] is not None}
+
+            indexed, errors = await self._index_many(inserted)
+            self.report.indexed += indexed
+            for document_id, error in errors.items():
+                self.report.fail(record_by_id.get(document_id, -1), 'index', error)
+        except Exception as ex:
+            for record_number, _ in chunk:
+                self.report.fail(record_number, 'write', str(ex))
+        finally:
+            self._slots.release()
+
+    def _track(self, inserted: list):
+        # imported rows are bookable and block their nights at once, as the single-write routes do,
+        # rather than once the availability stream catches up
+        if self._availability is None:
+            return
+        for document_id, document in inserted:
+            if self._entity == 'rooms':
+                self._availability.add_room(document_id)
+            elif self._entity == 'bookings':
+                self._availability.add_booking(document_id, document.room_id, document.start_dt, document.end_dt)
+
+    async def _submit(self, chunk: list, tasks: set):
+        await self._slots.acquire()
+        task = asyncio.create_task(self._write_chunk(chunk))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def run(self, lines, data_format: str) -> dict:
+        tasks = set()
+        chunk = []
+        async for record, error in parse_records(lines, data_format):
+            self.report.received += 1
+            record_number = self.report.received
+            if error is not None:
+                self.report.fail(record_number, 'parse', error)
+                continue
+            try:
+                chunk.append((record_number, self._model.model_validate(record)))
+            except ValidationError as ex:
+                self.report.fail(record_number, 'validate', '; '.join(
+                    f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in ex.errors()))
+                continue
+            if len(chunk) >= self._chunk_size:
+                await self._submit(chunk, tasks)
+                chunk = []
+        if chunk:
+            await self._submit(chunk, tasks)
+        if tasks:
+            await asyncio.gather(*tasks)
+        return self.report.to_dict()
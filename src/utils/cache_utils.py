@@ -1,17 +1,167 @@
 import json
+import zlib
+
+import orjson
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+from utils.log import get_logger
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+FLAG_STR = 1
+FLAG_JSON = 2
+FLAG_BINARY = 3
+
+# bump when the header layout or the model registry order changes; old entries then read as misses
+FORMAT_VERSION = 1
+COMPRESSED = 0x80
+
+# what a truncated, foreign or stale entry raises while decoding: bad zlib streams, codec decode
+# errors and pydantic ValidationError are all covered, the latter two being ValueError subclasses
+DECODE_ERRORS = (zlib.error, ValueError, TypeError)
+
+logger = get_logger('cache')
 
 
 class JsonSerializer(object):
     def serialize(self, key, value):
         if isinstance(value, str):
-            return value, 1
-        if type(value).__module__ != "__builtin__":
-            value = dict(value)
-        return json.dumps(value), 2
+            return value, FLAG_STR
+        if isinstance(value, BaseModel):
+            value = value.model_dump(mode='json')
+        return json.dumps(value), FLAG_JSON
 
     def deserialize(self, key, value, flags):
-        if flags == 1:
-            return value
-        if flags == 2:
+        if flags == FLAG_STR:
+            return value.decode() if isinstance(value, bytes) else value
+        if flags == FLAG_JSON:
             return json.loads(value)
         raise Exception("Unknown serialization format")
+
+
+class OrjsonCodec(object):
+    id = 1
+
+    @staticmethod
+    def dumps(value) -> bytes:
+        return orjson.dumps(value)
+
+    @staticmethod
+    def loads(data: bytes):
+        return orjson.loads(data)
+
+    @staticmethod
+    def dump_model(value: BaseModel) -> bytes:
+        return value.__pydantic_serializer__.to_json(value)
+
+    @staticmethod
+    def load_model(model: type, data: bytes) -> BaseModel:
+        return model.model_validate_json(data)
+
+
+class MsgpackCodec(object):
+    id = 2
+
+    @staticmethod
+    def dumps(value) -> bytes:
+        return msgpack.packb(value, default=str)
+
+    @staticmethod
+    def loads(data: bytes):
+        return msgpack.unpackb(data)
+
+    @staticmethod
+    def dump_model(value: BaseModel) -> bytes:
+        return msgpack.packb(value.model_dump(mode='json'))
+
+    @staticmethod
+    def load_model(model: type, data: bytes) -> BaseModel:
+        return model.model_validate(msgpack.unpackb(data))
+
+
+CODECS = {'orjson': OrjsonCodec, 'msgpack': MsgpackCodec}
+
+
+def to_json_bytes(value) -> bytes:
+    if isinstance(value, BaseModel):
+        return value.__pydantic_serializer__.to_json(value)
+    return to_json(value)
+
+
+# header: format version, codec id (high bit set when zlib compressed), model id (0 for plain values);
+# strings keep the raw text format so counters stay usable with memcached incr
+class BinarySerializer(object):
+    def __init__(self, models: list = (), codec: str = 'orjson', compress_threshold: int = 1024,
+                 compress_level: int = 1):
+        if codec not in CODECS:
+            raise ValueError(f'Unknown cache codec {codec}')
+        if codec == 'msgpack' and msgpack is None:
+            raise ValueError('Cache codec msgpack requires the msgpack package')
+        self._codec = CODECS[codec]
+        self._codecs = {OrjsonCodec.id: OrjsonCodec}
+        if msgpack is not None:
+            self._codecs[MsgpackCodec.id] = MsgpackCodec
+        self._models = list(models)
+        self._model_ids = {model: model_id for model_id, model in enumerate(self._models, start=1)}
+        self._compress_threshold = compress_threshold
+        self._compress_level = compress_level
+
+    def serialize(self, key, value):
+        if isinstance(value, str):
+            return value, FLAG_STR
+        model_id = self._model_ids.get(type(value), 0)
+        if model_id:
+            body = self._codec.dump_model(value)
+        else:
+            if isinstance(value, BaseModel):
+                value = value.model_dump(mode='json')
+            body = self._codec.dumps(value)
+
+        codec_id = self._codec.id
+        if self._compress_threshold and len(body) >= self._compress_threshold:
+            body = zlib.compress(body, self._compress_level)
+            codec_id |= COMPRESSED
+        return bytes((FORMAT_VERSION, codec_id, model_id)) + body, FLAG_BINARY
+
+    def json_body(self, value: bytes, flags: int) -> bytes | None:
+        if flags == FLAG_JSON:
+            return value
+        if flags != FLAG_BINARY or len(value) < 3 or value[0] != FORMAT_VERSION:
+            return None
+        if value[1] & ~COMPRESSED != OrjsonCodec.id:
+            return None
+        try:
+            return zlib.decompress(value[3:]) if value[1] & COMPRESSED else value[3:]
+        except zlib.error:
+            return None
+
+    def deserialize(self, key, value, flags):
+        # a corrupt entry reads as a miss so the caller reloads and overwrites it
+        try:
+            return self._deserialize(value, flags)
+        except DECODE_ERRORS as ex:
+            logger.warning('Discarding undecodable cache entry %s: %s', key, ex)
+            return None
+
+    def _deserialize(self, value, flags):
+        if flags == FLAG_STR:
+            return value.decode() if isinstance(value, bytes) else value
+        if flags == FLAG_JSON:
+            return json.loads(value)
+        if flags != FLAG_BINARY or len(value) < 3 or value[0] != FORMAT_VERSION:
+            return None
+
+        codec = self._codecs.get(value[1] & ~COMPRESSED)
+        if codec is None or value[2] > len(self._models):
+            return None
+        body = value[3:]
+        if value[1] & COMPRESSED:
+            body = zlib.decompress(body)
+        if value[2]:
+            return codec.load_model(self._models[value[2] - 1], body)
+        return codec.loads(body)
@@ -0,0 +1,22 @@
+from datetime import datetime, time, timedelta, timezone
+
+
+def parse_datetime(value) -> datetime:
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def booking_nights(start_dt, end_dt) -> list:
+    first_night = parse_datetime(start_dt).date()
+    nights = max((parse_datetime(end_dt).date() - first_night).days, 1)
+    return [first_night + timedelta(days=i) for i in range(nights)]
+
+
+def booking_span(start_dt, end_dt) -> tuple:
+    # rooms are held by the night, from midnight of the first night to midnight after the last one, which is
+    # the unit both the room nights ledger and the availability index work in
+    nights = booking_nights(start_dt, end_dt)
+    return datetime.combine(nights[0], time()), datetime.combine(nights[-1] + timedelta(days=1), time())
@@ -0,0 +1,85 @@
+class QueryBuilder(object):
+    def __init__(self):
+        self._must = []
+        self._filter = []
+        self._aggregations = {}
+
+    def match(self, field: str, value) -> 'QueryBuilder':
+        if value is not None:
+            self._must.append({"match": {field: value}})
+        return self
+
+    def multi_match(self, text: str | None, fields: list, match_type: str = 'best_fields') -> 'QueryBuilder':
+        if text:
+            self._must.append({"multi_match": {"query": text, "fields": fields, "type": match_type}})
+        return self
+
+    def term(self, field: str, value) -> 'QueryBuilder':
+        if value is not None:
+            self._filter.append({"term": {field: value}})
+        return self
+
+    def terms(self, field: str, values: list | None) -> 'QueryBuilder':
+        if values:
+            self._filter.append({"terms": {field: values}})
+        return self
+
+    def range(self, field: str, **bounds) -> 'QueryBuilder':
+        bounds = {operator: value for operator, value in bounds.items() if value is not None}
+        if bounds:
+            self._filter.append({"range": {field: bounds}})
+        return self
+
+    def geo_distance(self, field: str, lat: float, lon: float, distance_km: float) -> 'QueryBuilder':
+        self._filter.append({"geo_distance": {"distance": f"{distance_km}km", field: {"lat": lat, "lon": lon}}})
+        return self
+
+    def geo_bounding_box(self, field: str, top: float, left: float, bottom: float, right: float) -> 'QueryBuilder':
+        # a left edge east of the right edge is a box across the antimeridian
+        self._filter.append({"geo_bounding_box": {field: {"top_left": {"lat": top, "lon": left},
+                                                          "bottom_right": {"lat": bottom, "lon": right}}}})
+        return self
+
+    def facet(self, name: str, field: str, size: int = 10) -> 'QueryBuilder':
+        self._aggregations[name] = {"terms": {"field": field, "size": size}}
+        return self
+
+    def geo_grid(self, name: str, field: str, precision: int, size: int = 10000) -> 'QueryBuilder':
+        # the centroid places a cluster where its rooms are rather than in the middle of its cell
+        self._aggregations[name] = {"geohash_grid": {"field": field, "precision": precision, "size": size},
+                                    "aggregations": {"centroid": {"geo_centroid": {"field": field}}}}
+        return self
+
+    def build(self) -> dict:
+        if not self._must and not self._filter:
+            return {"match_all": {}}
+        query = {}
+        if self._must:
+            query["must"] = list(self._must)
+        if self._filter:
+            query["filter"] = list(self._filter)
+        return {"bool": query}
+
+    def build_aggregations(self) -> dict | None:
+        return dict(self._aggregations) or None
+
+    @staticmethod
+    def parse_facets(aggregations: dict | None) -> dict:
+        if not aggregations:
+            return {}
+        return {
+            name: [{"value": bucket["key"], "count": bucket["doc_count"]} for bucket in aggregation["buckets"]]
+            for name, aggregation in aggregations.items()
+        }
+
+    @staticmethod
+    def geo_distance_sort(field: str, lat: float, lon: float) -> list:
+        return [{"_geo_distance": {field: {"lat": lat, "lon": lon}, "order": "asc", "unit": "km"}}]
+
+    @staticmethod
+    def parse_geo_grid(aggregation: dict | None) -> list:
+        if not aggregation:
+            return []
+        return [{"geohash": bucket["key"], "count": bucket["doc_count"],
+                 "lat": bucket["centroid"]["location"]["lat"], "lon": bucket["centroid"]["location"]["lon"]}
+                for bucket in aggregation["buckets"]]
@@ -0,0 +1,80 @@
+import bisect
+
+
+class RoomIntervals(object):
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._ids = []
+        self._max_ends = []
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _rebuild_max_ends(self, position: int):
+        del self._max_ends[position:]
+        current = self._max_ends[-1] if self._max_ends else None
+        for end in self._ends[position:]:
+            current = end if current is None or end > current else current
+            self._max_ends.append(current)
+
+    def add(self, interval_id: str, start, end):
+        if interval_id in self._ids:
+            self.remove(interval_id)
+        position = bisect.bisect_right(self._starts, start)
+        self._starts.insert(position, start)
+        self._ends.insert(position, end)
+        self._ids.insert(position, interval_id)
+        self._rebuild_max_ends(position)
+
+    def remove(self, interval_id: str) -> bool:
+        if interval_id not in self._ids:
+            return False
+        position = self._ids.index(interval_id)
+        del self._starts[position]
+        del self._ends[position]
+        del self._ids[position]
+        self._rebuild_max_ends(position)
+        return True
+
+    def overlaps(self, start, end) -> bool:
+        # intervals starting before `end` overlap [start, end) iff one of them ends after `start`
+        candidates = bisect.bisect_left(self._starts, end)
+        return candidates > 0 and self._max_ends[candidates - 1] > start
+
+
+class IntervalIndex(object):
+    def __init__(self):
+        self._rooms = {}
+        self._interval_rooms = {}
+
+    def __len__(self):
+        return len(self._interval_rooms)
+
+    @property
+    def room_ids(self):
+        return self._rooms.keys()
+
+    def add_room(self, room_id: str):
+        self._rooms.setdefault(room_id, RoomIntervals())
+
+    def add(self, room_id: str, interval_id: str, start, end):
+        previous_room_id = self._interval_rooms.get(interval_id)
+        if previous_room_id is not None and previous_room_id != room_id:
+            self._rooms[previous_room_id].remove(interval_id)
+        self._rooms.setdefault(room_id, RoomIntervals()).add(interval_id, start, end)
+        self._interval_rooms[interval_id] = room_id
+
+    def remove(self, interval_id: str) -> bool:
+        room_id = self._interval_rooms.pop(interval_id, None)
+        if room_id is None:
+            return False
+        return self._rooms[room_id].remove(interval_id)
+
+    def is_free(self, room_id: str, start, end) -> bool:
+        intervals = self._rooms.get(room_id)
+        return intervals is None or not intervals.overlaps(start, end)
+
+    def free_rooms(self, start, end, room_ids=None) -> list:
+        room_ids = self._rooms.keys() if room_ids is None else room_ids
+        return [room_id for room_id in room_ids if self.is_free(room_id, start, end)]
@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+
+
+class LocalCache(object):
+    def __init__(self, max_bytes: int, default_ttl: float):
+        self._max_bytes = max_bytes
+        self._default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value, size: int, ttl: float | None = None):
+        if size > self._max_bytes:
+            self.delete(key)
+            return
+        # the default ttl also bounds how stale a worker that missed an invalidation can serve an entry
+        ttl = self._default_ttl if not ttl else min(ttl, self._default_ttl)
+        self._remove(key)
+        self._entries[key] = (value, time.monotonic() + ttl, size)
+        self._size += size
+        while self._size > self._max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def ttl_remaining(self, key: str) -> float:
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0.0
+        return max(entry[1] - time.monotonic(), 0.0)
+
+    def delete(self, key: str):
+        self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'entries': len(self._entries),
+            'size_bytes': self._size,
+            'max_bytes': self._max_bytes,
+        }
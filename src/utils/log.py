@@ -0,0 +1,96 @@
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+
+ROOT_LOGGER = 'airbnb'
+RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class DeferredQueueHandler(QueueHandler):
+    # records are formatted by the listener thread, the event loop only enqueues them
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate: int, interval: float):
+        super().__init__()
+        self._rate = rate
+        self._interval = interval
+        self._windows = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self._rate <= 0 or record.levelno >= logging.ERROR:
+            return True
+        # keyed by the message template so one noisy call site cannot hide the others
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self._interval:
+            suppressed = 0 if window is None else window[2]
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if window[1] < self._rate:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RECORD_FIELDS})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+listener: QueueListener = None
+
+
+def configure_logging(level: str = 'INFO', log_format: str = 'json', rate: int = 10, interval: float = 1.0):
+    global listener
+    if listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if log_format == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate, interval))
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level.upper())
+    logger.handlers = [queue_handler]
+    logger.propagate = False
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+
+
+def stop_logging():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
@@ -0,0 +1,168 @@
+import bisect
+import functools
+import inspect
+import math
+import time
+
+from utils.tracing import record_span
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    labels = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Histogram(object):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, *label_values, value: float):
+        counts = self._values.get(label_values)
+        if counts is None:
+            # one slot per bucket plus the +Inf overflow, then sum
+            counts = self._values[label_values] = [0] * (len(self._buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        for label_values, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self._buckets + (math.inf,), counts):
+                cumulative += count
+                yield (f'{self.name}_bucket', format_labels(self.labels, label_values, f'le="{format_value(bound)}"'),
+                       cumulative)
+            yield f'{self.name}_sum', format_labels(self.labels, label_values), counts[-1]
+            yield f'{self.name}_count', format_labels(self.labels, label_values), cumulative
+
+
+class CollectedMetric(object):
+    # values are read from `collect` at scrape time so hot paths keep their own plain counters
+    def __init__(self, name: str, documentation: str, type: str, labels: tuple, collect):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.labels = labels
+        self._collect = collect
+
+    def samples(self):
+        for label_values, value in self._collect():
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self._metrics.get(name) or self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.get(name) or self.register(Histogram(name, documentation, labels, buckets))
+
+    def collected(self, name: str, documentation: str, type: str, labels: tuple, collect) -> CollectedMetric:
+        return self.register(CollectedMetric(name, documentation, type, labels, collect))
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {format_value(value)}')
+        return ('\n'.join(lines) + '\n').encode()
+
+
+registry = Registry()
+
+backend_latency = registry.histogram('backend_request_duration_seconds', 'Latency of backend calls',
+                                     ('backend', 'operation'))
+backend_errors = registry.counter('backend_errors_total', 'Backend calls that raised', ('backend', 'operation'))
+memcached_keys = registry.counter('memcached_keys_total', 'Keys looked up in memcached', ('result',))
+http_requests = registry.counter('http_requests_total', 'Handled HTTP requests', ('method', 'route', 'status'))
+http_latency = registry.histogram('http_request_duration_seconds', 'Latency of HTTP requests', ('method', 'route'))
+http_shed = registry.counter('http_requests_shed_total', 'Requests refused by admission control', ('method',))
+
+
+def instrument_call(backend: str, operation: str, fn, on_result=None):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            result = await fn(*args, **kwargs)
+            if on_result is not None:
+                on_result(args, kwargs, result)
+            return result
+        except Exception as ex:
+            error = ex
+            backend_errors.inc(backend, operation)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            backend_latency.observe(backend, operation, value=duration)
+            record_span(f'{backend}.{operation}', started, duration, error)
+    return wrapper
+
+
+def instrument(target, backend: str, operations=None, hooks: dict = None):
+    # replaces the public coroutine methods of one instance, async generators are left as they are
+    hooks = hooks or {}
+    for name, method in inspect.getmembers(target, inspect.iscoroutinefunction):
+        if name.startswith('_') or (operations is not None and name not in operations):
+            continue
+        setattr(target, name, instrument_call(backend, name, method, hooks.get(name)))
+    return target
+
+
+def count_memcached_keys(args, kwargs, result: dict):
+    keys = set(args[0] if args else kwargs['keys'])
+    memcached_keys.inc('hit', amount=len(result))
+    memcached_keys.inc('miss', amount=len(keys) - len(result))
+
+
+def instrument_memcached(client):
+    return instrument(client, 'memcached', operations=('get_many_raw', 'set_many', 'set', 'add', 'incr', 'delete'),
+                      hooks={'get_many_raw': count_memcached_keys})
@@ -1,9 +1,21 @@
 from bson import ObjectId
+from pymongo.read_preferences import Primary, make_read_preference, read_pref_mode_from_name
 
 
 def filter_by_id(id: str) -> dict:
     return {'_id': ObjectId(id)}
 
 
+def filter_by_ids(ids: list) -> dict:
+    return {'_id': {'$in': [ObjectId(id) for id in ids]}}
+
+
 def filter_by_name(name: str) -> dict:
     return {'name': name}
+
+
+def read_preference(name: str, max_staleness_seconds: int):
+    # max staleness only applies to modes that may read from a secondary
+    if name == 'primary':
+        return Primary()
+    return make_read_preference(read_pref_mode_from_name(name), None, max_staleness_seconds)
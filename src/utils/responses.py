@@ -0,0 +1,34 @@
+import hashlib
+
+from pydantic_core import to_json
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+
+class FastJSONResponse(JSONResponse):
+    # models, datetimes and containers are encoded in one pass by pydantic-core, bytes are already encoded JSON
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return to_json(content)
+
+
+def make_etag(body: bytes) -> str:
+    # entities carry no version field, a digest of the serialized entity changes exactly when one of its fields does
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+def conditional_json_response(request: Request, content, cache_control: str) -> Response:
+    body = content if isinstance(content, bytes) else to_json(content)
+    headers = {'etag': make_etag(body), 'cache-control': cache_control}
+    if etag_matches(request.headers.get('if-none-match'), headers['etag']):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(body, headers=headers)
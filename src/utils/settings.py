@@ -0,0 +1,124 @@
+import os
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+
+READ_PREFERENCES = ('primary', 'primaryPreferred', 'secondary', 'secondaryPreferred', 'nearest')
+
+
+class Settings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    mongo_uri: str
+    mongo_db: str
+    mongo_clients_collection: str
+    mongo_rooms_collection: str
+    mongo_bookings_collection: str
+    mongo_room_nights_collection: str = 'room_nights'
+    mongo_check_query_plans: bool = False
+    mongo_read_preference: str = 'primary'
+    mongo_max_staleness_seconds: int = 90
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 10
+    mongo_max_idle_time_ms: int = 300000
+    mongo_wait_queue_timeout_ms: int = 1000
+    mongo_connect_timeout_ms: int = 5000
+    mongo_server_selection_timeout_ms: int = 5000
+    mongo_timeout_ms: int = 10000
+    mongo_retry_reads: bool = True
+    mongo_retry_writes: bool = True
+
+    elasticsearch_uri: str
+    elasticsearch_index_client: str
+    elasticsearch_index_room: str
+    elasticsearch_index_booking: str
+    elasticsearch_shards: int = 1
+    elasticsearch_replicas: int = 1
+    elasticsearch_refresh_interval: str = '1s'
+    elasticsearch_connections_per_node: int = 10
+    elasticsearch_sniff_on_start: bool = False
+    elasticsearch_sniff_on_node_failure: bool = False
+    elasticsearch_sniff_interval: float = 60.0
+    elasticsearch_search_timeout: float = 2.0
+    elasticsearch_search_retries: int = 2
+    elasticsearch_write_timeout: float = 10.0
+    elasticsearch_write_retries: int = 3
+
+    memcached_clients_uri: str
+    memcached_rooms_uri: str
+    memcached_bookings_uri: str
+    memcached_clients_expire: int = 0
+    memcached_rooms_expire: int = 0
+    memcached_bookings_expire: int = 0
+    memcached_pool_size: int = 10
+    memcached_timeout: float = 1.0
+
+    cache_l1_max_bytes: int = 16 * 1024 * 1024
+    cache_l1_ttl: float = 30.0
+    cache_peers: list[str] = []
+    cache_early_refresh_beta: float = 1.0
+    cache_codec: str = 'orjson'
+    cache_compress_threshold: int = 1024
+
+    search_cache_max_bytes: int = 32 * 1024 * 1024
+    search_cache_expire: int = 30
+    search_cache_generation_ttl: float = 0.0
+    search_cache_rebump_delay: float = 1.5
+
+    search_indexer_enabled: bool = False
+    search_indexer_batch_size: int = 500
+    search_indexer_flush_interval: float = 0.5
+    search_indexer_state_collection: str = 'search_indexer_state'
+
+    metrics_enabled: bool = True
+    trace_sample_rate: float = 0.0
+    trace_buffer_size: int = 100
+
+    server_host: str = '0.0.0.0'
+    server_port: int = 8000
+    server_workers: int = 1
+    server_loop: str = 'uvloop'
+    server_http: str = 'httptools'
+    server_backlog: int = 2048
+    server_keep_alive_timeout: int = 5
+    server_graceful_shutdown_timeout: int = 30
+
+    http_cache_max_age: int = 5
+    http_cache_stale_while_revalidate: int = 30
+
+    admission_max_concurrency: int = 256
+    admission_exempt_paths: list[str] = ['/metrics', '/airbnb/internal/']
+
+    log_level: str = 'INFO'
+    log_format: str = 'json'
+    log_rate_limit: int = 10
+    log_rate_interval: float = 1.0
+
+    @field_validator('mongo_read_preference')
+    @classmethod
+    def check_read_preference(cls, value):
+        if value not in READ_PREFERENCES:
+            raise ValueError(f'read preference must be one of {", ".join(READ_PREFERENCES)}')
+        return value
+
+    @field_validator('cache_peers', 'admission_exempt_paths', mode='before')
+    @classmethod
+    def split_list(cls, value):
+        if isinstance(value, str):
+            return [peer.strip() for peer in value.split(',') if peer.strip()]
+        return value
+
+    @classmethod
+    def from_env(cls):
+        return cls.model_validate({name: os.environ[name.upper()] for name in cls.model_fields
+                                   if name.upper() in os.environ})
+
+
+settings: Settings = None
+
+
+def get_settings() -> Settings:
+    global settings
+    if settings is None:
+        settings = Settings.from_env()
+    return settings
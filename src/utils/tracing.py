@@ -0,0 +1,77 @@
+import contextvars
+import random
+import time
+import uuid
+from collections import deque
+
+
+class Trace(object):
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.spans = []
+
+    def add_span(self, name: str, started: float, duration: float, error: Exception | None = None):
+        self.spans.append((name, started - self.started, duration, None if error is None else repr(error)))
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'route': self.route,
+            'status': self.status,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3),
+            'spans': [{'name': name, 'offset_ms': round(offset * 1000, 3), 'duration_ms': round(duration * 1000, 3),
+                       'error': error}
+                      for name, offset, duration, error in self.spans],
+        }
+
+
+class Tracer(object):
+    def __init__(self, sample_rate: float = 0.0, buffer_size: int = 100):
+        self.sample_rate = sample_rate
+        self._traces = deque(maxlen=buffer_size)
+
+    def start(self, method: str, path: str) -> Trace | None:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return Trace(method, path)
+
+    def finish(self, trace: Trace, route: str, status: int, duration: float):
+        trace.route = route
+        trace.status = status
+        trace.duration = duration
+        self._traces.append(trace)
+
+    def recent(self, limit: int) -> list:
+        # [-0:] would be the whole buffer
+        if limit <= 0:
+            return []
+        return [trace.to_dict() for trace in list(self._traces)[-limit:]]
+
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+tracer = Tracer()
+
+
+def configure_tracing(sample_rate: float, buffer_size: int):
+    global tracer
+    tracer = Tracer(sample_rate, buffer_size)
+
+
+def get_tracer() -> Tracer:
+    return tracer
+
+
+def record_span(name: str, started: float, duration: float, error: Exception | None = None):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(name, started, duration, error)